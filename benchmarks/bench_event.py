@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+bench_event.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+
+Micro-benchmarks for the rcorelib.event codec.
+
+Usage: bench_event.py [-o results.json] [--quick] [-k filter]
+
+Results are written as JSON, one entry per (case, operation), so runs
+from different commits can be compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'rcorelib'))
+
+import rcorelib.event as revent
+
+FIELD_COUNTS = [1, 4, 16, 64]
+VAR_SIZES = [16, 256, 4096, 65536, 1048576, 8388608]
+QUICK_VAR_SIZES = [16, 4096, 1048576]
+
+SAMPLE_VALUES = {
+    revent.MSG_DATA_TYPE_BYTE: 7,
+    revent.MSG_DATA_TYPE_INT: 123456,
+    revent.MSG_DATA_TYPE_LONG: -123456,
+    revent.MSG_DATA_TYPE_FLOAT: 1.5,
+    revent.MSG_DATA_TYPE_DOUBLE: 3.25,
+    revent.MSG_DATA_TYPE_STRING: 'status',
+    revent.MSG_DATA_TYPE_BYTEA: bytearray('raw'),
+    revent.MSG_DATA_TYPE_JSON: {'key': 'value', 'n': [1, 2, 3]}
+}
+
+TYPE_NAMES = {
+    revent.MSG_DATA_TYPE_BYTE: 'byte',
+    revent.MSG_DATA_TYPE_INT: 'int',
+    revent.MSG_DATA_TYPE_LONG: 'long',
+    revent.MSG_DATA_TYPE_FLOAT: 'float',
+    revent.MSG_DATA_TYPE_DOUBLE: 'double',
+    revent.MSG_DATA_TYPE_STRING: 'string',
+    revent.MSG_DATA_TYPE_BYTEA: 'bytea',
+    revent.MSG_DATA_TYPE_JSON: 'json',
+    revent.MSG_DATA_TYPE_NDARRAY: 'ndarray'
+}
+
+MIXED_SCHEMA = [
+    revent.MSG_DATA_TYPE_INT,
+    revent.MSG_DATA_TYPE_DOUBLE,
+    revent.MSG_DATA_TYPE_DOUBLE,
+    revent.MSG_DATA_TYPE_STRING,
+    revent.MSG_DATA_TYPE_BYTE,
+    revent.MSG_DATA_TYPE_FLOAT,
+    revent.MSG_DATA_TYPE_JSON,
+    revent.MSG_DATA_TYPE_LONG,
+    revent.MSG_DATA_TYPE_BYTEA
+]
+
+
+def make_case(name, dataTypes, values, params, options=None):
+    eventType = revent.RCoreEventType(name, list(dataTypes), id=100,
+                                      options=options)
+    return {'name': name,
+            'eventType': eventType,
+            'values': values,
+            'params': params}
+
+
+def build_cases(quick):
+    '''return the list of benchmark cases'''
+    cases = []
+
+    # single field of each type
+    for dtype in sorted(SAMPLE_VALUES.keys()):
+        cases.append(make_case('single_%s' % (TYPE_NAMES[dtype]),
+                               [dtype], [SAMPLE_VALUES[dtype]],
+                               {'dtype': TYPE_NAMES[dtype], 'fields': 1}))
+
+    # fixed size fields of each type, varying field count
+    for dtype in sorted(revent.MSG_DATA_TYPE_STRUCT.keys()):
+        for count in FIELD_COUNTS:
+            cases.append(make_case(
+                'fixed_%s_x%d' % (TYPE_NAMES[dtype], count),
+                [dtype] * count, [SAMPLE_VALUES[dtype]] * count,
+                {'dtype': TYPE_NAMES[dtype], 'fields': count}))
+
+    # mixed schema, repeated to vary field count
+    for repeat in [1, 4]:
+        dataTypes = MIXED_SCHEMA * repeat
+        cases.append(make_case(
+            'mixed_x%d' % (len(dataTypes)), dataTypes,
+            [SAMPLE_VALUES[dtype] for dtype in dataTypes],
+            {'dtype': 'mixed', 'fields': len(dataTypes)}))
+
+    # variable length payload sizes, both as last field and length prefixed
+    for size in (QUICK_VAR_SIZES if quick else VAR_SIZES):
+        payload = bytearray(os.urandom(size))
+        for dtype in [revent.MSG_DATA_TYPE_BYTEA, revent.MSG_DATA_TYPE_STRING]:
+            value = payload if dtype == revent.MSG_DATA_TYPE_BYTEA \
+                else 'x' * size
+            cases.append(make_case(
+                'var_%s_%d' % (TYPE_NAMES[dtype], size),
+                [revent.MSG_DATA_TYPE_INT, dtype], [1, value],
+                {'dtype': TYPE_NAMES[dtype], 'fields': 2, 'size': size}))
+        cases.append(make_case(
+            'var_bytea_prefixed_%d' % (size),
+            [revent.MSG_DATA_TYPE_BYTEA, revent.MSG_DATA_TYPE_INT],
+            [payload, 1],
+            {'dtype': 'bytea', 'fields': 2, 'size': size}))
+
+        # compressible text, as for json diagnostics
+        text = bytearray(('telemetry %d ok; ' * (size // 16 + 1) %
+                          tuple(range(size // 16 + 1)))[:size])
+        cases.append(make_case(
+            'var_bytea_zlib_%d' % (size),
+            [revent.MSG_DATA_TYPE_INT, revent.MSG_DATA_TYPE_BYTEA],
+            [1, text],
+            {'dtype': 'bytea', 'fields': 2, 'size': size,
+             'compression': 'zlib'},
+            options={'compression': {'codec': 'zlib'}}))
+
+        if revent.numpy is not None:
+            array = revent.numpy.frombuffer(bytes(payload), dtype='u1')
+            cases.append(make_case(
+                'var_ndarray_%d' % (size),
+                [revent.MSG_DATA_TYPE_INT, revent.MSG_DATA_TYPE_NDARRAY],
+                [1, array],
+                {'dtype': 'ndarray', 'fields': 2, 'size': size}))
+
+    return cases
+
+
+def build_operations(case):
+    '''return a dict of operation name to a no argument callable'''
+    eventType = case['eventType']
+    values = case['values']
+
+    def op_build():
+        builder = revent.RCoreEventBuilder(eventType)
+        for value in values:
+            builder.add(value)
+        return builder.build()
+
+    def op_encode():
+        return eventType.encode(*values)
+
+    evt = op_encode()
+    frames = [memoryview(frame).tobytes()
+              for frame in evt.serialize_frames()]
+    data = frames[0]
+
+    def op_serialize():
+        evt.serialized = None
+        return evt.serialize()
+
+    def op_from_data():
+        return revent.RCoreEvent.from_data(data, lambda id: eventType)
+
+    def op_from_frames():
+        return revent.RCoreEvent.from_frames(frames, lambda id: eventType)
+
+    received = revent.RCoreEvent.from_frames(frames, lambda id: eventType)[0]
+
+    def op_read():
+        reader = received.reader()
+        for i in range(eventType.count):
+            reader.read()
+
+    def op_decode():
+        # RCoreEvent.decode caches its values, time the codec itself
+        return eventType.decode(received.data, buffers=received.buffers)
+
+    def op_get_last():
+        # a fresh event each call, lazy access caches offsets and values
+        evt = revent.RCoreEvent(eventType, received.data, received.buffers)
+        return evt[eventType.count - 1]
+
+    operations = {
+        'build': op_build,
+        'encode': op_encode,
+        'serialize': op_serialize,
+        'from_frames': op_from_frames,
+        'read': op_read,
+        'decode': op_decode,
+        'get_last': op_get_last
+    }
+
+    if not eventType.bufferCount:
+        operations['from_data'] = op_from_data
+
+    return operations, len(data) + sum(len(frame) for frame in frames[1:])
+
+
+def time_operation(func, min_time, repeat):
+    '''return the best time per call in seconds'''
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1000000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    return min(timer.repeat(repeat, number)) / number, number
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = []
+    for case in build_cases(args.quick):
+        operations, size = build_operations(case)
+        for opname in sorted(operations.keys()):
+            name = '%s.%s' % (case['name'], opname)
+            if args.filter and args.filter not in name:
+                continue
+
+            best, number = time_operation(operations[opname],
+                                          args.min_time, args.repeat)
+            result = {'name': name,
+                      'case': case['name'],
+                      'operation': opname,
+                      'params': case['params'],
+                      'bytes': size,
+                      'number': number,
+                      'seconds': best,
+                      'ops_per_sec': 1.0 / best if best > 0 else None}
+            results.append(result)
+
+            sys.stderr.write('%-48s %12.3f us %12.1f MB/s\n' %
+                             (name, best * 1e6, size / best / 1e6))
+
+    return {'revision': git_revision(),
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='rcorelib.event codec micro-benchmarks')
+    parser.add_argument('-o', '--output',
+                        help='write JSON results to file, default stdout')
+    parser.add_argument('-k', '--filter',
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--quick', action='store_true',
+                        help='fewer payload sizes and shorter runs')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timing repeats, best is reported')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum seconds per timing repeat')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.repeat = min(args.repeat, 3)
+        args.min_time = min(args.min_time, 0.05)
+
+    report = run(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == "__main__":
+    main()
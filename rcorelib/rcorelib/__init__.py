@@ -25,39 +25,245 @@ import zmq
 import threading
 import traceback
 import event
+import dispatch
+import mgt
+import os
+import shm
+import stats
 import struct
+import time
 # import json
 
 PORT_MGT = 12210
 PORT_PUBSUB = 12211
+PORT_DATA = 12212
+PORT_PUBSUB_HIGH = 12213
+PORT_DATA_HIGH = 12214
+
+# publish and data ports of each priority class
+PUBSUB_PORTS = {event.PRIORITY_NORMAL: PORT_PUBSUB,
+                event.PRIORITY_HIGH: PORT_PUBSUB_HIGH}
+DATA_PORTS = {event.PRIORITY_NORMAL: PORT_DATA,
+              event.PRIORITY_HIGH: PORT_DATA_HIGH}
+
+LISTENER_POLL_TIMEOUT = 100
+LISTENER_TYPES_TIMEOUT = 5.0  # seconds before the listener fetches again
+
+TRANSPORT_TCP = 'tcp'
+TRANSPORT_IPC = 'ipc'  # unix sockets, for clients on the master's host
+TRANSPORT_INPROC = 'inproc'  # for clients sharing the master's zmq.Context
+
+IPC_PATH = '/tmp/rcore-%d'
+
+
+def endpoint(transport, server, port):
+    '''return the endpoint of a master port, server is only used by tcp'''
+    if transport == TRANSPORT_TCP:
+        return "tcp://%s:%d" % (server, port)
+    elif transport == TRANSPORT_IPC:
+        return "ipc://%s" % (IPC_PATH % (port))
+    elif transport == TRANSPORT_INPROC:
+        return "inproc://rcore-%d" % (port)
+    else:
+        raise Exception("Unknown transport %s" % (transport))
 
 
 class RCoreClient(object):
-    '''RobotCore Client'''
-    def __init__(self, server, name, ctx=None):
+    '''RobotCore Client
+
+    Listeners are called on the receiving thread unless a
+    dispatch.RCoreDispatcher is given, which calls them from its own
+    thread pool. With a dispatcher, a listener can also have its own queue,
+    see register_listener.
+
+    With prefetch the event type catalog is fetched from the master on
+    connect. With registryPath the catalog is also kept on disk, so later
+    runs only fetch the types registered since.
+
+    transport selects how to reach the master: TRANSPORT_TCP, TRANSPORT_IPC
+    for a master on the same host, or TRANSPORT_INPROC for a master in the
+    same process, which also requires passing the master's ctx.
+
+    With subscriptionHints the master tells the client which event types
+    have subscribers, and send skips events nobody would receive. Use
+    has_subscribers to also skip building them.
+
+    Events of types with the header option are stamped with this client's
+    publisher id and a sequence number per type when sent, and their
+    latency and gaps are tracked per listener, see read_listener_stats.
+
+    Each priority class has its own subscription and data sockets, so
+    high priority events never queue behind normal ones, and the listener
+    thread handles pending high priority events before each normal one.
+    sockSub and sockData are the normal priority sockets.
+
+    The listener thread never waits on the master. An event of a type it
+    doesn't know yet is dropped, counted in dropped, and the new event
+    types are fetched in the background.
+    '''
+    def __init__(self, server, name, ctx=None, dispatcher=None,
+                 prefetch=True, registryPath=None, transport=TRANSPORT_TCP,
+                 subscriptionHints=True):
+        self.name = name
         self.ctx = ctx
         self.termContext = False
         if self.ctx is None:
             self.ctx = zmq.Context()
             self.termContext = True
 
-        self.sockMgt = self.ctx.socket(zmq.REQ)
-        self.sockMgt.connect("tcp://%s:%d" % (server, PORT_MGT))
-
-        self.sockSub = self.ctx.socket(zmq.SUB)
-        self.sockSub.connect("tcp://%s:%d" % (server, PORT_PUBSUB))
+        if transport == TRANSPORT_INPROC and self.termContext:
+            raise Exception("inproc transport requires the master's context")
+
+        self.mgt = mgt.RCoreMgtChannel(self.ctx,
+                                       endpoint(transport, server, PORT_MGT))
+
+        self.sockSubs = {}
+        self.sockDatas = {}
+        for priority in event.PRIORITIES:
+            self.sockSubs[priority] = self.ctx.socket(zmq.SUB)
+            self.sockSubs[priority].connect(
+                endpoint(transport, server, PUBSUB_PORTS[priority]))
+            self.sockDatas[priority] = self.ctx.socket(zmq.PUSH)
+            self.sockDatas[priority].connect(
+                endpoint(transport, server, DATA_PORTS[priority]))
+        self.sockSub = self.sockSubs[event.PRIORITY_NORMAL]
+        self.sockData = self.sockDatas[event.PRIORITY_NORMAL]
+
+        self.publisherId = struct.unpack('>I', os.urandom(4))[0]
+        self.sequences = {}
+
+        # subscribed event types, None until the master says otherwise
+        self.subscribedTypes = None
+        self.subscriberCounts = {}
+        self.skipped = 0
+        self.sockHints = None
+        if subscriptionHints:
+            self.sockHints = self.ctx.socket(zmq.SUB)
+            self.sockHints.connect(endpoint(transport, server, PORT_PUBSUB))
+            self.sockHints.setsockopt(
+                zmq.SUBSCRIBE,
+                struct.pack('>h', event.EVT_TYPE_MGT_SUBSCRIPTIONS.id))
 
         self.typesByName = {}
         self.typesById = {}
+        self.catalogEntries = {}
+        self.registryId = None
+        self.typesVersion = 0
+        self.registryPath = registryPath
 
         for eventType in event.EVT_TYPE_MGT_TYPES:
             self.typesByName[eventType.name] = eventType
             self.typesById[eventType.id] = eventType
 
         self.listeners = {}
+        self.queuedListeners = {}
+        self.receiveStats = {}
+        self.listenerStats = {}
+        self.dispatcher = dispatcher
+        self.shmRings = []
+        self.running = False
+        self.t = None
+
+        # catalog fetch started by the listener thread, see
+        # request_event_types
+        self.typesFuture = None
+        self.typesRequested = None
+        self.dropped = 0
+
+        if self.registryPath is not None:
+            self.load_registry(self.registryPath)
+        if prefetch:
+            self.get_event_types()
 
     def get_event_types(self):
-        pass  # list event types via management interface
+        '''fetch event types registered since the last call from the master
+
+        Returns all known event types, excluding MGT types.
+        '''
+        evt = event.RCoreEventBuilder(event.EVT_TYPE_MGT_LIST_EVENT_TYPES) \
+            .add(self.typesVersion).build()
+        catalog = self.call_mgt_command(evt).reader().read()
+        if not self.receive_catalog(catalog):
+            return self.get_event_types()
+
+        return [eventType for eventType in self.typesById.values()
+                if eventType.id >= event.EVT_TYPE_FIRST_ID]
+
+    def receive_catalog(self, catalog):
+        '''apply a list_event_types response, false if it must be fetched
+        again from version 0'''
+        if catalog['registry'] != self.registryId and not catalog['full']:
+            # a different master registry, our version means nothing to it
+            self.typesVersion = 0
+            return False
+
+        self.apply_catalog(catalog)
+        if self.registryPath is not None:
+            self.save_registry(self.registryPath)
+        return True
+
+    def request_event_types(self):
+        '''start fetching new event types without waiting for them
+
+        At most one fetch is in flight, unless it has been pending for
+        LISTENER_TYPES_TIMEOUT. See check_event_types.
+        '''
+        if self.typesFuture is not None:
+            if time.time() - self.typesRequested < LISTENER_TYPES_TIMEOUT:
+                return
+            self.mgt.cancel(self.typesFuture)
+
+        evt = event.RCoreEventBuilder(event.EVT_TYPE_MGT_LIST_EVENT_TYPES) \
+            .add(self.typesVersion).build()
+        self.typesFuture = self.call_mgt_command_async(evt)
+        self.typesRequested = time.time()
+
+    def check_event_types(self):
+        '''apply the event types fetched by request_event_types, if they
+        have arrived'''
+        future = self.typesFuture
+        if future is None or not future.done():
+            return
+
+        self.typesFuture = None
+        try:
+            catalog = self.wait_mgt_command(future, 0).reader().read()
+            if not self.receive_catalog(catalog):
+                self.request_event_types()
+        except Exception:
+            traceback.print_exc()
+
+    def get_event_type_by_id(self, eventTypeId):
+        '''return the event type for an id, fetching new event types from
+        the master if it is unknown, None if the master doesn't know it'''
+        eventType = self.typesById.get(eventTypeId)
+        if eventType is None:
+            self.get_event_types()
+            eventType = self.typesById.get(eventTypeId)
+        return eventType
+
+    def apply_catalog(self, catalog):
+        if catalog['full']:
+            self.catalogEntries = {}
+        for entry in catalog['types']:
+            self.catalogEntries[entry['id']] = entry
+
+        event.update_event_types(self.typesByName, self.typesById, catalog)
+        self.registryId = catalog['registry']
+        self.typesVersion = catalog['version']
+
+    def save_registry(self, path):
+        '''write the known event types to path'''
+        event.save_registry(path, {'registry': self.registryId,
+                                   'version': self.typesVersion,
+                                   'full': True,
+                                   'types': self.catalogEntries.values()})
+
+    def load_registry(self, path):
+        '''load event types written by save_registry'''
+        catalog = event.load_registry(path)
+        if catalog is not None:
+            self.apply_catalog(catalog)
 
     def read_event_type(self, name):
         if name in self.typesByName:
@@ -71,89 +277,366 @@ class RCoreClient(object):
             respid = respreader.read()
             respname = respreader.read()
             respDataTypes = [i for i in respreader.read()]
+            respOptions = respreader.read()
 
             if respid >= 0:
                 eventType = event.RCoreEventType(respname,
                                                  respDataTypes,
-                                                 id=respid)
+                                                 id=respid,
+                                                 options=respOptions)
                 self.typesByName[name] = eventType
                 self.typesById[respid] = eventType
                 return eventType
             else:
                 return None
 
-    def register_event_type(self, eventType):
-        evt = event.RCoreEventBuilder(event.EVT_TYPE_MGT_REGISTER_EVENT_TYPE) \
-                    .add(eventType.name).add(eventType.dataTypes).build()
-
+    def register_event_type(self, eventType, timeout=mgt.MGT_TIMEOUT):
+        return self.register_event_types([eventType], timeout)[0]
+
+    def register_event_types(self, eventTypes, timeout=mgt.MGT_TIMEOUT):
+        '''register several event types, with all requests in flight at once
+        '''
+        futures = []
+        for eventType in eventTypes:
+            evt = event.RCoreEventBuilder(
+                event.EVT_TYPE_MGT_REGISTER_EVENT_TYPE) \
+                .add(eventType.name).add(eventType.dataTypes) \
+                .add(eventType.options).build()
+            futures.append(self.call_mgt_command_async(evt))
+
+        for eventType, future in zip(eventTypes, futures):
+            respid = self.wait_mgt_command(future, timeout).reader().read()
+            if respid >= 0:
+                eventType.id = respid
+                self.typesByName[eventType.name] = eventType
+                self.typesById[respid] = eventType
+            else:
+                raise Exception("Error registering event type %s" %
+                                (eventType.name))
+        return eventTypes
+
+    def create_shm_ring(self, eventType, size=shm.SHM_DEFAULT_SIZE):
+        '''create the shared memory ring for shm fields of eventType
+
+        Must be called before sending events with shm fields. Subscribers
+        must be on the same host to read them.
+        '''
+        eventType.shmRing = shm.RCoreShmRing(shm.ring_name(eventType.name),
+                                             size)
+        self.shmRings.append(eventType.shmRing)
+        return eventType.shmRing
+
+    def read_stats(self):
+        '''return the master routing stats, see RCoreMaster.read_stats'''
+        evt = event.RCoreEventBuilder(event.EVT_TYPE_MGT_READ_STATS).build()
         respevt = self.call_mgt_command(evt)
+        return respevt.reader().read()
 
-        respreader = respevt.reader()
-        respid = respreader.read()
-        if respid >= 0:
-            eventType.id = respid
-            self.typesByName[eventType.name] = eventType
-            self.typesById[respid] = eventType
-            return eventType
-        else:
-            raise Exception("Error registering event type %s" %
-                            (eventType.name))
+    def read_cache(self, eventTypeNames=None):
+        '''return the events cached by the master, of eventTypeNames or all
+
+        Only event types with the cache option are cached, see
+        event.RCoreEventTypeBuilder.with_cache.
+        '''
+        evt = event.RCoreEventBuilder(event.EVT_TYPE_MGT_READ_CACHE) \
+            .add(eventTypeNames).build()
+        respevt = self.call_mgt_command(evt)
 
-    def call_mgt_command(self, evt):
-        data = evt.serialize()
-        self.sockMgt.send(data)
-        resp = self.sockMgt.recv()
+        events = []
+        for frames in event.unpack_messages(respevt.reader().read()):
+            events.extend(evt for evt in event.RCoreEvent.from_frames(
+                frames, self.get_event_type_by_id)
+                if evt.eventType is not None)
+        return events
+
+    def call_mgt_command(self, evt, timeout=mgt.MGT_TIMEOUT):
+        '''send a management command and wait for its response event
+
+        Safe to call from any thread, calls from several threads are in
+        flight at the same time. Raises mgt.RCoreMgtTimeout after timeout
+        seconds, None waits forever.
+        '''
+        return self.wait_mgt_command(self.call_mgt_command_async(evt),
+                                     timeout)
+
+    def call_mgt_command_async(self, evt):
+        '''send a management command, returns a mgt.RCoreFuture to pass to
+        wait_mgt_command'''
+        return self.mgt.call(evt.serialize_frames())
+
+    def wait_mgt_command(self, future, timeout=mgt.MGT_TIMEOUT):
+        '''wait for the response event of call_mgt_command_async
+
+        Raises an Exception if the master failed to process the command.
+        '''
+        try:
+            resp = future.result(timeout)
+        except mgt.RCoreMgtTimeout:
+            self.mgt.cancel(future)
+            raise
         respevt = event.RCoreEvent.from_data(resp,
                                              lambda id: self.typesById[id])
+        if respevt.eventType is event.EVT_TYPE_MGT_ERROR_RESP:
+            raise Exception("Management command failed: %s" %
+                            (respevt.reader().read()))
         return respevt
 
-    def send(self, evt):
-        data = evt.serialize()
-        self.sockMgt.send(data)
-        self.sockMgt.recv()  # ignore response, but must receive on pub-sub
-
-    def register_listener(self, eventTypeName, callback):
-        eventListeners = None
-        if eventTypeName in self.listeners:
-            eventListeners = self.listeners[eventTypeName]
+    def send(self, evt, ack=False):
+        '''publish an event
+
+        By default the event is queued on the data socket and this returns
+        without waiting for the master. With ack=True the event is sent over
+        the management socket instead, returning once the master has
+        received it and queued it for routing. It can still be dropped if
+        it has no subscribers, and it is not ordered with events sent
+        without ack, which may be routed before or after it.
+        '''
+        if ack:
+            self.stamp(evt)
+            self.call_mgt_command(evt)
+        elif self.has_subscribers(evt.eventType):
+            self.stamp(evt)
+            self.sockDatas[evt.eventType.priority].send_multipart(
+                evt.serialize_frames(), copy=False)
         else:
-            eventListeners = []
-            self.listeners[eventTypeName] = eventListeners
-            eventType = self.read_event_type(eventTypeName)
-            self.sockSub.setsockopt(zmq.SUBSCRIBE,
-                                    struct.pack('>h', eventType.id))
-
-        eventListeners.append(callback)
+            self.skipped += 1
+
+    def send_many(self, events):
+        '''publish a batch of events as a single multipart message
+
+        Events of different priority classes are split into one message
+        per class, high priority first.
+        '''
+        frames = dict((priority, []) for priority in event.PRIORITIES)
+        for evt in events:
+            if self.has_subscribers(evt.eventType):
+                self.stamp(evt)
+                frames[evt.eventType.priority].extend(evt.serialize_frames())
+            else:
+                self.skipped += 1
+        for priority in event.PRIORITIES:
+            if frames[priority]:
+                self.sockDatas[priority].send_multipart(frames[priority],
+                                                        copy=False)
+
+    def stamp(self, evt):
+        '''set the header of an event about to be sent, if its type has one'''
+        if evt.eventType.header:
+            sequence = self.sequences.get(evt.eventType.id, 0) + 1
+            self.sequences[evt.eventType.id] = sequence
+            evt.stamp(self.publisherId, sequence)
+
+    def send_frames(self, frames, priority=event.PRIORITY_NORMAL):
+        '''publish an already serialized message, e.g. a recorded one'''
+        self.sockDatas[priority].send_multipart(frames, copy=False)
+
+    def has_subscribers(self, eventType):
+        '''return false if the master reported no subscribers of eventType
+
+        Always true for cached event types, the master keeps their latest
+        event for later subscribers. Shares the sending thread's sockets,
+        so only call it from there.
+        '''
+        if self.sockHints is None or eventType.cache:
+            return True
+        self.update_subscriptions()
+        return self.subscribedTypes is None or \
+            eventType.id in self.subscribedTypes
+
+    def update_subscriptions(self):
+        '''apply pending subscriptions events, true if there were any
+
+        subscriberCounts maps event type ids to their number of subscribers,
+        not counting catch-all subscriptions. Shares the sending thread's
+        sockets like has_subscribers.
+        '''
+        updated = False
+        while self.sockHints.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+            data = self.sockHints.recv()
+            hint = event.RCoreEvent.from_data(data, self.typesById.get) \
+                .reader().read()
+            if hint['all']:
+                self.subscribedTypes = None
+            else:
+                self.subscribedTypes = frozenset(hint['types'])
+            self.subscriberCounts = dict(
+                zip(hint['types'],
+                    hint.get('subscribers', [1] * len(hint['types']))))
+            updated = True
+        return updated
+
+    def register_listener(self, eventTypeName, callback, conflate=False,
+                          maxQueueSize=None, policy=None):
+        '''register a listener
+
+        By default the listeners of a type share the type's dispatcher
+        queue. With conflate, or a maxQueueSize or policy, the listener gets
+        its own queue instead: conflate keeps only the latest event, so a
+        slow listener always sees the newest value and skips stale ones.
+        Events dropped from a listener's queue are counted under its key in
+        dispatcher.stats(). Returns the key, None for the shared queue.
+
+        Listener queues need the client to have a dispatcher. Without one,
+        listeners are called on the receiving thread as events arrive, with
+        nothing queued to conflate or limit.
+        '''
+        queued = conflate or maxQueueSize is not None or policy is not None
+        if queued and self.dispatcher is None:
+            raise Exception("conflate, maxQueueSize and policy require a "
+                            "dispatch.RCoreDispatcher passed to RCoreClient")
+
+        eventType = self.read_event_type(eventTypeName)
+        if eventType is None:
+            raise Exception("Unknown event type %s" % (eventTypeName))
+
+        if eventTypeName not in self.listeners:
+            self.listeners[eventTypeName] = []
+            self.queuedListeners[eventTypeName] = []
+            self.receiveStats[eventTypeName] = stats.RCoreListenerStats()
+            self.listenerStats[eventTypeName] = []
+            self.sockSubs[eventType.priority].setsockopt(
+                zmq.SUBSCRIBE, struct.pack('>h', eventType.id))
+
+        if eventType.header:
+            listenerStats = stats.RCoreListenerStats()
+            self.listenerStats[eventTypeName].append(listenerStats)
+            callback = measure_listener(callback, listenerStats)
+
+        if not queued:
+            self.listeners[eventTypeName].append(callback)
+            return None
+
+        queuedListeners = self.queuedListeners[eventTypeName]
+        key = '%s:%d' % (eventTypeName, len(queuedListeners))
+        if conflate:
+            self.dispatcher.configure(key, 1,
+                                      dispatch.DISPATCH_POLICY_DROP_OLDEST)
+        else:
+            self.dispatcher.configure(key, maxQueueSize, policy)
+        queuedListeners.append((key, [callback]))
+        return key
+
+    def read_listener_stats(self):
+        '''return latency and loss stats per event type name
+
+        received is measured as events arrive, so its gaps are events lost
+        before reaching this client. listeners holds the stats of each
+        listener in registration order, measured when it is called, so
+        gaps beyond received's were dropped from its queue and latency
+        includes queueing. Only event types with headers are measured.
+        '''
+        result = {}
+        for name, listenerStats in self.listenerStats.items():
+            if listenerStats:
+                result[name] = {
+                    'received': self.receiveStats[name].snapshot(),
+                    'listeners': [s.snapshot() for s in listenerStats]}
+        return result
 
     def start(self):
+        if self.dispatcher is not None:
+            self.dispatcher.start()
         self.t = threading.Thread(target=self.run_listeners)
         self.running = True
         self.t.start()
 
     def close(self):
         self.running = False
-        self.sockMgt.close()
-        self.sockSub.close()
+        if self.t is not None and self.t is not threading.current_thread():
+            self.t.join()  # exits within LISTENER_POLL_TIMEOUT
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        self.mgt.close()
+        for priority in event.PRIORITIES:
+            self.sockSubs[priority].close()
+            self.sockDatas[priority].close()
+        if self.sockHints is not None:
+            self.sockHints.close()
+        for ring in self.shmRings:
+            ring.unlink()
         if self.termContext:
             self.ctx.term()
 
     def run_listeners(self):
         print 'Started Listener'
+        sockHigh = self.sockSubs[event.PRIORITY_HIGH]
+        poller = zmq.Poller()
+        poller.register(sockHigh, zmq.POLLIN)
+        poller.register(self.sockSub, zmq.POLLIN)
         try:
             while self.running:
-                data = self.sockSub.recv()
+                if not poller.poll(LISTENER_POLL_TIMEOUT):
+                    self.check_event_types()
+                    continue
+
+                # drain the high priority lane, then handle one normal event
+                while True:
+                    try:
+                        frames = sockHigh.recv_multipart(zmq.NOBLOCK,
+                                                         copy=False)
+                    except zmq.Again:
+                        break
+                    self.process_message(frames)
+
+                try:
+                    frames = self.sockSub.recv_multipart(zmq.NOBLOCK,
+                                                         copy=False)
+                except zmq.Again:
+                    continue
+                self.process_message(frames)
+        except zmq.ContextTerminated:
+            pass
+        except:
+            print 'Error in Listener Thread'
+            traceback.print_exc()
 
-                print 'Received: %s' % (data)
+    def process_message(self, frames):
+        '''pass the events of a received message to their listeners
 
-                evt = event.RCoreEvent.from_data(data,
-                                                 lambda id: self.typesById[id])
+        Errors are printed, they only lose this message.
+        '''
+        try:
+            self.check_event_types()
+            events = event.RCoreEvent.from_frames(frames, self.typesById.get)
+            if events[-1].eventType is None:
+                events.pop()
+                self.dropped += 1
+                self.request_event_types()
+            self.dispatch_events(events)
+        except Exception:
+            traceback.print_exc()
 
-                if evt.eventType.name in self.listeners:
-                    for listener in self.listeners[evt.eventType.name]:
+    def dispatch_events(self, events):
+        '''pass received events to their listeners'''
+        for evt in events:
+            if evt.eventType.name not in self.listeners:
+                continue
+
+            if evt.header is not None:
+                self.receiveStats[evt.eventType.name].record(
+                    evt.header, event.timestamp_us())
+
+            listeners = self.listeners[evt.eventType.name]
+            if self.dispatcher is not None:
+                if listeners:
+                    self.dispatcher.dispatch(evt, listeners)
+                for key, queued in \
+                        self.queuedListeners[evt.eventType.name]:
+                    self.dispatcher.dispatch(evt, queued, key)
+            else:
+                for listener in listeners:
+                    try:
                         listener(evt)
-        except:
-            traceback.print_exc()
-            self.close()
+                    except Exception:
+                        traceback.print_exc()
+
+
+def measure_listener(callback, listenerStats):
+    '''wrap a listener to record the header of each event it is called with'''
+    def listener(evt):
+        listenerStats.record(evt.header, event.timestamp_us())
+        return callback(evt)
+    return listener
 
 
 def demo():
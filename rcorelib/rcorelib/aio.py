@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+aio.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+"""
+
+import datetime
+import itertools
+import os
+import struct
+import traceback
+
+import zmq
+from zmq.eventloop import future as zmqfuture
+from tornado import concurrent
+from tornado import gen
+from tornado import ioloop
+
+import event
+import mgt
+import rcorelib
+
+
+class AsyncRCoreClient(object):
+    '''RobotCore Client for event loop based components
+
+    Mirrors RCoreClient, but every call returns a future instead of blocking.
+    Under Python 3 with tornado 5+ these are asyncio futures, so they can be
+    awaited from asyncio code.
+
+    ctx may be a plain zmq.Context, e.g. the master's for the inproc
+    transport, it is shadowed to get future based sockets.
+
+    Like RCoreClient, each priority class has its own sockets, and pending
+    high priority events are received before normal ones. Management calls
+    are pipelined over a DEALER socket with correlation ids, see
+    mgt.RCoreMgtChannel, and time out after mgt.MGT_TIMEOUT.
+
+    Not supported yet, compared to RCoreClient: subscription hints (send
+    never skips events without subscribers), per listener queues and
+    conflation (listeners run in order on the event loop, see
+    register_listener), the registry snapshot and shared memory rings.
+    '''
+    def __init__(self, server, name, ctx=None,
+                 transport=rcorelib.TRANSPORT_TCP):
+        self.termContext = False
+        if ctx is None:
+            if transport == rcorelib.TRANSPORT_INPROC:
+                raise Exception(
+                    "inproc transport requires the master's context")
+            self.ctx = zmqfuture.Context()
+            self.termContext = True
+        elif isinstance(ctx, zmqfuture.Context):
+            self.ctx = ctx
+        else:
+            self.ctx = zmqfuture.Context.shadow(ctx.underlying)
+
+        self.sockMgt = self.ctx.socket(zmq.DEALER)
+        self.sockMgt.connect(
+            rcorelib.endpoint(transport, server, rcorelib.PORT_MGT))
+        self.mgtIds = itertools.count(1)
+        self.mgtPending = {}  # correlation id -> future of the reply
+        self.mgtReceiving = False
+
+        self.sockSubs = {}
+        self.sockDatas = {}
+        self.poller = zmqfuture.Poller()
+        for priority in event.PRIORITIES:
+            self.sockSubs[priority] = self.ctx.socket(zmq.SUB)
+            self.sockSubs[priority].connect(rcorelib.endpoint(
+                transport, server, rcorelib.PUBSUB_PORTS[priority]))
+            self.poller.register(self.sockSubs[priority], zmq.POLLIN)
+            self.sockDatas[priority] = self.ctx.socket(zmq.PUSH)
+            self.sockDatas[priority].connect(rcorelib.endpoint(
+                transport, server, rcorelib.DATA_PORTS[priority]))
+        self.sockSub = self.sockSubs[event.PRIORITY_NORMAL]
+        self.sockData = self.sockDatas[event.PRIORITY_NORMAL]
+
+        self.publisherId = struct.unpack('>I', os.urandom(4))[0]
+        self.sequences = {}
+
+        self.typesByName = {}
+        self.typesById = {}
+        self.registryId = None
+        self.typesVersion = 0
+
+        for eventType in event.EVT_TYPE_MGT_TYPES:
+            self.typesByName[eventType.name] = eventType
+            self.typesById[eventType.id] = eventType
+
+        self.listeners = {}
+        self.running = False
+        self.dropped = 0  # messages received with an unknown event type
+
+    @gen.coroutine
+    def get_event_types(self, timeout=mgt.MGT_TIMEOUT):
+        '''fetch event types registered since the last call from the master
+
+        Returns all known event types, excluding MGT types.
+        '''
+        evt = event.RCoreEventBuilder(event.EVT_TYPE_MGT_LIST_EVENT_TYPES) \
+            .add(self.typesVersion).build()
+        respevt = yield self.call_mgt_command(evt, timeout)
+        catalog = respevt.reader().read()
+
+        if catalog['registry'] != self.registryId and not catalog['full']:
+            # a different master registry, our version means nothing to it
+            self.typesVersion = 0
+            result = yield self.get_event_types(timeout)
+            raise gen.Return(result)
+
+        event.update_event_types(self.typesByName, self.typesById, catalog)
+        self.registryId = catalog['registry']
+        self.typesVersion = catalog['version']
+
+        raise gen.Return([eventType for eventType in self.typesById.values()
+                          if eventType.id >= event.EVT_TYPE_FIRST_ID])
+
+    @gen.coroutine
+    def read_event_type(self, name):
+        if name in self.typesByName:
+            raise gen.Return(self.typesByName[name])
+
+        evt = event.RCoreEventBuilder(event.EVT_TYPE_MGT_READ_EVENT_TYPE) \
+            .add(name).build()
+        respevt = yield self.call_mgt_command(evt)
+
+        respreader = respevt.reader()
+        respid = respreader.read()
+        respname = respreader.read()
+        respDataTypes = [i for i in respreader.read()]
+        respOptions = respreader.read()
+
+        if respid >= 0:
+            eventType = event.RCoreEventType(respname,
+                                             respDataTypes,
+                                             id=respid,
+                                             options=respOptions)
+            self.typesByName[name] = eventType
+            self.typesById[respid] = eventType
+            raise gen.Return(eventType)
+        else:
+            raise gen.Return(None)
+
+    @gen.coroutine
+    def register_event_type(self, eventType):
+        evt = event.RCoreEventBuilder(event.EVT_TYPE_MGT_REGISTER_EVENT_TYPE) \
+            .add(eventType.name).add(eventType.dataTypes) \
+            .add(eventType.options).build()
+
+        respevt = yield self.call_mgt_command(evt)
+
+        respreader = respevt.reader()
+        respid = respreader.read()
+        if respid >= 0:
+            eventType.id = respid
+            self.typesByName[eventType.name] = eventType
+            self.typesById[respid] = eventType
+            raise gen.Return(eventType)
+        else:
+            raise Exception("Error registering event type %s" %
+                            (eventType.name))
+
+    @gen.coroutine
+    def read_stats(self):
+        '''return the master routing stats, see RCoreMaster.read_stats'''
+        evt = event.RCoreEventBuilder(event.EVT_TYPE_MGT_READ_STATS).build()
+        respevt = yield self.call_mgt_command(evt)
+        raise gen.Return(respevt.reader().read())
+
+    @gen.coroutine
+    def read_cache(self, eventTypeNames=None):
+        '''return the events cached by the master, see
+        RCoreClient.read_cache'''
+        evt = event.RCoreEventBuilder(event.EVT_TYPE_MGT_READ_CACHE) \
+            .add(eventTypeNames).build()
+        respevt = yield self.call_mgt_command(evt)
+        messages = event.unpack_messages(respevt.reader().read())
+
+        if any(event.EVENT_TYPE_ID_STRUCT.unpack_from(frames[0])[0]
+               not in self.typesById for frames in messages):
+            yield self.get_event_types()
+
+        events = []
+        for frames in messages:
+            events.extend(evt for evt in event.RCoreEvent.from_frames(
+                frames, self.typesById.get) if evt.eventType is not None)
+        raise gen.Return(events)
+
+    @gen.coroutine
+    def call_mgt_command(self, evt, timeout=mgt.MGT_TIMEOUT):
+        '''send a management command and wait for its response event
+
+        Several calls can be in flight at once. Raises mgt.RCoreMgtTimeout
+        after timeout seconds, None waits forever.
+        '''
+        correlationId = mgt.CORRELATION_STRUCT.pack(
+            next(self.mgtIds) & 0xffffffff)
+        future = concurrent.Future()
+        self.mgtPending[correlationId] = future
+        if not self.mgtReceiving:
+            self.mgtReceiving = True
+            ioloop.IOLoop.current().spawn_callback(self.receive_mgt)
+
+        try:
+            yield self.sockMgt.send_multipart(
+                [correlationId, ''] + evt.serialize_frames(), copy=False)
+            if timeout is None:
+                resp = yield future
+            else:
+                resp = yield gen.with_timeout(
+                    datetime.timedelta(seconds=timeout), future)
+        except gen.TimeoutError:
+            raise mgt.RCoreMgtTimeout("Management call timed out after %ss" %
+                                      (timeout))
+        finally:
+            self.mgtPending.pop(correlationId, None)
+
+        respevt = event.RCoreEvent.from_data(resp,
+                                             lambda id: self.typesById[id])
+        if respevt.eventType is event.EVT_TYPE_MGT_ERROR_RESP:
+            raise Exception("Management command failed: %s" %
+                            (respevt.reader().read()))
+        raise gen.Return(respevt)
+
+    @gen.coroutine
+    def receive_mgt(self):
+        '''pass management replies to their calls while any are pending
+
+        Replies to calls that timed out are dropped.
+        '''
+        try:
+            while self.mgtPending:
+                frames = yield self.sockMgt.recv_multipart()
+                future = self.mgtPending.pop(frames[0], None)
+                if future is not None and not future.done():
+                    future.set_result(frames[2])
+        except zmq.ZMQError:
+            if self.running:
+                traceback.print_exc()
+        finally:
+            self.mgtReceiving = False
+
+    @gen.coroutine
+    def send(self, evt, ack=False):
+        '''publish an event, see RCoreClient.send'''
+        self.stamp(evt)
+        if ack:
+            yield self.call_mgt_command(evt)
+        else:
+            yield self.sockDatas[evt.eventType.priority].send_multipart(
+                evt.serialize_frames(), copy=False)
+
+    @gen.coroutine
+    def send_many(self, events):
+        '''publish a batch of events, one multipart message per priority'''
+        frames = dict((priority, []) for priority in event.PRIORITIES)
+        for evt in events:
+            self.stamp(evt)
+            frames[evt.eventType.priority].extend(evt.serialize_frames())
+        for priority in event.PRIORITIES:
+            if frames[priority]:
+                yield self.sockDatas[priority].send_multipart(
+                    frames[priority], copy=False)
+
+    def stamp(self, evt):
+        '''set the header of an event about to be sent, if its type has one'''
+        if evt.eventType.header:
+            sequence = self.sequences.get(evt.eventType.id, 0) + 1
+            self.sequences[evt.eventType.id] = sequence
+            evt.stamp(self.publisherId, sequence)
+
+    @gen.coroutine
+    def register_listener(self, eventTypeName, callback):
+        '''register a listener
+
+        callback may be a plain function or a coroutine. Futures returned by
+        callback are waited on before the next event is dispatched.
+        '''
+        eventListeners = None
+        if eventTypeName in self.listeners:
+            eventListeners = self.listeners[eventTypeName]
+        else:
+            eventListeners = []
+            self.listeners[eventTypeName] = eventListeners
+            eventType = yield self.read_event_type(eventTypeName)
+            self.sockSubs[eventType.priority].setsockopt(
+                zmq.SUBSCRIBE, struct.pack('>h', eventType.id))
+
+        eventListeners.append(callback)
+
+    @gen.coroutine
+    def recv_events(self):
+        '''receive the next message from the subscription sockets
+
+        Returns a list of events, more than one for a batched message.
+        Only needed when not using start() and listeners.
+        '''
+        frames = None
+        while frames is None:
+            for priority in event.PRIORITIES:
+                sock = self.sockSubs[priority]
+                if sock.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                    frames = yield sock.recv_multipart(copy=False)
+                    break
+            else:
+                yield self.poller.poll()
+        events = event.RCoreEvent.from_frames(frames, self.typesById.get)
+
+        if events[-1].eventType is None:
+            # unknown type, fetch new event types and parse again
+            try:
+                yield self.get_event_types(rcorelib.LISTENER_TYPES_TIMEOUT)
+            except Exception:
+                traceback.print_exc()
+            events = event.RCoreEvent.from_frames(frames, self.typesById.get)
+            if events[-1].eventType is None:
+                self.dropped += 1
+                events.pop()
+
+        raise gen.Return(events)
+
+    def start(self):
+        '''start dispatching to listeners on the current event loop'''
+        self.running = True
+        ioloop.IOLoop.current().spawn_callback(self.run_listeners)
+
+    def close(self):
+        self.running = False
+        self.sockMgt.close()
+        for priority in event.PRIORITIES:
+            self.sockSubs[priority].close()
+            self.sockDatas[priority].close()
+        if self.termContext:
+            self.ctx.term()
+
+    @gen.coroutine
+    def run_listeners(self):
+        try:
+            while self.running:
+                events = yield self.recv_events()
+
+                for evt in events:
+                    if evt.eventType.name in self.listeners:
+                        for listener in self.listeners[evt.eventType.name]:
+                            try:
+                                res = listener(evt)
+                                if res is not None:
+                                    yield res
+                            except Exception:
+                                traceback.print_exc()
+        except zmq.ZMQError:
+            if self.running:
+                traceback.print_exc()
+        except:
+            traceback.print_exc()
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+bridge.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+"""
+
+
+import time
+import traceback
+
+import zmq
+
+import event
+
+BRIDGE_BATCH_SIZE = 256
+BRIDGE_BATCH_INTERVAL = 0.002
+BRIDGE_POLL_TIMEOUT = 100
+
+
+class RCoreBridge(object):
+    '''Forwards events between two or more masters
+
+    Each master is reached through an RCoreClient with subscription hints,
+    which report how many subscribers each event type has. An event type
+    subscribed on one master is subscribed by the bridge on every other
+    master, and events received there are forwarded to it. Subscriptions
+    made by the bridge itself are not counted, so nothing is forwarded to
+    a master where only the bridge would receive it. Catch-all
+    subscriptions, e.g. recorders, are not bridged.
+
+    Event types are matched by name, dataTypes and options, and registered
+    on the masters that don't know them yet, so ids are translated per
+    master. Only event types with the header option are bridged. A type
+    registered differently on two masters is not bridged, nor are types
+    with shared memory fields, which are only readable on their
+    publisher's host.
+
+    Events forwarded to a master are batched into multipart messages of up
+    to batchSize events, sent at the latest batchInterval seconds after
+    their first event. High priority events are forwarded right away,
+    through the high priority sockets.
+
+    Forwarded events are marked as published by the bridge's client of
+    their destination, with that client's per type sequence, keeping their
+    published time. Events the bridge forwarded into a master come back to
+    it if it also subscribes to their type there, those carrying one of
+    the bridge's own publisher ids are dropped instead of being forwarded
+    again. Events forwarded by other bridges are forwarded as usual, so
+    bridges can be chained as long as they don't form a cycle.
+
+    Runs on a single thread, which owns all the clients' sockets.
+    '''
+    def __init__(self, clients, batchSize=BRIDGE_BATCH_SIZE,
+                 batchInterval=BRIDGE_BATCH_INTERVAL):
+        if len(clients) < 2:
+            raise Exception("A bridge needs at least two masters")
+        for client in clients:
+            if client.sockHints is None:
+                raise Exception("Bridged clients require subscription hints")
+
+        self.clients = clients
+        self.batchSize = batchSize
+        self.batchInterval = batchInterval
+        self.running = False
+
+        count = len(clients)
+        # event type ids the bridge subscribes to, per master
+        self.subscribed = [set() for i in range(count)]
+        # per master, event type id -> [(destination, destination id)]
+        self.routes = [{} for i in range(count)]
+        # (master, destination, event type id) -> destination id or None
+        self.idMap = {}
+
+        # frames, event count and first event time waiting per destination
+        self.batches = [[] for i in range(count)]
+        self.batchCounts = [0] * count
+        self.batchStarts = [None] * count
+
+        # publisher ids stamped on forwarded events
+        self.publisherIds = set(client.publisherId for client in clients)
+
+        self.forwarded = [0] * count
+        self.echoesDropped = [0] * count
+        self.unknown = [0] * count  # events of types not known to the bridge
+        # names of the event types of each master that can't be bridged
+        self.unbridged = [set() for i in range(count)]
+
+    def translate(self, source, destination, eventTypeId):
+        '''return the id on destination of an event type of source
+
+        The type is registered on destination if needed, None if it can't
+        be bridged. A type registered differently on destination is not
+        bridged, registering it would take the name over from destination's
+        own components.
+        '''
+        key = (source, destination, eventTypeId)
+        if key not in self.idMap:
+            eventType = self.clients[source].get_event_type_by_id(eventTypeId)
+            translated = None
+            if eventType is not None and eventType.header and \
+                    not eventType.shmCount:
+                client = self.clients[destination]
+                existing = client.read_event_type(eventType.name)
+                if existing is None:
+                    translated = client.register_event_type(
+                        event.RCoreEventType(eventType.name,
+                                             eventType.dataTypes,
+                                             options=eventType.options)).id
+                elif list(existing.dataTypes) == list(eventType.dataTypes) \
+                        and event.layout_options(existing.options) == \
+                        event.layout_options(eventType.options):
+                    translated = existing.id
+            if eventType is not None and translated is None:
+                self.unbridged[source].add(eventType.name)
+            self.idMap[key] = translated
+        return self.idMap[key]
+
+    def update_routes(self):
+        '''subscribe to the event types other masters have subscribers for
+        '''
+        routes = [{} for client in self.clients]
+        for destination, client in enumerate(self.clients):
+            for eventTypeId, count in client.subscriberCounts.items():
+                if eventTypeId in self.subscribed[destination]:
+                    count -= 1
+                if count <= 0:
+                    continue
+                for source in range(len(self.clients)):
+                    if source == destination:
+                        continue
+                    sourceId = self.translate(destination, source,
+                                              eventTypeId)
+                    if sourceId is not None and \
+                            self.translate(source, destination,
+                                           sourceId) is not None:
+                        routes[source].setdefault(sourceId, []).append(
+                            (destination, eventTypeId))
+
+        for source, client in enumerate(self.clients):
+            wanted = set(routes[source].keys())
+            for eventTypeId in wanted - self.subscribed[source]:
+                self.subscribed[source].add(eventTypeId)
+                self.sub_socket(source, eventTypeId).setsockopt(
+                    zmq.SUBSCRIBE,
+                    event.EVENT_TYPE_ID_STRUCT.pack(eventTypeId))
+            for eventTypeId in self.subscribed[source] - wanted:
+                self.subscribed[source].discard(eventTypeId)
+                self.sub_socket(source, eventTypeId).setsockopt(
+                    zmq.UNSUBSCRIBE,
+                    event.EVENT_TYPE_ID_STRUCT.pack(eventTypeId))
+        self.routes = routes
+
+    def sub_socket(self, source, eventTypeId):
+        '''return the subscription socket of an event type's priority'''
+        client = self.clients[source]
+        eventType = client.get_event_type_by_id(eventTypeId)
+        return client.sockSubs[eventType.priority]
+
+    def forward(self, source, frames, now):
+        '''queue the events of a message received from source'''
+        client = self.clients[source]
+        events = event.RCoreEvent.from_frames(frames,
+                                              client.get_event_type_by_id)
+        for evt in events:
+            if evt.eventType is None:
+                self.unknown[source] += 1
+                break
+
+            routes = self.routes[source].get(evt.eventType.id)
+            if not routes:
+                continue
+
+            if evt.header[0] in self.publisherIds:
+                # forwarded into source by this bridge
+                self.echoesDropped[source] += 1
+                continue
+
+            for destination, eventTypeId in routes:
+                client = self.clients[destination]
+                sequence = client.sequences.get(eventTypeId, 0) + 1
+                client.sequences[eventTypeId] = sequence
+                frame = bytearray(event.EVENT_TYPE_ID_STRUCT.pack(eventTypeId))
+                frame.extend(event.EVENT_HEADER_STRUCT.pack(
+                    client.publisherId, sequence, evt.header[2], 0))
+                frame.extend(evt.data)
+
+                if evt.eventType.priority == event.PRIORITY_HIGH:
+                    client.send_frames([frame] + evt.buffers,
+                                       event.PRIORITY_HIGH)
+                    self.forwarded[destination] += 1
+                    continue
+
+                self.batches[destination].append(frame)
+                self.batches[destination].extend(evt.buffers)
+                self.batchCounts[destination] += 1
+                if self.batchStarts[destination] is None:
+                    self.batchStarts[destination] = now
+
+                if self.batchCounts[destination] >= self.batchSize:
+                    self.flush(destination)
+
+    def flush(self, destination):
+        '''send the events queued for destination as one message'''
+        if self.batches[destination]:
+            self.clients[destination].send_frames(self.batches[destination])
+            self.forwarded[destination] += self.batchCounts[destination]
+        self.batches[destination] = []
+        self.batchCounts[destination] = 0
+        self.batchStarts[destination] = None
+
+    def stats(self):
+        '''return per master the events forwarded to it, the echoes and
+        events of unknown types dropped from it, and how many of its event
+        types are not bridged'''
+        return [{'forwarded': self.forwarded[i],
+                 'echoes': self.echoesDropped[i],
+                 'unknown': self.unknown[i],
+                 'unbridged': len(self.unbridged[i]),
+                 'subscribed': len(self.subscribed[i])}
+                for i in range(len(self.clients))]
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        '''forward events until stopped'''
+        poller = zmq.Poller()
+        for client in self.clients:
+            for priority in event.PRIORITIES:
+                poller.register(client.sockSubs[priority], zmq.POLLIN)
+            poller.register(client.sockHints, zmq.POLLIN)
+
+        self.running = True
+        try:
+            while self.running:
+                timeout = BRIDGE_POLL_TIMEOUT
+                starts = [start for start in self.batchStarts
+                          if start is not None]
+                if starts:
+                    timeout = max(0, (min(starts) + self.batchInterval -
+                                      time.time()) * 1000)
+                socks = dict(poller.poll(timeout))
+                now = time.time()
+
+                hinted = False
+                for client in self.clients:
+                    if socks.get(client.sockHints) == zmq.POLLIN:
+                        hinted = client.update_subscriptions() or hinted
+                if hinted:
+                    self.update_routes()
+
+                for priority in event.PRIORITIES:
+                    for source, client in enumerate(self.clients):
+                        sock = client.sockSubs[priority]
+                        if socks.get(sock) != zmq.POLLIN:
+                            continue
+                        for i in range(self.batchSize):
+                            try:
+                                frames = sock.recv_multipart(zmq.NOBLOCK,
+                                                             copy=False)
+                            except zmq.Again:
+                                break
+                            self.forward(source, frames, now)
+
+                now = time.time()
+                for destination, start in enumerate(self.batchStarts):
+                    if start is not None and \
+                            now - start >= self.batchInterval:
+                        self.flush(destination)
+
+            # stopped cleanly, the sockets are still usable
+            for destination in range(len(self.clients)):
+                self.flush(destination)
+        except zmq.ContextTerminated:
+            pass
+        except:
+            traceback.print_exc()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+dispatch.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+"""
+
+import collections
+import threading
+import traceback
+
+DISPATCH_POLICY_BLOCK = 'block'
+DISPATCH_POLICY_DROP_OLDEST = 'drop_oldest'
+
+DISPATCH_WORKERS = 4
+DISPATCH_MAX_QUEUE_SIZE = 1000
+
+
+class RCoreDispatcher(object):
+    '''Dispatches events to listeners on a pool of worker threads
+
+    Each event type has its own bounded queue, and at most one worker
+    services a queue at a time, so listeners see the events of a type in
+    order while slow listeners of one type don't hold up other types.
+
+    When a queue is full, DISPATCH_POLICY_DROP_OLDEST discards the oldest
+    queued event of that type, DISPATCH_POLICY_BLOCK makes the receiving
+    thread wait for room.
+
+    Events can also be dispatched to a queue other than their type's by
+    passing a key, and each queue's size and policy can be set with
+    configure, e.g. a queue of size 1 that drops the oldest event only
+    ever holds the latest event (conflation).
+    '''
+    def __init__(self, workers=DISPATCH_WORKERS,
+                 maxQueueSize=DISPATCH_MAX_QUEUE_SIZE,
+                 policy=DISPATCH_POLICY_DROP_OLDEST):
+        if policy not in [DISPATCH_POLICY_BLOCK, DISPATCH_POLICY_DROP_OLDEST]:
+            raise Exception("Invalid dispatch policy %s" % (policy))
+        if maxQueueSize < 1:
+            raise Exception("Invalid queue size %s" % (maxQueueSize))
+
+        self.workers = workers
+        self.maxQueueSize = maxQueueSize
+        self.policy = policy
+
+        self.cond = threading.Condition()
+        self.queues = {}
+        self.ready = collections.deque()  # keys of queues with work
+        self.scheduled = set()  # keys queued in ready or being dispatched
+        self.counters = {}
+        self.config = {}
+
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self.run_worker)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.threads = []
+
+    def configure(self, key, maxQueueSize=None, policy=None):
+        '''set the size and policy of one queue, None keeps the default'''
+        if policy is not None and \
+                policy not in [DISPATCH_POLICY_BLOCK,
+                               DISPATCH_POLICY_DROP_OLDEST]:
+            raise Exception("Invalid dispatch policy %s" % (policy))
+        if maxQueueSize is not None and maxQueueSize < 1:
+            raise Exception("Invalid queue size %s" % (maxQueueSize))
+
+        with self.cond:
+            self.config[key] = (
+                self.maxQueueSize if maxQueueSize is None else maxQueueSize,
+                self.policy if policy is None else policy)
+
+    def dispatch(self, evt, listeners, key=None):
+        '''queue evt to be passed to each of listeners
+
+        key selects the queue, by default the event type name
+        '''
+        if key is None:
+            key = evt.eventType.name
+        with self.cond:
+            if key not in self.queues:
+                self.queues[key] = collections.deque()
+                self.counters[key] = {'queued': 0,
+                                      'dispatched': 0,
+                                      'dropped': 0}
+
+            queue = self.queues[key]
+            counters = self.counters[key]
+            maxQueueSize, policy = self.config.get(
+                key, (self.maxQueueSize, self.policy))
+
+            if len(queue) >= maxQueueSize:
+                if policy == DISPATCH_POLICY_DROP_OLDEST:
+                    queue.popleft()
+                    counters['dropped'] += 1
+                else:
+                    while self.running and len(queue) >= maxQueueSize:
+                        self.cond.wait()
+
+            queue.append((evt, listeners))
+            counters['queued'] += 1
+
+            if key not in self.scheduled:
+                self.scheduled.add(key)
+                self.ready.append(key)
+                self.cond.notify_all()
+
+    def stats(self):
+        '''return counters per queue key, by default event type names
+
+        queued and dispatched are totals, pending is the current queue size
+        '''
+        with self.cond:
+            stats = {}
+            for key, counters in self.counters.items():
+                stats[key] = dict(counters)
+                stats[key]['pending'] = len(self.queues[key])
+            return stats
+
+    def run_worker(self):
+        while True:
+            with self.cond:
+                while self.running and not self.ready:
+                    self.cond.wait()
+                if not self.running:
+                    return
+
+                key = self.ready.popleft()
+                evt, listeners = self.queues[key].popleft()
+                self.cond.notify_all()  # wake receiver blocked on full queue
+
+            for listener in listeners:
+                try:
+                    listener(evt)
+                except:
+                    traceback.print_exc()
+
+            with self.cond:
+                self.counters[key]['dispatched'] += 1
+                if self.queues[key]:
+                    self.ready.append(key)
+                    self.cond.notify_all()
+                else:
+                    self.scheduled.discard(key)
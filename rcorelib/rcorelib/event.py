@@ -21,10 +21,25 @@ along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
 @copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
 """
 
+import os
 import struct
 import json
+import time
+import zlib
 # import traceback
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import lz4.block as lz4block
+except ImportError:
+    lz4block = None
+
+import shm
+
 
 MSG_DATA_TYPE_BYTE = 0
 MSG_DATA_TYPE_INT = 1
@@ -34,13 +49,15 @@ MSG_DATA_TYPE_DOUBLE = 4
 MSG_DATA_TYPE_STRING = 5
 MSG_DATA_TYPE_BYTEA = 6
 MSG_DATA_TYPE_JSON = 7
+MSG_DATA_TYPE_NDARRAY = 8
+MSG_DATA_TYPE_SHM_BYTEA = 9
 
 MSG_DATA_TYPE_STRUCT = {
-    MSG_DATA_TYPE_BYTE: {'fmt': 'B'},
-    MSG_DATA_TYPE_INT: {'fmt': 'i'},
-    MSG_DATA_TYPE_LONG: {'fmt': 'l'},
-    MSG_DATA_TYPE_FLOAT: {'fmt': 'f'},
-    MSG_DATA_TYPE_DOUBLE: {'fmt': 'd'}
+    MSG_DATA_TYPE_BYTE: {'fmt': 'B', 'numpy': 'u1'},
+    MSG_DATA_TYPE_INT: {'fmt': 'i', 'numpy': '>i4'},
+    MSG_DATA_TYPE_LONG: {'fmt': 'l', 'numpy': '>i4'},  # standard size
+    MSG_DATA_TYPE_FLOAT: {'fmt': 'f', 'numpy': '>f4'},
+    MSG_DATA_TYPE_DOUBLE: {'fmt': 'd', 'numpy': '>f8'}
 }
 
 MSG_DATA_TYPES_VARS = [
@@ -49,60 +66,373 @@ MSG_DATA_TYPES_VARS = [
     MSG_DATA_TYPE_JSON
 ]
 
+# types whose data is sent in a separate frame after the event
+MSG_DATA_TYPES_FRAMES = [
+    MSG_DATA_TYPE_NDARRAY
+]
+
+# types whose data is written to a shared memory ring, see shm
+MSG_DATA_TYPES_SHM = [
+    MSG_DATA_TYPE_SHM_BYTEA
+]
+
 for k in MSG_DATA_TYPE_STRUCT.keys():
-    MSG_DATA_TYPE_STRUCT[k]['size'] = \
-        struct.calcsize('>%s' % (MSG_DATA_TYPE_STRUCT[k]['fmt']))
+    MSG_DATA_TYPE_STRUCT[k]['struct'] = \
+        struct.Struct('>%s' % (MSG_DATA_TYPE_STRUCT[k]['fmt']))
+    MSG_DATA_TYPE_STRUCT[k]['size'] = MSG_DATA_TYPE_STRUCT[k]['struct'].size
+
+EVENT_TYPE_ID_STRUCT = struct.Struct('>h')
+# optional header, after the type id for event types with the header option:
+# publisher id, sequence, published and master ingress time in microseconds
+EVENT_HEADER_STRUCT = struct.Struct('>IIQQ')
+EVENT_HEADER_DTYPE = [('publisher', '>u4'),
+                      ('sequence', '>u4'),
+                      ('published', '>u8'),
+                      ('ingress', '>u8')]
+# field names taken by the columns numpy_dtype(serialized=True) prepends
+EVENT_RESERVED_FIELD_NAMES = ['id'] + [name for name, _ in EVENT_HEADER_DTYPE]
+VAR_LENGTH_STRUCT = MSG_DATA_TYPE_STRUCT[MSG_DATA_TYPE_INT]['struct']
+NDARRAY_HEADER_STRUCT = struct.Struct('>BB')  # dtype string length, ndim
+SHM_NAME_STRUCT = struct.Struct('>B')
+SHM_SLOT_STRUCT = struct.Struct('>QIQ')  # offset, length, generation
+# messages packed into a single bytea: frame count, then each frame's length
+# and data
+PACKED_FRAME_COUNT_STRUCT = struct.Struct('>H')
+PACKED_FRAME_LENGTH_STRUCT = struct.Struct('>I')
+
+# types compressed by event types with the compression option, their data
+# is prefixed with a COMPRESSION_FLAG_STRUCT naming the codec used
+MSG_DATA_TYPES_COMPRESSIBLE = [
+    MSG_DATA_TYPE_BYTEA,
+    MSG_DATA_TYPE_JSON
+]
+
+COMPRESSION_FLAG_STRUCT = struct.Struct('>B')
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZ4 = 2
+
+COMPRESSION_CODECS = {
+    'zlib': COMPRESSION_ZLIB,
+    'lz4': COMPRESSION_LZ4
+}
+COMPRESSION_MIN_SIZE = 256
+COMPRESSION_LEVEL = 6
+
+# priority classes, each routed through its own sockets
+PRIORITY_NORMAL = 'normal'
+PRIORITY_HIGH = 'high'
+PRIORITIES = [PRIORITY_HIGH, PRIORITY_NORMAL]  # in servicing order
+
+
+def prepare_var_data(dtype, value):
+    '''coerce a variable length value into its raw byte form'''
+    if dtype == MSG_DATA_TYPE_STRING and type(value) != str:
+        value = str(value)
+    elif dtype == MSG_DATA_TYPE_JSON and \
+            type(value) not in [str, unicode, bytearray]:
+        value = json.dumps(value)
+    return value
+
+
+def raw_bytes(value):
+    '''return value as a byte string, as the Python 2 codecs require'''
+    if type(value) == memoryview:
+        return value.tobytes()
+    elif type(value) == bytearray:
+        return bytes(value)
+    return value
+
+
+def compress_var_data(compression, value):
+    '''prefix a raw variable length value with its codec flag, compressing
+    it if it is at least the minimum size and gets smaller'''
+    codec, minSize, level = compression
+    flag = COMPRESSION_NONE
+    if len(value) >= minSize:
+        if codec == COMPRESSION_LZ4 and lz4block is not None:
+            compressed = lz4block.compress(raw_bytes(value))
+            flag = COMPRESSION_LZ4
+        else:
+            # zlib, also when lz4 is not installed here
+            compressed = zlib.compress(raw_bytes(value), level)
+            flag = COMPRESSION_ZLIB
+        if len(compressed) < len(value):
+            value = compressed
+        else:
+            flag = COMPRESSION_NONE
+
+    data = bytearray(COMPRESSION_FLAG_STRUCT.pack(flag))
+    data.extend(value)
+    return data
+
+
+def decompress_var_data(value):
+    '''strip the codec flag of a value, decompressing it if needed'''
+    flag = COMPRESSION_FLAG_STRUCT.unpack_from(value)[0]
+    value = value[COMPRESSION_FLAG_STRUCT.size:]
+    if flag == COMPRESSION_ZLIB:
+        return zlib.decompress(raw_bytes(value))
+    elif flag == COMPRESSION_LZ4:
+        if lz4block is None:
+            raise Exception("lz4 is required to decompress this field")
+        return lz4block.decompress(raw_bytes(value))
+    return value
+
+
+def decode_var_data(dtype, value):
+    '''convert raw variable length bytes into its field value
+
+    bytea values are returned as is, so a memoryview stays a zero-copy view
+    '''
+    if dtype != MSG_DATA_TYPE_BYTEA and type(value) == memoryview:
+        value = value.tobytes()
+
+    if dtype == MSG_DATA_TYPE_STRING:
+        return value.decode()
+    elif dtype == MSG_DATA_TYPE_JSON:
+        return json.loads(value.decode())
+    return value
+
+
+def timestamp_us():
+    '''return the wall clock time in microseconds, for event headers'''
+    return int(time.time() * 1e6)
+
+
+def encode_ndarray(value):
+    '''return the header and contiguous array for an ndarray value
+
+    The header is [dtype length][ndim][dtype string][ndim x uint32 shape].
+    '''
+    if numpy is None:
+        raise Exception("numpy is required for ndarray fields")
+
+    value = numpy.ascontiguousarray(value)
+    dtype = value.dtype.str
+    header = bytearray(NDARRAY_HEADER_STRUCT.pack(len(dtype), value.ndim))
+    header.extend(dtype)
+    header.extend(struct.pack('>%dI' % (value.ndim), *value.shape))
+    return header, value
+
+
+def decode_ndarray(data, offset, buffer):
+    '''read an ndarray header at offset, returns (array, next offset)
+
+    The array is backed by buffer, no data is copied.
+    '''
+    if numpy is None:
+        raise Exception("numpy is required for ndarray fields")
+
+    dtypelen, ndim = NDARRAY_HEADER_STRUCT.unpack_from(data, offset)
+    offset += NDARRAY_HEADER_STRUCT.size
+    dtype = bytes(bytearray(data[offset:offset+dtypelen])).decode()
+    offset += dtypelen
+    shape = struct.unpack_from('>%dI' % (ndim), data, offset)
+    offset += 4 * ndim
+    return numpy.frombuffer(buffer, dtype=dtype).reshape(shape), offset
+
+
+def encode_shm(eventType, value):
+    '''write value to the event type's shared memory ring, returns the
+    descriptor [name length][name][offset][length][generation]'''
+    if eventType.shmRing is None:
+        raise Exception("No shared memory ring for %s" % (eventType.name))
+
+    ring = eventType.shmRing
+    offset, length, generation = ring.write(value)
+    descriptor = bytearray(SHM_NAME_STRUCT.pack(len(ring.name)))
+    descriptor.extend(ring.name)
+    descriptor.extend(SHM_SLOT_STRUCT.pack(offset, length, generation))
+    return descriptor
+
+
+def decode_shm(data, offset):
+    '''read a shared memory descriptor at offset, returns (shm.RCoreShmSlot,
+    next offset)'''
+    namelen = SHM_NAME_STRUCT.unpack_from(data, offset)[0]
+    offset += SHM_NAME_STRUCT.size
+    name = bytes(bytearray(data[offset:offset+namelen]))
+    offset += namelen
+    slot = SHM_SLOT_STRUCT.unpack_from(data, offset)
+    offset += SHM_SLOT_STRUCT.size
+    return shm.attach(name).slot(*slot), offset
+
+
+def pack_messages(messages):
+    '''pack a list of messages (lists of frames) into one bytearray'''
+    data = bytearray()
+    for frames in messages:
+        data.extend(PACKED_FRAME_COUNT_STRUCT.pack(len(frames)))
+        for frame in frames:
+            frame = memoryview(frame)
+            data.extend(PACKED_FRAME_LENGTH_STRUCT.pack(len(frame)))
+            data.extend(frame)
+    return data
+
+
+def unpack_messages(data):
+    '''return the messages packed by pack_messages, frames are views into
+    data'''
+    messages = []
+    offset = 0
+    while offset < len(data):
+        count = PACKED_FRAME_COUNT_STRUCT.unpack_from(data, offset)[0]
+        offset += PACKED_FRAME_COUNT_STRUCT.size
+        frames = []
+        for i in range(count):
+            length = PACKED_FRAME_LENGTH_STRUCT.unpack_from(data, offset)[0]
+            offset += PACKED_FRAME_LENGTH_STRUCT.size
+            frames.append(shm.view(data, offset, length))
+            offset += length
+        messages.append(frames)
+    return messages
 
 
 class RCoreEventTypeBuilder(object):
     def __init__(self, name):
         self.name = name
         self.dataTypes = []
+        self.names = []
+        self.options = {}
 
-    def add_byte(self):
-        self.dataTypes.append(MSG_DATA_TYPE_BYTE)
+    def with_header(self):
+        '''send events with a timestamp and sequence number header'''
+        self.options['header'] = True
         return self
 
-    def add_int(self):
-        self.dataTypes.append(MSG_DATA_TYPE_INT)
-        return self
+    def with_compression(self, codec='zlib', minSize=COMPRESSION_MIN_SIZE,
+                         level=COMPRESSION_LEVEL):
+        '''compress bytea and json fields of at least minSize bytes
 
-    def add_long(self):
-        self.dataTypes.append(MSG_DATA_TYPE_LONG)
+        codec is one of COMPRESSION_CODECS, lz4 falls back to zlib when
+        the lz4 package is not installed. level only applies to zlib.
+        '''
+        if codec not in COMPRESSION_CODECS:
+            raise Exception("Unknown compression codec %s" % (codec))
+        self.options['compression'] = {'codec': codec,
+                                       'minSize': minSize,
+                                       'level': level}
         return self
 
-    def add_float(self):
-        self.dataTypes.append(MSG_DATA_TYPE_FLOAT)
-        return self
+    def with_priority(self, priority):
+        '''route events through the sockets of a priority class
 
-    def add_double(self):
-        self.dataTypes.append(MSG_DATA_TYPE_DOUBLE)
+        PRIORITY_HIGH is meant for small latency sensitive events, e.g.
+        motor commands, which then never queue behind bulk sensor data.
+        '''
+        if priority not in PRIORITIES:
+            raise Exception("Unknown priority %s" % (priority))
+        self.options['priority'] = priority
         return self
 
-    def add_string(self):
-        self.dataTypes.append(MSG_DATA_TYPE_STRING)
-        return self
+    def with_cache(self):
+        '''have the master keep the latest event, see RCoreMaster
 
-    def add_bytea(self):
-        self.dataTypes.append(MSG_DATA_TYPE_BYTEA)
+        Meant for slow changing state, e.g. calibration or modes. New
+        subscribers receive the cached event right away, and
+        RCoreClient.read_cache returns it on demand.
+        '''
+        self.options['cache'] = True
         return self
 
-    def add_json(self):
-        self.dataTypes.append(MSG_DATA_TYPE_JSON)
+    def add_field(self, dtype, name=None):
+        '''add a field of a MSG_DATA_TYPE, optionally named for lookups
+        with RCoreEvent[name]'''
+        if name is not None and name in self.names:
+            raise Exception("Duplicate field name %s" % (name))
+        self.dataTypes.append(dtype)
+        self.names.append(name)
         return self
 
+    def add_byte(self, name=None):
+        return self.add_field(MSG_DATA_TYPE_BYTE, name)
+
+    def add_int(self, name=None):
+        return self.add_field(MSG_DATA_TYPE_INT, name)
+
+    def add_long(self, name=None):
+        return self.add_field(MSG_DATA_TYPE_LONG, name)
+
+    def add_float(self, name=None):
+        return self.add_field(MSG_DATA_TYPE_FLOAT, name)
+
+    def add_double(self, name=None):
+        return self.add_field(MSG_DATA_TYPE_DOUBLE, name)
+
+    def add_string(self, name=None):
+        return self.add_field(MSG_DATA_TYPE_STRING, name)
+
+    def add_bytea(self, name=None):
+        return self.add_field(MSG_DATA_TYPE_BYTEA, name)
+
+    def add_json(self, name=None):
+        return self.add_field(MSG_DATA_TYPE_JSON, name)
+
+    def add_ndarray(self, name=None):
+        return self.add_field(MSG_DATA_TYPE_NDARRAY, name)
+
+    def add_shm_bytea(self, name=None):
+        return self.add_field(MSG_DATA_TYPE_SHM_BYTEA, name)
+
     def build(self):
-        return RCoreEventType(self.name, self.dataTypes)
+        if any(name is not None for name in self.names):
+            self.options['names'] = list(self.names)
+        return RCoreEventType(self.name, self.dataTypes, options=self.options)
 
 
 class RCoreEventType(object):
-    '''RobotCore Message Type'''
-    def __init__(self, name, dataTypes, id=None, lock=None):
+    '''RobotCore Message Type
+
+    options are negotiated with the master when registering, an event type
+    is only the same type with the same data types and options. With the
+    header option events carry an EVENT_HEADER_STRUCT header, with the
+    compression option bytea and json fields may be compressed, see
+    RCoreEventTypeBuilder.with_compression. The priority option selects
+    the sockets events are routed through, see with_priority. The names
+    option lists the field names, None for unnamed fields, none of them
+    in EVENT_RESERVED_FIELD_NAMES. Names are not part of the type's
+    identity, see layout_options.
+    '''
+    def __init__(self, name, dataTypes, id=None, lock=None, options=None):
         self.name = name
         self.id = id
         self.lock = lock
         self.count = len(dataTypes)
         self.dataTypes = dataTypes
+        self.options = dict(options) if options else {}
+        self.header = bool(self.options.get('header'))
+        self.compression = None
+        if self.options.get('compression'):
+            compression = self.options['compression']
+            codec = compression.get('codec', 'zlib')
+            if codec not in COMPRESSION_CODECS:
+                raise Exception("Unknown compression codec %s" % (codec))
+            self.compression = (COMPRESSION_CODECS[codec],
+                                compression.get('minSize',
+                                                COMPRESSION_MIN_SIZE),
+                                compression.get('level', COMPRESSION_LEVEL))
+        self.priority = self.options.get('priority', PRIORITY_NORMAL)
+        if self.priority not in PRIORITIES:
+            raise Exception("Unknown priority %s" % (self.priority))
+        self.cache = bool(self.options.get('cache'))
+        self.names = self.options.get('names')
+        self.fieldIndexes = {}
+        if self.names is not None:
+            if len(self.names) != self.count:
+                raise Exception("%s has %d field names for %d fields" %
+                                (name, len(self.names), self.count))
+            for i, fieldName in enumerate(self.names):
+                if fieldName is None:
+                    continue
+                if fieldName in EVENT_RESERVED_FIELD_NAMES:
+                    raise Exception("%s field name %s is reserved" %
+                                    (name, fieldName))
+                if fieldName in self.fieldIndexes:
+                    raise Exception("Duplicate field name %s" % (fieldName))
+                self.fieldIndexes[fieldName] = i
+        self.shmRing = None  # set by publishers of shm fields
+        self.compile()
 
         '''
         if self.count > 1:
@@ -113,15 +443,247 @@ class RCoreEventType(object):
                         )
         '''
 
+    def compile(self):
+        '''compile dataTypes into cached struct codecs
+
+        Each entry of segments is (start, end, codec), covering fields
+        [start, end). Runs of fixed size fields share a single
+        struct.Struct codec, variable length and frame fields have a codec
+        of None.
+
+        offsets holds the offset of each field in the event data, None for
+        fields following a variable size field, see RCoreEvent.field_offset.
+        bufferIndexes holds the index in buffers of each field's frame.
+        shmCount is the number of shared memory fields, events with any are
+        only readable on their publisher's host.
+        '''
+        self.structs = []
+        self.segments = []
+        self.offsets = []
+        self.bufferIndexes = []
+        self.bufferCount = 0
+        self.shmCount = 0
+        self.fixedSize = 0  # payload size if all fields are fixed size
+
+        start = 0
+        fmt = ''
+        offset = 0
+        for i in range(self.count):
+            dtype = self.dataTypes[i]
+            self.offsets.append(offset)
+            self.bufferIndexes.append(self.bufferCount)
+            if dtype in MSG_DATA_TYPES_FRAMES:
+                self.bufferCount += 1
+            if dtype in MSG_DATA_TYPES_SHM:
+                self.shmCount += 1
+            if dtype in MSG_DATA_TYPES_VARS or \
+                    dtype in MSG_DATA_TYPES_FRAMES or \
+                    dtype in MSG_DATA_TYPES_SHM:
+                if fmt:
+                    self.segments.append((start, i, struct.Struct('>' + fmt)))
+                self.segments.append((i, i+1, None))
+                self.structs.append(None)
+                start = i+1
+                fmt = ''
+                offset = None
+            else:
+                fmt += MSG_DATA_TYPE_STRUCT[dtype]['fmt']
+                self.structs.append(MSG_DATA_TYPE_STRUCT[dtype]['struct'])
+                if offset is not None:
+                    offset += MSG_DATA_TYPE_STRUCT[dtype]['size']
+        if fmt:
+            self.segments.append((start, self.count, struct.Struct('>' + fmt)))
+
+        if any(codec is None for codec in self.structs):
+            self.fixedSize = None
+        else:
+            self.fixedSize = sum(codec.size for codec in self.structs)
+
     def buildEvent(self):
         return RCoreEventBuilder(self)
 
+    def field_index(self, key):
+        '''return the index of a field given its name or index'''
+        if isinstance(key, (int, long)):
+            if key < -self.count or key >= self.count:
+                raise IndexError("%s has %d fields" % (self.name, self.count))
+            return key % self.count
+        index = self.fieldIndexes.get(key)
+        if index is None:
+            raise KeyError("%s has no field %s" % (self.name, key))
+        return index
+
+    def skip_field(self, data, index, offset):
+        '''return the offset following field index, which starts at offset,
+        reading at most its length'''
+        codec = self.structs[index]
+        dtype = self.dataTypes[index]
+        if codec is not None:
+            return offset + codec.size
+        elif dtype in MSG_DATA_TYPES_FRAMES:
+            dtypelen, ndim = NDARRAY_HEADER_STRUCT.unpack_from(data, offset)
+            return offset + NDARRAY_HEADER_STRUCT.size + dtypelen + 4 * ndim
+        elif dtype in MSG_DATA_TYPES_SHM:
+            namelen = SHM_NAME_STRUCT.unpack_from(data, offset)[0]
+            return offset + SHM_NAME_STRUCT.size + namelen + \
+                SHM_SLOT_STRUCT.size
+        elif index + 1 < self.count:
+            return offset + VAR_LENGTH_STRUCT.size + \
+                VAR_LENGTH_STRUCT.unpack_from(data, offset)[0]
+        else:
+            return len(data)
+
+    def read_field(self, data, index, offset, buffers=None):
+        '''decode field index at offset, returns (value, next offset)'''
+        codec = self.structs[index]
+        dtype = self.dataTypes[index]
+        if codec is not None:
+            return codec.unpack_from(data, offset)[0], offset + codec.size
+        elif dtype in MSG_DATA_TYPES_FRAMES:
+            return decode_ndarray(data, offset,
+                                  buffers[self.bufferIndexes[index]])
+        elif dtype in MSG_DATA_TYPES_SHM:
+            return decode_shm(data, offset)
+
+        if index + 1 < self.count:
+            lenval = VAR_LENGTH_STRUCT.unpack_from(data, offset)[0]
+            offset += VAR_LENGTH_STRUCT.size
+        else:
+            lenval = len(data) - offset
+        value = data[offset:offset+lenval]
+        if self.compression is not None and \
+                dtype in MSG_DATA_TYPES_COMPRESSIBLE:
+            value = decompress_var_data(value)
+        return decode_var_data(dtype, value), offset + lenval
+
+    def encode(self, *values):
+        '''build an event from all field values in one call'''
+        if len(values) != self.count:
+            raise Exception("Expected %d values for %s, got %d" %
+                            (self.count, self.name, len(values)))
+
+        buffer = bytearray()
+        buffers = []
+        for start, end, codec in self.segments:
+            dtype = self.dataTypes[start]
+            if codec is not None:
+                buffer.extend(codec.pack(*values[start:end]))
+            elif dtype in MSG_DATA_TYPES_FRAMES:
+                header, value = encode_ndarray(values[start])
+                buffer.extend(header)
+                buffers.append(value)
+            elif dtype in MSG_DATA_TYPES_SHM:
+                buffer.extend(encode_shm(self, values[start]))
+            else:
+                value = prepare_var_data(dtype, values[start])
+                if self.compression is not None and \
+                        dtype in MSG_DATA_TYPES_COMPRESSIBLE:
+                    value = compress_var_data(self.compression, value)
+                if end < self.count:
+                    buffer.extend(VAR_LENGTH_STRUCT.pack(len(value)))
+                buffer.extend(value)
+
+        return RCoreEvent(self, buffer, buffers)
+
+    def decode(self, data, offset=0, buffers=None):
+        '''read all field values of event data in one call'''
+        values = []
+        bufferIndex = 0
+        for start, end, codec in self.segments:
+            if codec is not None:
+                values.extend(codec.unpack_from(data, offset))
+                offset += codec.size
+            elif self.dataTypes[start] in MSG_DATA_TYPES_FRAMES:
+                value, offset = decode_ndarray(data, offset,
+                                               buffers[bufferIndex])
+                bufferIndex += 1
+                values.append(value)
+            elif self.dataTypes[start] in MSG_DATA_TYPES_SHM:
+                value, offset = decode_shm(data, offset)
+                values.append(value)
+            else:
+                if end < self.count:
+                    lenval = VAR_LENGTH_STRUCT.unpack_from(data, offset)[0]
+                    offset += VAR_LENGTH_STRUCT.size
+                else:
+                    lenval = len(data) - offset
+                value = data[offset:offset+lenval]
+                offset += lenval
+                if self.compression is not None and \
+                        self.dataTypes[start] in MSG_DATA_TYPES_COMPRESSIBLE:
+                    value = decompress_var_data(value)
+                values.append(decode_var_data(self.dataTypes[start], value))
+        return values
+
+    def numpy_dtype(self, serialized=False):
+        '''return the numpy structured dtype of one event's fields
+
+        Only for event types of fixed size fields, named after the field
+        names, unnamed fields f0, f1, ... With serialized the type id (and
+        header fields) come first, matching the layout of serialize().
+        '''
+        if numpy is None:
+            raise Exception("numpy is required for batch decoding")
+        if self.fixedSize is None:
+            raise Exception("%s has variable length fields" % (self.name))
+
+        fields = []
+        if serialized:
+            fields.append(('id', '>i2'))
+            if self.header:
+                fields.extend(EVENT_HEADER_DTYPE)
+        for i in range(self.count):
+            name = self.names[i] if self.names is not None else None
+            fields.append((str(name) if name is not None else 'f%d' % (i),
+                           MSG_DATA_TYPE_STRUCT[self.dataTypes[i]]['numpy']))
+        return numpy.dtype(fields)
+
+    def decode_batch(self, events):
+        '''decode the fields of a list of events into a structured array'''
+        dtype = self.numpy_dtype()
+        data = b''.join([raw_bytes(evt.data) for evt in events])
+        if len(data) != len(events) * self.fixedSize:
+            raise Exception("Invalid %s events, expected %d bytes each" %
+                            (self.name, self.fixedSize))
+        return numpy.frombuffer(data, dtype=dtype)
+
+    def decode_buffer(self, data):
+        '''decode concatenated serialized events into a structured array
+
+        The array includes the id and any header fields, and is a view of
+        data, nothing is copied.
+        '''
+        array = numpy.frombuffer(data, dtype=self.numpy_dtype(True))
+        if (array['id'] != self.id).any():
+            raise Exception("Buffer holds events of other types than %s" %
+                            (self.name))
+        return array
+
+    def encode_batch(self, values):
+        '''build events from a structured array, or a sequence of tuples
+
+        Structured arrays are converted field by field in order, whatever
+        their names and byte order. The events share a single buffer.
+        '''
+        dtype = self.numpy_dtype()
+        if isinstance(values, numpy.ndarray) and values.dtype.names:
+            array = values.astype(dtype)
+        else:
+            array = numpy.array([tuple(value) for value in values],
+                                dtype=dtype)
+
+        data = memoryview(array.tobytes())
+        size = self.fixedSize
+        return [RCoreEvent(self, data[i*size:(i+1)*size])
+                for i in range(len(array))]
+
 
 class RCoreEventBuilder(object):
     '''Builder for a RobotCore event'''
     def __init__(self, eventType):
         self.eventType = eventType
         self.buffer = bytearray()
+        self.buffers = []
         self.index = 0
 
     def add(self, value):
@@ -129,22 +691,27 @@ class RCoreEventBuilder(object):
             raise Exception("Can't add to event, already %d items" %
                             (self.eventType.count))
 
+        codec = self.eventType.structs[self.index]
         dtype = self.eventType.dataTypes[self.index]
 
-        if dtype in MSG_DATA_TYPES_VARS:
-            if dtype == MSG_DATA_TYPE_STRING and type(value) != str:
-                value = str(value)
-            elif dtype == MSG_DATA_TYPE_JSON and \
-                    type(value) not in [str, unicode, bytearray]:
-                value = json.dumps(value)
+        if dtype in MSG_DATA_TYPES_FRAMES:
+            header, value = encode_ndarray(value)
+            self.buffer.extend(header)
+            self.buffers.append(value)
+        elif dtype in MSG_DATA_TYPES_SHM:
+            self.buffer.extend(encode_shm(self.eventType, value))
+        elif codec is None:
+            value = prepare_var_data(dtype, value)
+            if self.eventType.compression is not None and \
+                    dtype in MSG_DATA_TYPES_COMPRESSIBLE:
+                value = compress_var_data(self.eventType.compression, value)
 
             if (self.index+1) < self.eventType.count:
-                self.buffer.extend(struct.pack('>i', len(value)))
+                self.buffer.extend(VAR_LENGTH_STRUCT.pack(len(value)))
 
             self.buffer.extend(value)
         else:
-            fmt = '>%s' % (MSG_DATA_TYPE_STRUCT[dtype]['fmt'])
-            self.buffer.extend(struct.pack(fmt, value))
+            self.buffer.extend(codec.pack(value))
 
         self.index += 1
 
@@ -154,7 +721,8 @@ class RCoreEventBuilder(object):
         if self.index >= self.eventType.count:
             raise Exception("Can't add to event, already %d items" %
                             (self.eventType.count))
-        self.buffer.extend(struct.pack('>B', value))
+        self.buffer.extend(
+            MSG_DATA_TYPE_STRUCT[MSG_DATA_TYPE_BYTE]['struct'].pack(value))
         self.index += 1
         return self
 
@@ -162,7 +730,8 @@ class RCoreEventBuilder(object):
         if self.index >= self.eventType.count:
             raise Exception("Can't add to event, already %d items" %
                             (self.eventType.count))
-        self.buffer.extend(struct.pack('>i', value))
+        self.buffer.extend(
+            MSG_DATA_TYPE_STRUCT[MSG_DATA_TYPE_INT]['struct'].pack(value))
         self.index += 1
         return self
 
@@ -170,7 +739,8 @@ class RCoreEventBuilder(object):
         if self.index >= self.eventType.count:
             raise Exception("Can't add to event, already %d items" %
                             (self.eventType.count))
-        self.buffer.extend(struct.pack('>l', value))
+        self.buffer.extend(
+            MSG_DATA_TYPE_STRUCT[MSG_DATA_TYPE_LONG]['struct'].pack(value))
         self.index += 1
         return self
 
@@ -178,7 +748,8 @@ class RCoreEventBuilder(object):
         if self.index >= self.eventType.count:
             raise Exception("Can't add to event, already %d items" %
                             (self.eventType.count))
-        self.buffer.extend(struct.pack('>f', value))
+        self.buffer.extend(
+            MSG_DATA_TYPE_STRUCT[MSG_DATA_TYPE_FLOAT]['struct'].pack(value))
         self.index += 1
         return self
 
@@ -186,7 +757,8 @@ class RCoreEventBuilder(object):
         if self.index >= self.eventType.count:
             raise Exception("Can't add to event, already %d items" %
                             (self.eventType.count))
-        self.buffer.extend(struct.pack('>d', value))
+        self.buffer.extend(
+            MSG_DATA_TYPE_STRUCT[MSG_DATA_TYPE_DOUBLE]['struct'].pack(value))
         self.index += 1
         return self
 
@@ -197,7 +769,7 @@ class RCoreEventBuilder(object):
         if type(value) != str:
             value = str(value)
         if (self.index+1) < self.eventType.count:
-            self.buffer.extend(struct.pack('>i', len(value)))
+            self.buffer.extend(VAR_LENGTH_STRUCT.pack(len(value)))
 
         self.buffer.extend(value)
         self.index += 1
@@ -207,8 +779,10 @@ class RCoreEventBuilder(object):
         if self.index >= self.eventType.count:
             raise Exception("Can't add to event, already %d items" %
                             (self.eventType.count))
+        if self.eventType.compression is not None:
+            value = compress_var_data(self.eventType.compression, value)
         if (self.index+1) < self.eventType.count:
-            self.buffer.extend(struct.pack('>i', len(value)))
+            self.buffer.extend(VAR_LENGTH_STRUCT.pack(len(value)))
 
         self.buffer.extend(value)
         self.index += 1
@@ -220,45 +794,195 @@ class RCoreEventBuilder(object):
                             (self.eventType.count))
         if type(value) not in [str, unicode, bytearray]:
             value = json.dumps(value)
+        if self.eventType.compression is not None:
+            value = compress_var_data(self.eventType.compression, value)
         if (self.index+1) < self.eventType.count:
-            self.buffer.extend(struct.pack('>i', len(value)))
+            self.buffer.extend(VAR_LENGTH_STRUCT.pack(len(value)))
 
         self.buffer.extend(value)
         self.index += 1
         return self
 
+    def add_ndarray(self, value):
+        if self.index >= self.eventType.count:
+            raise Exception("Can't add to event, already %d items" %
+                            (self.eventType.count))
+        header, value = encode_ndarray(value)
+        self.buffer.extend(header)
+        self.buffers.append(value)
+        self.index += 1
+        return self
+
+    def add_shm_bytea(self, value):
+        if self.index >= self.eventType.count:
+            raise Exception("Can't add to event, already %d items" %
+                            (self.eventType.count))
+        self.buffer.extend(encode_shm(self.eventType, value))
+        self.index += 1
+        return self
+
     def build(self):
-        return RCoreEvent(self.eventType, self.buffer)
+        return RCoreEvent(self.eventType, self.buffer, self.buffers)
 
 
 class RCoreEvent(object):
-    '''RCore Event'''
-    def __init__(self, eventType, data):
+    '''RCore Event
+
+    buffers holds the data of frame fields (ndarray), which are sent as
+    separate frames following the serialized event.
+
+    header is (publisher, sequence, published, ingress) for event types
+    with the header option, set by stamp and stamp_ingress.
+
+    Fields can be read by name or index, evt['heading'], which decodes only
+    that field. Fields after variable size fields are located by skipping
+    over the fields before them, see field_offset.
+    '''
+    def __init__(self, eventType, data, buffers=None, header=None):
         self.eventType = eventType
         self.data = data
+        self.buffers = buffers if buffers is not None else []
+        self.header = header
         self.index = 0
         self.serialized = None
+        self.values = None
+        self.fieldOffsets = None
+        self.fieldValues = None
 
     def serialize(self):
         if self.serialized is None:
-            buffer = bytearray(struct.pack('>h', self.eventType.id))
+            buffer = bytearray(EVENT_TYPE_ID_STRUCT.pack(self.eventType.id))
+            if self.eventType.header:
+                buffer.extend(EVENT_HEADER_STRUCT.pack(
+                    *(self.header or (0, 0, 0, 0))))
             buffer.extend(self.data)
             self.serialized = buffer
             return buffer
         else:
             return self.serialized
 
+    def stamp(self, publisher, sequence, published=None):
+        '''set the publisher header fields, published defaults to now'''
+        if published is None:
+            published = timestamp_us()
+        self.header = (publisher, sequence, published, 0)
+        self.serialized = None
+
+    def stamp_ingress(self, ingress=None):
+        '''set the master ingress time of the header, defaults to now'''
+        if ingress is None:
+            ingress = timestamp_us()
+        self.header = self.header[:3] + (ingress,)
+        self.serialized = None
+
+    def __getitem__(self, key):
+        '''return a field value by name or index, decoding only that field
+        '''
+        index = self.eventType.field_index(key)
+        if self.values is not None:
+            return self.values[index]
+        if self.fieldValues is None:
+            self.fieldValues = {}
+        if index not in self.fieldValues:
+            self.fieldValues[index] = self.eventType.read_field(
+                self.data, index, self.field_offset(index), self.buffers)[0]
+        return self.fieldValues[index]
+
+    def field_offset(self, index):
+        '''return the offset of a field in data
+
+        Offsets of the fixed size prefix come from the event type. Later
+        fields are found by skipping from the closest known offset, reading
+        only length prefixes, and the offsets found are kept.
+        '''
+        offset = self.eventType.offsets[index]
+        if offset is not None:
+            return offset
+        if self.fieldOffsets is None:
+            self.fieldOffsets = list(self.eventType.offsets)
+
+        i = index
+        while self.fieldOffsets[i] is None:
+            i -= 1
+        offset = self.fieldOffsets[i]
+        while i < index:
+            offset = self.eventType.skip_field(self.data, i, offset)
+            i += 1
+            self.fieldOffsets[i] = offset
+        return offset
+
+    def serialize_frames(self):
+        '''return the list of frames to send for this event'''
+        return [self.serialize()] + self.buffers
+
     def reader(self):
         return RCoreEventReader(self)
 
+    def decode(self):
+        '''read all field values in one call
+
+        The values are decoded once and shared by every caller, e.g. all
+        listeners of the event, so they must not be modified.
+        '''
+        if self.values is None:
+            self.values = self.eventType.decode(self.data,
+                                                buffers=self.buffers)
+        return self.values
+
     @staticmethod
     def from_data(data, getEventForId):
-        eventTypeId = struct.unpack('>h', data[:2])[0]
+        eventTypeId = EVENT_TYPE_ID_STRUCT.unpack(data[:2])[0]
         eventType = getEventForId(eventTypeId)
-        eventData = data[2:]
+        offset = EVENT_TYPE_ID_STRUCT.size
+        header = None
+        if eventType is not None and eventType.header:
+            header = EVENT_HEADER_STRUCT.unpack_from(data, offset)
+            offset += EVENT_HEADER_STRUCT.size
+        eventData = data[offset:]
         if type(eventData) != bytearray:
             eventData = bytearray(eventData)
-        return RCoreEvent(eventType, eventData)
+        return RCoreEvent(eventType, eventData, header=header)
+
+    @staticmethod
+    def from_buffer(data, getEventForId):
+        '''parse an event without copying its payload
+
+        data can be a zmq.Frame, or anything exposing the buffer interface.
+        The event data is a memoryview into data, so data must not be
+        modified while the event is in use.
+        '''
+        view = data if type(data) == memoryview else memoryview(data)
+        eventTypeId = EVENT_TYPE_ID_STRUCT.unpack_from(view)[0]
+        eventType = getEventForId(eventTypeId)
+        offset = EVENT_TYPE_ID_STRUCT.size
+        header = None
+        if eventType is not None and eventType.header:
+            header = EVENT_HEADER_STRUCT.unpack_from(view, offset)
+            offset += EVENT_HEADER_STRUCT.size
+        evt = RCoreEvent(eventType, view[offset:], header=header)
+        evt.serialized = view
+        return evt
+
+    @staticmethod
+    def from_frames(frames, getEventForId):
+        '''parse all events of a multipart message without copying
+
+        A message holds one or more events, each followed by the frames of
+        its frame fields. Parsing stops after an event of unknown type
+        (eventType None), since its frames can't be skipped.
+        '''
+        events = []
+        i = 0
+        while i < len(frames):
+            evt = RCoreEvent.from_buffer(frames[i], getEventForId)
+            events.append(evt)
+            i += 1
+            if evt.eventType is None:
+                break
+            if evt.eventType.bufferCount:
+                evt.buffers = frames[i:i+evt.eventType.bufferCount]
+                i += evt.eventType.bufferCount
+        return events
 
 
 class RCoreEventReader(object):
@@ -270,6 +994,7 @@ class RCoreEventReader(object):
 
     def reset(self):
         self.data = self.event.data
+        self.offset = 0
         self.index = 0
 
     def read(self):
@@ -277,42 +1002,28 @@ class RCoreEventReader(object):
             raise Exception("Can't read more, already read %d items" %
                             (self.event.eventType.count))
 
-        value = None
-
-        dtype = self.event.eventType.dataTypes[self.index]
-        if dtype == MSG_DATA_TYPE_STRING:
-            value = self.read_var_data().decode()
-        elif dtype == MSG_DATA_TYPE_BYTEA:
-            value = self.read_var_data()
-        elif dtype == MSG_DATA_TYPE_JSON:
-            value = json.loads(self.read_var_data().decode())
-        else:
-            fmt = '>%s' % (MSG_DATA_TYPE_STRUCT[dtype]['fmt'])
-            size = MSG_DATA_TYPE_STRUCT[dtype]['size']
-            value = struct.unpack(fmt, self.data[:size])[0]
-            self.data = self.data[size:]
-
+        value, self.offset = self.event.eventType.read_field(
+            self.data, self.index, self.offset, self.event.buffers)
         self.index += 1
 
         return value
 
-    def read_var_data(self):
-        value = None
-        if (self.index+1) < self.event.eventType.count:
-            lensize = MSG_DATA_TYPE_STRUCT[MSG_DATA_TYPE_INT]['size']
-            lenval = struct.unpack('>i', self.data[:lensize])[0]
-            value = self.data[lensize:lensize+lenval]
-            self.data = self.data[lensize+lenval:]
-        else:
-            value = self.data
-            self.data = None
-        return value
+    def skip(self):
+        '''move past the next field without decoding it'''
+        if self.index >= self.event.eventType.count:
+            raise Exception("Can't skip more, already read %d items" %
+                            (self.event.eventType.count))
+
+        self.offset = self.event.eventType.skip_field(self.data, self.index,
+                                                      self.offset)
+        self.index += 1
 
 
 EVT_TYPE_MGT_REGISTER_EVENT_TYPE = \
     RCoreEventTypeBuilder('register_event_type') \
     .add_string() \
     .add_bytea() \
+    .add_json() \
     .build()
 
 EVT_TYPE_MGT_REGISTER_EVENT_TYPE_RESP = \
@@ -330,19 +1041,137 @@ EVT_TYPE_MGT_READ_EVENT_TYPE_RESP = \
     .add_int() \
     .add_string() \
     .add_bytea() \
+    .add_json() \
     .build()
 
 EVT_TYPE_MGT_EVENT_RESP = \
     RCoreEventTypeBuilder('event_response') \
     .build()
 
+EVT_TYPE_MGT_READ_STATS = \
+    RCoreEventTypeBuilder('read_stats') \
+    .build()
+
+EVT_TYPE_MGT_READ_STATS_RESP = \
+    RCoreEventTypeBuilder('read_stats_response') \
+    .add_json() \
+    .build()
+
+EVT_TYPE_MGT_LIST_EVENT_TYPES = \
+    RCoreEventTypeBuilder('list_event_types') \
+    .add_int() \
+    .build()
+
+EVT_TYPE_MGT_LIST_EVENT_TYPES_RESP = \
+    RCoreEventTypeBuilder('list_event_types_response') \
+    .add_json() \
+    .build()
+
+# published by the master when the set of subscribed event types changes
+EVT_TYPE_MGT_SUBSCRIPTIONS = \
+    RCoreEventTypeBuilder('subscriptions') \
+    .add_json() \
+    .build()
+
+EVT_TYPE_MGT_READ_CACHE = \
+    RCoreEventTypeBuilder('read_cache') \
+    .add_json() \
+    .build()
+
+# cached messages packed with pack_messages
+EVT_TYPE_MGT_READ_CACHE_RESP = \
+    RCoreEventTypeBuilder('read_cache_response') \
+    .add_bytea() \
+    .build()
+
+# reply to a management request that failed, with the error message
+EVT_TYPE_MGT_ERROR_RESP = \
+    RCoreEventTypeBuilder('error_response') \
+    .add_string() \
+    .build()
+
 EVT_TYPE_MGT_TYPES = [
     EVT_TYPE_MGT_REGISTER_EVENT_TYPE,
     EVT_TYPE_MGT_REGISTER_EVENT_TYPE_RESP,
     EVT_TYPE_MGT_READ_EVENT_TYPE,
     EVT_TYPE_MGT_READ_EVENT_TYPE_RESP,
-    EVT_TYPE_MGT_EVENT_RESP
+    EVT_TYPE_MGT_EVENT_RESP,
+    EVT_TYPE_MGT_READ_STATS,
+    EVT_TYPE_MGT_READ_STATS_RESP,
+    EVT_TYPE_MGT_LIST_EVENT_TYPES,
+    EVT_TYPE_MGT_LIST_EVENT_TYPES_RESP,
+    EVT_TYPE_MGT_SUBSCRIPTIONS,
+    EVT_TYPE_MGT_READ_CACHE,
+    EVT_TYPE_MGT_READ_CACHE_RESP,
+    EVT_TYPE_MGT_ERROR_RESP
 ]
 
+# ids below this are reserved for the MGT interface
+EVT_TYPE_FIRST_ID = 100
+
 for i in range(len(EVT_TYPE_MGT_TYPES)):
     EVT_TYPE_MGT_TYPES[i].id = (i+1)
+
+
+def event_type_entry(eventType, version):
+    '''return the catalog entry of an event type, suitable for json'''
+    return {'id': eventType.id,
+            'name': eventType.name,
+            'dataTypes': list(eventType.dataTypes),
+            'options': eventType.options,
+            'version': version}
+
+
+def layout_options(options):
+    '''return the options of an event type that affect its wire format
+
+    Field names are only labels for reading, event types that differ only
+    by their names are the same type.
+    '''
+    options = dict(options or {})
+    options.pop('names', None)
+    return options
+
+
+def update_event_types(typesByName, typesById, catalog):
+    '''apply a list_event_types catalog to a client registry
+
+    A full catalog replaces all non MGT event types.
+    '''
+    if catalog['full']:
+        # several ids can share a name after it is re-registered
+        mgtTypes = [eventType for eventType in typesById.values()
+                    if eventType.id < EVT_TYPE_FIRST_ID]
+        typesByName.clear()
+        typesById.clear()
+        for eventType in mgtTypes:
+            typesByName[eventType.name] = eventType
+            typesById[eventType.id] = eventType
+
+    # in version order, so a re-registered name maps to its latest type
+    for entry in sorted(catalog['types'], key=lambda entry: entry['version']):
+        eventType = RCoreEventType(str(entry['name']), entry['dataTypes'],
+                                   id=entry['id'],
+                                   options=entry.get('options'))
+        typesByName[eventType.name] = eventType
+        typesById[eventType.id] = eventType
+
+
+def save_registry(path, catalog):
+    '''write a registry snapshot (a list_event_types catalog) to path
+
+    The file is replaced atomically, so a crash never leaves a partial
+    registry behind.
+    '''
+    tmppath = '%s.tmp' % (path)
+    with open(tmppath, 'w') as f:
+        json.dump(catalog, f, indent=1, sort_keys=True)
+    os.rename(tmppath, path)
+
+
+def load_registry(path):
+    '''read a registry snapshot written by save_registry, None if missing'''
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+host.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+"""
+
+
+import importlib
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import traceback
+
+import rcorelib
+import dispatch
+
+HOST_WORKERS = multiprocessing.cpu_count()
+HOST_RESTART_DELAY = 1.0  # seconds before restarting a dead worker
+HOST_STOP_TIMEOUT = 5.0  # seconds workers get to stop before termination
+
+
+class RCoreComponent(object):
+    '''Base class of components run by RCoreHost
+
+    start is called with an RCoreComponentContext before the worker starts
+    receiving events, so listeners must be registered there. stop is
+    called when the host shuts down.
+    '''
+    def __init__(self, name=None):
+        self.name = name or self.__class__.__name__
+        self.context = None
+
+    def start(self, context):
+        self.context = context
+
+    def stop(self):
+        pass
+
+
+class RCoreComponentContext(object):
+    '''A component's access to its worker's shared RCoreClient
+
+    Listeners are called from the worker's dispatcher threads, so sending
+    is serialized by a lock shared by the worker's components. Events
+    passed to listeners are shared by all co-located listeners of their
+    type, and decoded once, so they must not be modified.
+    '''
+    def __init__(self, client, name, sendLock):
+        self.client = client
+        self.name = name
+        self.sendLock = sendLock
+
+    def read_event_type(self, name):
+        return self.client.read_event_type(name)
+
+    def register_event_type(self, eventType):
+        return self.client.register_event_type(eventType)
+
+    def register_event_types(self, eventTypes):
+        return self.client.register_event_types(eventTypes)
+
+    def register_listener(self, eventTypeName, callback, **kwargs):
+        '''see RCoreClient.register_listener, only call from start'''
+        return self.client.register_listener(eventTypeName, callback,
+                                             **kwargs)
+
+    def send(self, evt, ack=False):
+        with self.sendLock:
+            self.client.send(evt, ack)
+
+    def send_many(self, events):
+        with self.sendLock:
+            self.client.send_many(events)
+
+    def has_subscribers(self, eventType):
+        with self.sendLock:
+            return self.client.has_subscribers(eventType)
+
+    def read_cache(self, eventTypeNames=None):
+        return self.client.read_cache(eventTypeNames)
+
+    def read_stats(self):
+        return self.client.read_stats()
+
+
+def load_component(spec):
+    '''create a component from a spec
+
+    A spec is a 'package.module:Class' string, or a callable returning a
+    component, e.g. the class itself.
+    '''
+    if callable(spec):
+        return spec()
+    moduleName, sep, className = spec.partition(':')
+    if not sep:
+        raise Exception("Invalid component %s, expected module:Class" %
+                        (spec))
+    return getattr(importlib.import_module(moduleName), className)()
+
+
+def run_worker(server, specs, transport):
+    '''worker process entrypoint, runs specs' components until SIGTERM'''
+    stopped = threading.Event()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the host stops workers
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+
+    client = rcorelib.RCoreClient(server, 'rcorehost-%d' % (os.getpid()),
+                                  dispatcher=dispatch.RCoreDispatcher(),
+                                  transport=transport)
+    sendLock = threading.Lock()
+    started = []
+    try:
+        for spec in specs:
+            component = load_component(spec)
+            component.start(RCoreComponentContext(client, component.name,
+                                                  sendLock))
+            started.append(component)
+            print 'Started component %s [pid=%d]' % (component.name,
+                                                     os.getpid())
+
+        client.start()
+        while not stopped.wait(1.0):
+            pass
+    except:
+        traceback.print_exc()
+    finally:
+        for component in reversed(started):
+            try:
+                component.stop()
+            except:
+                traceback.print_exc()
+        client.close()
+
+
+class RCoreHost(object):
+    '''Runs components in a pool of worker processes
+
+    Components are spread round robin over the workers. The components of
+    a worker share one RCoreClient: one set of connections to the master,
+    one subscription per event type, and each received event is parsed
+    and decoded once for all of its listeners. Separate worker processes
+    sidestep the GIL.
+
+    components are specs for load_component, loaded in the workers. A
+    worker that dies is restarted with all of its components. Workers are
+    stopped with SIGTERM, rather than through a shared multiprocessing
+    primitive that a dying worker could leave locked.
+    '''
+    def __init__(self, server, components, workers=HOST_WORKERS,
+                 transport=rcorelib.TRANSPORT_TCP):
+        self.server = server
+        self.transport = transport
+        workers = max(1, min(workers, len(components)))
+        self.assignments = [components[i::workers] for i in range(workers)]
+        self.processes = [None] * workers
+        self.stopped = threading.Event()
+
+    def start_worker(self, i):
+        process = multiprocessing.Process(
+            target=run_worker,
+            args=(self.server, self.assignments[i], self.transport))
+        process.daemon = True
+        process.start()
+        self.processes[i] = process
+
+    def start(self):
+        for i in range(len(self.assignments)):
+            self.start_worker(i)
+
+    def run(self):
+        '''start the workers and supervise them until stopped'''
+        self.start()
+        try:
+            while not self.stopped.wait(HOST_RESTART_DELAY):
+                for i, process in enumerate(self.processes):
+                    if not process.is_alive():
+                        print 'Worker %d exited with %s, restarting' % (
+                            process.pid, process.exitcode)
+                        self.start_worker(i)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        '''stop the workers, killing those still running after
+        HOST_STOP_TIMEOUT'''
+        self.stopped.set()
+        processes = [process for process in self.processes
+                     if process is not None and process.is_alive()]
+        for process in processes:
+            process.terminate()
+        deadline = time.time() + HOST_STOP_TIMEOUT
+        for process in processes:
+            process.join(max(0, deadline - time.time()))
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGKILL)
+                process.join()
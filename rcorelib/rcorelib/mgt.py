@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+mgt.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+"""
+
+import itertools
+import struct
+import threading
+import traceback
+
+import zmq
+
+MGT_TIMEOUT = 30.0
+
+CORRELATION_STRUCT = struct.Struct('>I')
+
+
+class RCoreMgtTimeout(Exception):
+    pass
+
+
+class RCoreFuture(object):
+    '''Result of a management call, set by the channel's I/O thread'''
+    def __init__(self, correlationId=None):
+        self.correlationId = correlationId
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+    def set_result(self, value):
+        self.value = value
+        self.event.set()
+
+    def set_exception(self, error):
+        self.error = error
+        self.event.set()
+
+    def done(self):
+        return self.event.is_set()
+
+    def result(self, timeout=None):
+        '''wait for the result, raises RCoreMgtTimeout after timeout'''
+        if not self.event.wait(timeout):
+            raise RCoreMgtTimeout("Management call timed out after %ss" %
+                                  (timeout))
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class RCoreMgtChannel(object):
+    '''Pipelined management calls over a DEALER socket
+
+    Each request is sent as [correlation id, '', frames...]. The master's
+    ROUTER and REP workers keep everything before the empty frame as the
+    reply envelope, so replies come back tagged with the id and can be
+    matched to their call in any order.
+
+    The DEALER socket is owned by an I/O thread. Callers on any thread hand
+    requests to it over an inproc socket, guarded by a lock that is only
+    held while sending.
+    '''
+    def __init__(self, ctx, endpoint):
+        self.ctx = ctx
+        self.pending = {}
+        self.pendingLock = threading.Lock()
+        self.ids = itertools.count(1)
+
+        self.sockMgt = ctx.socket(zmq.DEALER)
+        self.sockMgt.connect(endpoint)
+
+        requestsEndpoint = 'inproc://rcore-mgt-%x' % (id(self))
+        self.sockRequests = ctx.socket(zmq.PAIR)
+        self.sockRequests.bind(requestsEndpoint)
+        self.sockCalls = ctx.socket(zmq.PAIR)
+        self.sockCalls.connect(requestsEndpoint)
+        self.callsLock = threading.Lock()
+
+        self.t = threading.Thread(target=self.run)
+        self.t.daemon = True
+        self.t.start()
+
+    def call(self, frames):
+        '''send a request, returns an RCoreFuture of the reply frame'''
+        correlationId = CORRELATION_STRUCT.pack(next(self.ids) & 0xffffffff)
+        future = RCoreFuture(correlationId)
+        with self.pendingLock:
+            self.pending[correlationId] = future
+        with self.callsLock:
+            self.sockCalls.send_multipart([correlationId] + frames,
+                                          copy=False)
+        return future
+
+    def cancel(self, future):
+        '''forget a call, e.g. after it timed out, its reply is dropped'''
+        with self.pendingLock:
+            self.pending.pop(future.correlationId, None)
+
+    def close(self):
+        with self.callsLock:
+            self.sockCalls.send('')  # asks the I/O thread to exit
+        self.t.join()
+        self.sockCalls.close()
+
+        with self.pendingLock:
+            pending = self.pending.values()
+            self.pending = {}
+        for future in pending:
+            future.set_exception(Exception("Management channel closed"))
+
+    def run(self):
+        '''I/O thread entrypoint'''
+        poller = zmq.Poller()
+        poller.register(self.sockRequests, zmq.POLLIN)
+        poller.register(self.sockMgt, zmq.POLLIN)
+        try:
+            while True:
+                socks = dict(poller.poll())
+
+                if socks.get(self.sockRequests) == zmq.POLLIN:
+                    frames = self.sockRequests.recv_multipart(copy=False)
+                    if len(frames) == 1:
+                        return
+                    self.sockMgt.send_multipart(
+                        [frames[0], ''] + frames[1:], copy=False)
+
+                if socks.get(self.sockMgt) == zmq.POLLIN:
+                    frames = self.sockMgt.recv_multipart()
+                    with self.pendingLock:
+                        future = self.pending.pop(frames[0], None)
+                    if future is not None:
+                        future.set_result(frames[2])
+        except zmq.ContextTerminated:
+            pass
+        except:
+            traceback.print_exc()
+        finally:
+            self.sockRequests.close(linger=0)
+            self.sockMgt.close(linger=0)
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+recorder.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+"""
+
+import bisect
+import mmap
+import os
+import re
+import struct
+import time
+
+import event
+import shm
+
+LOG_MAGIC = 'RCLG'
+LOG_VERSION = 1
+LOG_SEGMENT_SIZE = 64 * 1024 * 1024
+LOG_INDEX_FLUSH_INTERVAL = 1.0  # seconds of index entries a crash can lose
+LOG_TYPES_FILE = 'types.json'
+LOG_SEGMENT_RE = re.compile(r'^events-(\d+)\.log$')
+
+# magic, version
+LOG_HEADER_STRUCT = struct.Struct('>4sI')
+# timestamp, event type id, frame count, followed by the frame lengths
+LOG_ENTRY_STRUCT = struct.Struct('>dhH')
+LOG_FRAME_LENGTH_STRUCT = struct.Struct('>I')
+# timestamp, event type id, entry offset in its segment
+LOG_INDEX_STRUCT = struct.Struct('>dhQ')
+
+
+def segment_path(path, segment):
+    return os.path.join(path, 'events-%06d.log' % (segment))
+
+
+def index_path(path, segment):
+    return os.path.join(path, 'events-%06d.idx' % (segment))
+
+
+def list_segments(path):
+    '''return the segment numbers in a log directory, in order'''
+    segments = []
+    for filename in os.listdir(path):
+        match = LOG_SEGMENT_RE.match(filename)
+        if match:
+            segments.append(int(match.group(1)))
+    return sorted(segments)
+
+
+class RCoreRecorder(object):
+    '''Appends published messages to a segmented, memory-mapped log
+
+    Each segment is preallocated and mapped, entries are copied straight
+    into the mapping. A sidecar index per segment holds the timestamp,
+    event type id and offset of each entry, so readers can seek and filter
+    without scanning the payloads.
+
+    Recording into a directory that already holds a log appends new
+    segments. Index entries are written out at least every
+    LOG_INDEX_FLUSH_INTERVAL seconds of recorded time, and on each segment
+    roll, so a crashed recorder loses at most that much of its index. Call
+    flush_index when idle to write out the rest. Not thread-safe.
+    '''
+    def __init__(self, path, segmentSize=LOG_SEGMENT_SIZE):
+        self.path = path
+        self.segmentSize = segmentSize
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        segments = list_segments(self.path)
+        self.segment = segments[-1] + 1 if segments else 0
+        self.mmap = None
+        self.index = None
+        self.indexFlushed = 0.0
+        self.open_segment(self.segmentSize)
+
+    def open_segment(self, size):
+        f = open(segment_path(self.path, self.segment), 'w+b')
+        try:
+            f.truncate(size)
+            self.mmap = mmap.mmap(f.fileno(), size)
+        finally:
+            f.close()
+
+        LOG_HEADER_STRUCT.pack_into(self.mmap, 0, LOG_MAGIC, LOG_VERSION)
+        self.size = size
+        self.offset = LOG_HEADER_STRUCT.size
+        self.index = open(index_path(self.path, self.segment), 'wb')
+
+    def close_segment(self):
+        '''unmap the current segment and trim it to the data written'''
+        self.mmap.close()
+        self.mmap = None
+        with open(segment_path(self.path, self.segment), 'r+b') as f:
+            f.truncate(self.offset)
+        self.index.close()
+        self.index = None
+
+    def roll(self, entrySize):
+        '''start a new segment, large enough for an entry of entrySize'''
+        self.close_segment()
+        self.segment += 1
+        self.open_segment(max(self.segmentSize,
+                              LOG_HEADER_STRUCT.size + entrySize))
+
+    def record(self, timestamp, eventTypeId, frames):
+        '''append a message (a list of frames) published at timestamp'''
+        lengths = [len(frame) for frame in frames]
+        size = LOG_ENTRY_STRUCT.size + \
+            LOG_FRAME_LENGTH_STRUCT.size * len(frames) + sum(lengths)
+        if self.offset + size > self.size:
+            self.roll(size)
+
+        entryOffset = self.offset
+        LOG_ENTRY_STRUCT.pack_into(self.mmap, self.offset,
+                                   timestamp, eventTypeId, len(frames))
+        self.offset += LOG_ENTRY_STRUCT.size
+        for length in lengths:
+            LOG_FRAME_LENGTH_STRUCT.pack_into(self.mmap, self.offset, length)
+            self.offset += LOG_FRAME_LENGTH_STRUCT.size
+        for frame, length in zip(frames, lengths):
+            shm.write_into(self.mmap, self.offset, frame)
+            self.offset += length
+
+        self.index.write(LOG_INDEX_STRUCT.pack(timestamp, eventTypeId,
+                                               entryOffset))
+        if timestamp - self.indexFlushed >= LOG_INDEX_FLUSH_INTERVAL:
+            self.flush_index(timestamp)
+
+    def flush_index(self, now=None):
+        '''write buffered index entries out to the index file'''
+        self.index.flush()
+        self.indexFlushed = now if now is not None else time.time()
+
+    def save_types(self, catalog):
+        '''store the event type catalog, needed to replay the log'''
+        event.save_registry(os.path.join(self.path, LOG_TYPES_FILE), catalog)
+
+    def flush(self):
+        self.mmap.flush()
+        self.index.flush()
+
+    def close(self):
+        if self.mmap is not None:
+            self.close_segment()
+
+
+class RCoreLogSegment(object):
+    '''A recorded segment, read through mmap, and its index'''
+    def __init__(self, path, segment):
+        with open(segment_path(path, segment), 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = LOG_HEADER_STRUCT.unpack_from(self.mmap, 0)
+        if magic != LOG_MAGIC or version != LOG_VERSION:
+            raise Exception("Invalid event log segment %s" %
+                            (segment_path(path, segment)))
+
+        with open(index_path(path, segment), 'rb') as f:
+            self.index = f.read()
+        self.count = len(self.index) // LOG_INDEX_STRUCT.size
+
+    def entry(self, i):
+        '''return (timestamp, event type id, offset) of index entry i'''
+        return LOG_INDEX_STRUCT.unpack_from(self.index,
+                                            i * LOG_INDEX_STRUCT.size)
+
+    def seek(self, timestamp):
+        '''return the first index entry at or after timestamp'''
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(mid)[0] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def frames(self, offset):
+        '''return the frames of the entry at offset, viewed in place'''
+        timestamp, eventTypeId, count = \
+            LOG_ENTRY_STRUCT.unpack_from(self.mmap, offset)
+        offset += LOG_ENTRY_STRUCT.size
+        lengths = [LOG_FRAME_LENGTH_STRUCT.unpack_from(
+            self.mmap, offset + i * LOG_FRAME_LENGTH_STRUCT.size)[0]
+            for i in range(count)]
+        offset += LOG_FRAME_LENGTH_STRUCT.size * count
+
+        frames = []
+        for length in lengths:
+            frames.append(shm.view(self.mmap, offset, length))
+            offset += length
+        return frames
+
+
+class RCoreLogReader(object):
+    '''Reads a log written by RCoreRecorder
+
+    Seeking to a time is a binary search over the segments, then over the
+    segment's index.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.segmentIds = list_segments(path)
+        self.segments = {}
+
+        # first timestamp of each non empty segment, for seeking
+        self.starts = []
+        self.startSegments = []
+        for segment in self.segmentIds:
+            if os.path.getsize(index_path(path, segment)) == 0:
+                continue
+            with open(index_path(path, segment), 'rb') as f:
+                data = f.read(LOG_INDEX_STRUCT.size)
+            self.starts.append(LOG_INDEX_STRUCT.unpack(data)[0])
+            self.startSegments.append(segment)
+
+    def segment(self, segment):
+        if segment not in self.segments:
+            self.segments[segment] = RCoreLogSegment(self.path, segment)
+        return self.segments[segment]
+
+    def types(self):
+        '''return the recorded event type catalog, None if missing'''
+        return event.load_registry(os.path.join(self.path, LOG_TYPES_FILE))
+
+    def time_range(self):
+        '''return the (first, last) timestamp recorded, None if empty'''
+        if not self.starts:
+            return None
+        last = self.segment(self.startSegments[-1])
+        return self.starts[0], last.entry(last.count - 1)[0]
+
+    def entries(self, start=None, end=None, eventTypeIds=None):
+        '''yield (timestamp, event type id, frames) in recorded order
+
+        Only entries in [start, end) and, if given, of eventTypeIds are
+        read. Frames are views into the log and are only valid until the
+        reader is closed.
+        '''
+        first = 0
+        if start is not None:
+            first = max(0, bisect.bisect_right(self.starts, start) - 1)
+
+        for segment in self.startSegments[first:]:
+            seg = self.segment(segment)
+            i = seg.seek(start) if start is not None else 0
+            while i < seg.count:
+                timestamp, eventTypeId, offset = seg.entry(i)
+                if end is not None and timestamp >= end:
+                    return
+                if eventTypeIds is None or eventTypeId in eventTypeIds:
+                    yield timestamp, eventTypeId, seg.frames(offset)
+                i += 1
+
+    def close(self):
+        for seg in self.segments.values():
+            seg.mmap.close()
+        self.segments = {}
+
+
+def replay(reader, client, start=None, end=None, eventTypeNames=None,
+           speed=1.0):
+    '''republish recorded events through client, returns the count sent
+
+    Event types are registered with client's master, and ids rewritten
+    where they differ from the recording. speed scales the recorded
+    timing, 0 sends as fast as possible.
+    '''
+    recordedTypes = {}
+    catalog = reader.types()
+    if catalog is None:
+        raise Exception("No event types recorded in %s" % (reader.path))
+    for entry in catalog['types']:
+        recordedTypes[entry['id']] = event.RCoreEventType(
+            str(entry['name']), entry['dataTypes'], id=entry['id'],
+            options=entry.get('options'))
+
+    eventTypeIds = None
+    if eventTypeNames is not None:
+        eventTypeIds = set(eventTypeId
+                           for eventTypeId, eventType in recordedTypes.items()
+                           if eventType.name in eventTypeNames)
+
+    idMap = {}
+    sent = 0
+    first = None
+    began = time.time()
+    for timestamp, eventTypeId, frames in reader.entries(start, end,
+                                                         eventTypeIds):
+        if first is None:
+            first = timestamp
+        if speed > 0:
+            delay = (timestamp - first) / speed - (time.time() - began)
+            if delay > 0:
+                time.sleep(delay)
+
+        priority = recordedTypes[event.EVENT_TYPE_ID_STRUCT.unpack_from(
+            frames[0])[0]].priority
+        i = 0
+        while i < len(frames):
+            # a message can hold several events, each possibly with frames
+            recordedId = event.EVENT_TYPE_ID_STRUCT.unpack_from(frames[i])[0]
+            if recordedId not in idMap:
+                recorded = recordedTypes[recordedId]
+                idMap[recordedId] = client.register_event_type(
+                    event.RCoreEventType(recorded.name, recorded.dataTypes,
+                                         options=recorded.options)).id
+            if idMap[recordedId] != recordedId:
+                header = event.EVENT_TYPE_ID_STRUCT.pack(idMap[recordedId])
+                frames[i] = bytearray(header) + frames[i][len(header):]
+            i += 1 + recordedTypes[recordedId].bufferCount
+
+        client.send_frames(frames, priority)
+        sent += 1
+
+    return sent
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+shm.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+"""
+
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+SHM_MAGIC = 'RCSH'
+SHM_DEFAULT_SIZE = 64 * 1024 * 1024
+SHM_ATTACH_CHECK_INTERVAL = 1.0  # seconds between checks for stale rings
+
+# magic, data size, generation, head
+SHM_HEADER_STRUCT = struct.Struct('>4sQQQ')
+SHM_STATE_STRUCT = struct.Struct('>QQ')
+SHM_STATE_OFFSET = 12
+SHM_DATA_OFFSET = 64
+
+# ring names come off the wire, anything else could reach outside SHM_DIR
+SHM_NAME_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+SHM_NAME_INVALID_RE = re.compile(r'[^A-Za-z0-9_-]')
+
+
+def shm_path(name):
+    if not SHM_NAME_RE.match(name):
+        raise Exception("Invalid shared memory ring name %r" % (name))
+    return os.path.join(SHM_DIR, 'rcore-%s' % (name))
+
+
+def ring_name(label):
+    '''return a ring name for this process, made of label's valid
+    characters'''
+    return '%d-%s' % (os.getpid(), SHM_NAME_INVALID_RE.sub('_', label))
+
+
+def view(data, offset, length):
+    '''return a zero-copy view of length bytes of data at offset'''
+    try:
+        return buffer(data, offset, length)
+    except NameError:
+        return memoryview(data)[offset:offset+length]
+
+
+def write_into(mm, offset, data):
+    '''copy data into mmap mm at offset'''
+    if type(data) == memoryview:
+        data = data.tobytes()
+    try:
+        mm.seek(offset)
+        mm.write(buffer(data))
+    except NameError:
+        mm[offset:offset+len(data)] = data
+
+
+class RCoreShmRing(object):
+    '''Shared memory ring buffer with a single writer and many readers
+
+    The writer appends payloads to the ring, wrapping to the start (and
+    incrementing the generation) when a payload doesn't fit before the end.
+    A payload is located by (offset, length, generation), it stays valid
+    until the writer wraps around and reaches it again.
+
+    The writer moves the head before writing a payload, so a reader that
+    checks a slot is still valid after reading it knows the data it read
+    was not being overwritten. Readers map the ring read-only.
+    '''
+    def __init__(self, name, size=None):
+        self.name = name
+        self.path = shm_path(name)
+        self.lock = threading.Lock()  # guards writes
+
+        if size is not None:
+            # create (or take over) the ring as its writer
+            f = open(self.path, 'w+b')
+            f.truncate(SHM_DATA_OFFSET + size)
+            access = mmap.ACCESS_WRITE
+        else:
+            f = open(self.path, 'rb')
+            access = mmap.ACCESS_READ
+
+        try:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=access)
+            self.inode = os.fstat(f.fileno()).st_ino
+        finally:
+            f.close()
+
+        if size is not None:
+            SHM_HEADER_STRUCT.pack_into(self.mmap, 0, SHM_MAGIC, size, 0, 0)
+
+        magic, self.size, generation, head = \
+            SHM_HEADER_STRUCT.unpack_from(self.mmap, 0)
+        if magic != SHM_MAGIC:
+            raise Exception("Invalid shared memory ring %s" % (self.path))
+
+    def state(self):
+        '''return the writer's (generation, head)'''
+        return SHM_STATE_STRUCT.unpack_from(self.mmap, SHM_STATE_OFFSET)
+
+    def write(self, data):
+        '''copy data into the ring, returns (offset, length, generation)'''
+        length = len(data)
+        if length > self.size:
+            raise Exception("Payload of %d bytes larger than ring %s" %
+                            (length, self.name))
+
+        with self.lock:
+            generation, head = self.state()
+            if head + length > self.size:
+                generation += 1
+                head = 0
+
+            offset = head
+            SHM_STATE_STRUCT.pack_into(self.mmap, SHM_STATE_OFFSET,
+                                       generation, offset + length)
+
+            write_into(self.mmap, SHM_DATA_OFFSET + offset, data)
+
+        return offset, length, generation
+
+    def valid(self, offset, length, generation):
+        '''return true if the slot has not been overwritten'''
+        current, head = self.state()
+        if generation == current:
+            return True
+        elif generation == current - 1:
+            return offset >= head
+        return False
+
+    def slot(self, offset, length, generation):
+        return RCoreShmSlot(self, offset, length, generation)
+
+    def stale(self):
+        '''return true if the ring file was removed or replaced'''
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except OSError:
+            return True
+
+    def close(self):
+        self.mmap.close()
+
+    def unlink(self):
+        '''remove the ring file, mapped readers keep working'''
+        os.remove(self.path)
+
+
+class RCoreShmSlot(object):
+    '''A payload in a shared memory ring, read in place
+
+    data is a zero-copy view into the ring. It may be overwritten by the
+    writer at any time, so check valid() after using it, or use copy().
+    '''
+    def __init__(self, ring, offset, length, generation):
+        self.ring = ring
+        self.offset = offset
+        self.length = length
+        self.generation = generation
+        self.data = view(ring.mmap, SHM_DATA_OFFSET + offset, length)
+
+    def __len__(self):
+        return self.length
+
+    def valid(self):
+        return self.ring.valid(self.offset, self.length, self.generation)
+
+    def copy(self):
+        '''return a copy of the payload, raises if it was overwritten'''
+        if not self.valid():
+            raise Exception("Shared memory slot overwritten")
+        data = bytearray(self.data)
+        if not self.valid():
+            raise Exception("Shared memory slot overwritten")
+        return data
+
+
+attachedRings = {}
+attachedLock = threading.Lock()
+attachedChecked = [0.0]
+
+
+def attach(name):
+    '''return a reader of the named ring, shared by all callers
+
+    Rings whose file was removed or replaced, e.g. by a restarted writer,
+    are dropped when a new ring is attached, and at most every
+    SHM_ATTACH_CHECK_INTERVAL seconds.
+    '''
+    with attachedLock:
+        ring = attachedRings.get(name)
+        now = time.time()
+        if ring is None or \
+                now - attachedChecked[0] >= SHM_ATTACH_CHECK_INTERVAL:
+            attachedChecked[0] = now
+            for staleName in [staleName
+                              for staleName, attached in attachedRings.items()
+                              if attached.stale()]:
+                # not closed, slots still viewing it keep the mapping alive
+                # and it is unmapped once they are gone
+                del attachedRings[staleName]
+            ring = attachedRings.get(name)
+        if ring is None:
+            ring = RCoreShmRing(name)
+            attachedRings[name] = ring
+        return ring
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+stats.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+"""
+
+import threading
+
+HISTOGRAM_PERCENTILES = [50.0, 90.0, 99.0, 99.9]
+
+
+class RCoreHistogram(object):
+    '''Log-linear (HDR style) histogram of non-negative integer values
+
+    Values below 2**subBucketBits are counted exactly, larger values are
+    bucketed with a relative error of at most 2**-subBucketBits. Buckets
+    are stored sparsely, so memory only grows with the range of values
+    actually recorded. Not thread-safe.
+    '''
+    def __init__(self, subBucketBits=5):
+        self.subBucketBits = subBucketBits
+        self.subBucketCount = 1 << subBucketBits
+        self.reset()
+
+    def reset(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def index(self, value):
+        '''return the bucket index of value'''
+        if value < self.subBucketCount:
+            return value
+        shift = value.bit_length() - self.subBucketBits - 1
+        return ((shift + 1) << self.subBucketBits) + \
+            (value >> shift) - self.subBucketCount
+
+    def value(self, index):
+        '''return the highest value counted in bucket index'''
+        if index < self.subBucketCount:
+            return index
+        shift = (index >> self.subBucketBits) - 1
+        sub = (index & (self.subBucketCount - 1)) + self.subBucketCount
+        return ((sub + 1) << shift) - 1
+
+    def record(self, value, count=1):
+        value = int(value)
+        if value < 0:
+            value = 0
+
+        index = self.index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percentile):
+        '''return the value at percentile (0-100), None if empty'''
+        if self.count == 0:
+            return None
+
+        target = max(1, int(round(self.count * percentile / 100.0)))
+        seen = 0
+        for index in sorted(self.counts.keys()):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self.value(index), self.max)
+        return self.max
+
+    def snapshot(self, percentiles=HISTOGRAM_PERCENTILES):
+        '''return a dict of summary values, suitable for json'''
+        snapshot = {'count': self.count,
+                    'min': self.min,
+                    'max': self.max,
+                    'mean': float(self.total) / self.count
+                    if self.count else None}
+        for percentile in percentiles:
+            snapshot['p%s' % (('%g' % (percentile)).replace('.', '_'))] = \
+                self.percentile(percentile)
+        return snapshot
+
+
+class RCoreListenerStats(object):
+    '''Latency and loss stats of events with headers, for one listener
+
+    latency is from publishing to recording, delivery from the master
+    routing the event to recording, both in microseconds. gaps counts
+    sequence numbers skipped per publisher, late counts events arriving
+    after a later sequence number. Thread-safe.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = RCoreHistogram()
+        self.delivery = RCoreHistogram()
+        self.sequences = {}
+        self.received = 0
+        self.gaps = 0
+        self.late = 0
+
+    def record(self, header, now):
+        '''record an event header, received at now (in microseconds)'''
+        publisher, sequence, published, ingress = header
+        with self.lock:
+            self.received += 1
+            self.latency.record(now - published)
+            if ingress:
+                self.delivery.record(now - ingress)
+
+            last = self.sequences.get(publisher)
+            if last is None or sequence > last:
+                if last is not None:
+                    self.gaps += sequence - last - 1
+                self.sequences[publisher] = sequence
+            else:
+                self.late += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {'received': self.received,
+                    'gaps': self.gaps,
+                    'late': self.late,
+                    'publishers': len(self.sequences),
+                    'latency_us': self.latency.snapshot(),
+                    'delivery_us': self.delivery.snapshot()}
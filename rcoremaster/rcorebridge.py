@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+rcorebridge.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+
+
+Bridges the events of two or more masters, e.g. a robot and a base station.
+
+Usage: rcorebridge.py SERVER SERVER [SERVER...] [--batch-size N]
+                      [--batch-interval S]
+
+Only the event types with subscribers on the other side are forwarded.
+"""
+
+import argparse
+
+import rcorelib
+import rcorelib.bridge as rbridge
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='RobotCore federation bridge')
+    parser.add_argument('servers', nargs='+', help='masters to bridge')
+    parser.add_argument('--batch-size', type=int,
+                        default=rbridge.BRIDGE_BATCH_SIZE,
+                        help='max events per forwarded message')
+    parser.add_argument('--batch-interval', type=float,
+                        default=rbridge.BRIDGE_BATCH_INTERVAL,
+                        help='max seconds an event waits for its batch')
+    args = parser.parse_args()
+    if len(args.servers) < 2:
+        parser.error('at least two masters are required')
+
+    clients = [rcorelib.RCoreClient(server, 'rcorebridge')
+               for server in args.servers]
+    bridge = rbridge.RCoreBridge(clients, batchSize=args.batch_size,
+                                 batchInterval=args.batch_interval)
+    try:
+        bridge.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server, stats in zip(args.servers, bridge.stats()):
+            print '%s: forwarded %d events, dropped %d echoes and %d ' \
+                'of unknown types, %d event types not bridged' % (
+                    server, stats['forwarded'], stats['echoes'],
+                    stats['unknown'], stats['unbridged'])
+        for client in clients:
+            client.close()
+
+
+if __name__ == "__main__":
+    main()
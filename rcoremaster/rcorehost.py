@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+rcorehost.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+
+
+Runs components in a pool of worker processes sharing their connections.
+
+Usage: rcorehost.py [--server HOST] [--workers N] module:Class [...]
+
+Components subclass rcorelib.host.RCoreComponent and must be importable,
+e.g. through PYTHONPATH.
+"""
+
+import argparse
+
+import rcorelib.host as rhost
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='RobotCore component host')
+    parser.add_argument('--server', default='localhost',
+                        help='master to connect to')
+    parser.add_argument('--workers', type=int, default=rhost.HOST_WORKERS,
+                        help='worker processes, default one per cpu')
+    parser.add_argument('components', nargs='+',
+                        help='components to run, as module:Class')
+    args = parser.parse_args()
+
+    host = rhost.RCoreHost(args.server, args.components,
+                           workers=args.workers)
+    host.run()
+
+
+if __name__ == "__main__":
+    main()
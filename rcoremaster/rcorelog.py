@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+rcorelog.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+
+Records, inspects and replays RobotCore event logs.
+
+Usage: rcorelog.py record DIR
+       rcorelog.py info DIR
+       rcorelog.py replay DIR [--speed N] [--start T] [--end T] [--types A,B]
+
+A log can also be recorded by the master itself, with rcoremaster.py
+--record DIR. Start and end times are seconds relative to the start of the
+log. Events of shared memory fields reference rings that are gone once
+their writer exits, so they are not recorded.
+"""
+
+import argparse
+import os
+import time
+
+import zmq
+
+import rcorelib
+import rcorelib.event as revent
+import rcorelib.recorder as rrecorder
+
+
+def record(args):
+    '''record every published event until interrupted'''
+    recorder = rrecorder.RCoreRecorder(args.path)
+    client = rcorelib.RCoreClient(
+        args.server, 'rcorelog',
+        registryPath=os.path.join(args.path, rrecorder.LOG_TYPES_FILE))
+    poller = zmq.Poller()
+    for sock in client.sockSubs.values():
+        sock.setsockopt(zmq.SUBSCRIBE, '')
+        poller.register(sock, zmq.POLLIN)
+
+    count = 0
+    skipped = 0
+    try:
+        while True:
+            socks = dict(poller.poll(
+                rrecorder.LOG_INDEX_FLUSH_INTERVAL * 1000))
+            if not socks:
+                recorder.flush_index()  # idle, write out the rest
+                continue
+            sock = client.sockSubs[revent.PRIORITY_HIGH]
+            if socks.get(sock) != zmq.POLLIN:
+                sock = client.sockSub
+            frames = sock.recv_multipart(copy=False)
+            eventTypeId = revent.EVENT_TYPE_ID_STRUCT.unpack_from(
+                frames[0].buffer)[0]
+            # fetches and saves the catalog when a new type shows up
+            eventType = client.get_event_type_by_id(eventTypeId)
+            if eventType is None or eventType.shmCount:
+                skipped += 1
+                continue
+            recorder.record(time.time(), eventTypeId, frames)
+            count += 1
+    except KeyboardInterrupt:
+        print 'Recorded %d messages, skipped %d of unknown or shared ' \
+            'memory event types' % (count, skipped)
+    finally:
+        recorder.close()
+        client.close()
+
+
+def info(args):
+    reader = rrecorder.RCoreLogReader(args.path)
+    timeRange = reader.time_range()
+    if timeRange is None:
+        print 'Empty log'
+        return
+
+    catalog = reader.types() or {'types': []}
+    names = dict((entry['id'], entry['name']) for entry in catalog['types'])
+
+    counts = {}
+    sizes = {}
+    for timestamp, eventTypeId, frames in reader.entries():
+        counts[eventTypeId] = counts.get(eventTypeId, 0) + 1
+        sizes[eventTypeId] = sizes.get(eventTypeId, 0) + \
+            sum(len(frame) for frame in frames)
+
+    print 'Segments: %d' % (len(reader.segmentIds))
+    print 'Start:    %s' % (time.ctime(timeRange[0]))
+    print 'Duration: %.3fs' % (timeRange[1] - timeRange[0])
+    for eventTypeId in sorted(counts.keys()):
+        print '  %-32s [id=%d] %10d messages %14d bytes' % (
+            names.get(eventTypeId, '?'), eventTypeId,
+            counts[eventTypeId], sizes[eventTypeId])
+    reader.close()
+
+
+def replay(args):
+    reader = rrecorder.RCoreLogReader(args.path)
+    timeRange = reader.time_range()
+    if timeRange is None:
+        print 'Empty log'
+        return
+
+    start = timeRange[0] + args.start if args.start is not None else None
+    end = timeRange[0] + args.end if args.end is not None else None
+    eventTypeNames = args.types.split(',') if args.types else None
+
+    client = rcorelib.RCoreClient(args.server, 'rcorelog')
+    try:
+        sent = rrecorder.replay(reader, client, start=start, end=end,
+                                eventTypeNames=eventTypeNames,
+                                speed=args.speed)
+        print 'Replayed %d messages' % (sent)
+    finally:
+        client.close()
+        reader.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RobotCore event logs')
+    parser.add_argument('--server', default='localhost',
+                        help='master to record from or replay to')
+    commands = parser.add_subparsers()
+
+    parser_record = commands.add_parser(
+        'record', help='record published events until interrupted')
+    parser_record.add_argument('path', help='log directory')
+    parser_record.set_defaults(func=record)
+
+    parser_info = commands.add_parser('info', help='summarize a log')
+    parser_info.add_argument('path', help='log directory')
+    parser_info.set_defaults(func=info)
+
+    parser_replay = commands.add_parser('replay', help='republish a log')
+    parser_replay.add_argument('path', help='log directory')
+    parser_replay.add_argument('--speed', type=float, default=1.0,
+                               help='replay speed, 0 for as fast as possible')
+    parser_replay.add_argument('--start', type=float,
+                               help='seconds into the log to start at')
+    parser_replay.add_argument('--end', type=float,
+                               help='seconds into the log to stop at')
+    parser_replay.add_argument('--types',
+                               help='comma separated event types to replay')
+    parser_replay.set_defaults(func=replay)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -23,114 +23,712 @@ along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 # import sys
+import argparse
+import collections
+import json
+import struct
 import threading
 import traceback
 import time
+import uuid
 
 import zmq
 
 import rcorelib
 import rcorelib.event as revent
+import rcorelib.recorder as rrecorder
+import rcorelib.stats as rstats
 
 MGT_EVENT_RESP = revent.RCoreEventBuilder(revent.EVT_TYPE_MGT_EVENT_RESP) \
     .build()
+SUBSCRIPTIONS_PREFIX = struct.pack('>h', revent.EVT_TYPE_MGT_SUBSCRIPTIONS.id)
+
+DATA_RECV_BATCH = 256  # max normal priority data events routed per poll
+POLL_TIMEOUT = 1000  # ms, how often threads check the running flag
+MGT_WORKERS = 4
+CACHE_SIZE = 16 * 1024 * 1024  # bytes of events kept by the last value cache
+
+MGT_WORKERS_ENDPOINT = "inproc://rcoremaster-mgt-workers"
+DATA_INPROC_ENDPOINTS = {
+    revent.PRIORITY_NORMAL: "inproc://rcoremaster-data",
+    revent.PRIORITY_HIGH: "inproc://rcoremaster-data-high"
+}
+
+
+def default_transports():
+    '''tcp and inproc, plus ipc where supported'''
+    transports = [rcorelib.TRANSPORT_TCP, rcorelib.TRANSPORT_INPROC]
+    if zmq.has('ipc'):
+        transports.append(rcorelib.TRANSPORT_IPC)
+    return transports
+
+
+class RCoreLastValueCache(object):
+    '''Latest message of each cached event type, bounded in bytes
+
+    When full, the least recently updated or read messages are evicted
+    first. A message larger than the whole cache is not kept. Thread-safe.
+    '''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.messages = collections.OrderedDict()  # id -> (frames, size)
+        self.size = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def put(self, event_type_id, frames):
+        size = sum(len(frame) for frame in frames)
+        with self.lock:
+            old = self.messages.pop(event_type_id, None)
+            if old is not None:
+                self.size -= old[1]
+            if size > self.max_bytes:
+                return
+            self.messages[event_type_id] = (frames, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                evicted_id, evicted = self.messages.popitem(last=False)
+                self.size -= evicted[1]
+                self.evicted += 1
+
+    def get(self, event_type_id):
+        '''return the frames of the cached message, None if not cached'''
+        with self.lock:
+            entry = self.messages.pop(event_type_id, None)
+            if entry is None:
+                return None
+            self.messages[event_type_id] = entry
+            return entry[0]
+
+    def snapshot(self, event_type_ids=None):
+        '''return the cached messages, of event_type_ids if given'''
+        if event_type_ids is None:
+            with self.lock:
+                event_type_ids = self.messages.keys()
+        messages = []
+        for event_type_id in event_type_ids:
+            frames = self.get(event_type_id)
+            if frames is not None:
+                messages.append(frames)
+        return messages
+
+    def stats(self):
+        with self.lock:
+            return {'types': len(self.messages),
+                    'bytes': self.size,
+                    'evicted': self.evicted}
+
 
 class RCoreMaster(object):
-    '''Master RobotCore daemon'''
-    def __init__(self, ctx):
+    '''Master RobotCore daemon
+
+    Management requests are received on a ROUTER socket and proxied to a
+    pool of worker threads. Data events are routed to subscribers by a
+    separate data thread, so slow management requests never stall routing.
+
+    pub_hwm limits the events queued for each subscriber, zmq drops events
+    for a subscriber that falls further behind. zmq queues per subscriber,
+    not per type, per type limits and conflation are done by the clients.
+
+    With record_path every published message is appended to an event log
+    in that directory, see rcorelib.recorder. Event types with shared
+    memory fields are not recorded, their rings are gone on replay.
+
+    Events of types nobody subscribes to are dropped on arrival (unless
+    recording), and clients are told which types have subscribers with
+    subscriptions events, so they can skip sending the others.
+
+    Each event type priority class has its own data and publish sockets.
+    The data thread routes all pending high priority events before each
+    normal one, so a high priority event waits for at most one normal
+    event, e.g. an image, instead of the whole normal queue.
+
+    The latest event of types with the cache option is kept in a last value
+    cache of cache_size bytes, 0 disables it. A new subscription to a cached
+    type republishes its cached event right away, which existing
+    subscribers of the type receive again too. The read_cache command
+    returns all cached events at once.
+    '''
+    def __init__(self, ctx, mgt_workers=MGT_WORKERS, registry_path=None,
+                 transports=None, pub_hwm=None, record_path=None,
+                 cache_size=CACHE_SIZE):
+        self.ctx = ctx
+        self.transports = transports
+        if self.transports is None:
+            self.transports = default_transports()
         self.clients = {}
         self.types_by_id = {}
         self.types_by_name = {}
+        self.type_versions = {}
+        self.lock = threading.RLock()  # guards types_by_*, nextId, version
 
         for event_type in revent.EVT_TYPE_MGT_TYPES:
             self.types_by_name[event_type.name] = event_type
             self.types_by_id[event_type.id] = event_type
 
-        self.sock_mgt = ctx.socket(zmq.REP)
-        self.sock_mgt.bind("tcp://*:%d" % (rcorelib.PORT_MGT))
-
-        self.sock_pub = ctx.socket(zmq.PUB)
-        self.sock_pub.bind("tcp://*:%d" % (rcorelib.PORT_PUBSUB))
+        # registry version, incremented for every new event type
+        self.version = 0
+        self.nextId = revent.EVT_TYPE_FIRST_ID
+        self.registry_id = uuid.uuid4().hex
+        self.registry_path = registry_path
+        if self.registry_path is not None:
+            self.load_registry()
+
+        self.cache = None
+        if cache_size:
+            self.cache = RCoreLastValueCache(cache_size)
+
+        self.recorder = None
+        if record_path is not None:
+            self.recorder = rrecorder.RCoreRecorder(record_path)
+            self.recorder.save_types(self.list_event_types(0))
+
+        self.sock_mgt = ctx.socket(zmq.ROUTER)
+        self.bind_all(self.sock_mgt, rcorelib.PORT_MGT)
+
+        self.sock_mgt_workers = ctx.socket(zmq.DEALER)
+        self.sock_mgt_workers.bind(MGT_WORKERS_ENDPOINT)
+
+        # XPUB reports subscriptions, used to count subscribers per type
+        self.xpub_verboser = hasattr(zmq, 'XPUB_VERBOSER')
+        self.sock_pubs = {}
+        self.sock_datas = {}
+        for priority in revent.PRIORITIES:
+            sock_pub = ctx.socket(zmq.XPUB)
+            if self.xpub_verboser:
+                sock_pub.setsockopt(zmq.XPUB_VERBOSER, 1)
+            else:
+                sock_pub.setsockopt(zmq.XPUB_VERBOSE, 1)
+            if pub_hwm is not None:
+                sock_pub.setsockopt(zmq.SNDHWM, pub_hwm)
+            self.bind_all(sock_pub, rcorelib.PUBSUB_PORTS[priority])
+            self.sock_pubs[priority] = sock_pub
+
+            sock_data = ctx.socket(zmq.PULL)
+            self.bind_all(sock_data, rcorelib.DATA_PORTS[priority])
+            sock_data.bind(DATA_INPROC_ENDPOINTS[priority])
+            self.sock_datas[priority] = sock_data
+
+        # subscriptions events are published on the normal priority socket
+        self.sock_pub = self.sock_pubs[revent.PRIORITY_NORMAL]
+        self.sock_data = self.sock_datas[revent.PRIORITY_NORMAL]
+        self.sock_data_high = self.sock_datas[revent.PRIORITY_HIGH]
 
         self.running = False
-        self.t = threading.Thread(target=self.run)
-
-        self.nextId = 10   # first 10 reserved for MGT interface
+        self.threads = [threading.Thread(target=self.run_data),
+                        threading.Thread(target=self.run_mgt_proxy)]
+        for i in range(mgt_workers):
+            self.threads.append(threading.Thread(target=self.run_mgt_worker))
+
+        self.stats_lock = threading.Lock()  # guards topic_stats, subscriptions
+        self.topic_stats = {}
+        self.unknown_dropped = 0  # data messages with an unknown type id
+        self.subscriptions = {}
+        self.started = None
+
+        # event types with subscribers, only updated by the data thread
+        self.subscribed_all = self.recorder is not None
+        self.subscribed_ids = frozenset()
+        self.subscribed_counts = {}
+
+    def bind_all(self, sock, port):
+        '''bind sock to port on all configured transports'''
+        for transport in self.transports:
+            sock.bind(rcorelib.endpoint(transport, '*', port))
 
     def start(self):
         '''start running master daemon'''
         self.running = True
-        self.t.start()
+        self.started = time.time()
+        for t in self.threads:
+            t.daemon = True
+            t.start()
 
     def isAlive(self):
-        '''return true if master daemon is alive'''
-        if self.t is not None:
-            return self.t.isAlive()
+        '''return true if all master daemon threads are alive'''
+        if self.threads is not None:
+            return all(t.isAlive() for t in self.threads)
         return False
 
     def stop(self):
-        '''stop running thread'''
-        self.running = False
-        self.sock_mgt.close()
-        self.sock_pub.close()
-        self.t = None
+        '''stop running threads
 
-    def run(self):
-        '''Thread entrypoint'''
+        The data thread and workers exit within POLL_TIMEOUT, the management
+        proxy exits once the context is terminated.
+        '''
+        self.running = False
+        self.threads = None
+
+    def run_data(self):
+        '''Data thread entrypoint'''
+        poller = zmq.Poller()
+        for priority in revent.PRIORITIES:
+            poller.register(self.sock_datas[priority], zmq.POLLIN)
+            poller.register(self.sock_pubs[priority], zmq.POLLIN)
         try:
             while self.running:
-                data = self.sock_mgt.recv()
-
-                print 'MGT RCVD: %s' % (":".join("{:02x}".format(ord(c)) for c in data))
+                socks = dict(poller.poll(POLL_TIMEOUT))
+
+                for sock_pub in self.sock_pubs.values():
+                    if socks.get(sock_pub) == zmq.POLLIN:
+                        self.process_subscriptions(sock_pub)
+
+                if socks.get(self.sock_data_high) == zmq.POLLIN or \
+                        socks.get(self.sock_data) == zmq.POLLIN:
+                    self.process_data()
+                elif not socks and self.recorder is not None:
+                    self.recorder.flush_index()  # idle, write out the rest
+        except zmq.ContextTerminated:
+            pass
+        except:
+            print 'Error in Data Thread'
+            traceback.print_exc()
+        finally:
+            self.running = False
+            for priority in revent.PRIORITIES:
+                self.sock_datas[priority].close(linger=0)
+                self.sock_pubs[priority].close(linger=0)
+            if self.recorder is not None:
+                self.recorder.close()
+
+    def run_mgt_proxy(self):
+        '''Management proxy thread entrypoint'''
+        try:
+            zmq.proxy(self.sock_mgt, self.sock_mgt_workers)
+        except zmq.ContextTerminated:
+            pass
+        except:
+            print 'Error in MGT Proxy Thread'
+            traceback.print_exc()
+        finally:
+            self.running = False
+            self.sock_mgt.close(linger=0)
+            self.sock_mgt_workers.close(linger=0)
 
-                evt = revent.RCoreEvent \
-                    .from_data(data,
-                               lambda id: self.types_by_id[id])
-                
-                res = None
+    def run_mgt_worker(self):
+        '''Management worker thread entrypoint'''
+        sock = self.ctx.socket(zmq.REP)
+        sock.connect(MGT_WORKERS_ENDPOINT)
 
-                if evt.eventType.name == "register_event_type":
-                    res = self.process_register_event_type(evt)
-                elif evt.eventType.name == "read_event_type":
-                    res = self.process_read_event_type(evt)
-                else:
-                    res = self.process_event(evt, data)
+        sock_forwards = {}
+        for priority in revent.PRIORITIES:
+            sock_forwards[priority] = self.ctx.socket(zmq.PUSH)
+            sock_forwards[priority].connect(DATA_INPROC_ENDPOINTS[priority])
 
-                self.sock_mgt.send(res.serialize())
+        poller = zmq.Poller()
+        poller.register(sock, zmq.POLLIN)
+        try:
+            while self.running:
+                if poller.poll(POLL_TIMEOUT):
+                    self.process_mgt(sock, sock_forwards)
+        except zmq.ContextTerminated:
+            pass
         except:
-            print 'Error in MGT Thread'
+            print 'Error in MGT Worker Thread'
             traceback.print_exc()
-            self.running = False
+        finally:
+            sock.close(linger=0)
+            for sock_forward in sock_forwards.values():
+                sock_forward.close(linger=0)
+
+    def process_mgt(self, sock, sock_forwards):
+        '''process one request from a management worker socket
+
+        sock_forwards are the data thread's inproc sockets per priority.
+        Failed requests are answered with an error_response.
+        '''
+        frames = sock.recv_multipart(copy=False)
+        try:
+            res = self.process_mgt_request(frames, sock_forwards)
+        except zmq.ContextTerminated:
+            raise
+        except Exception as e:
+            print 'Error processing MGT request'
+            traceback.print_exc()
+            res = revent.RCoreEventBuilder(revent.EVT_TYPE_MGT_ERROR_RESP) \
+                .add(str(e)) \
+                .build()
+
+        sock.send(res.serialize())
+
+    def process_mgt_request(self, frames, sock_forwards):
+        '''return the response event of a management request'''
+        evt = revent.RCoreEvent.from_buffer(frames[0], self.types_by_id.get)
+        if evt.eventType is None:
+            raise Exception("Unknown event type id %d" %
+                            (revent.EVENT_TYPE_ID_STRUCT.unpack_from(
+                                frames[0])[0]))
+
+        res = None
+
+        if evt.eventType.name == "register_event_type":
+            res = self.process_register_event_type(evt)
+        elif evt.eventType.name == "read_event_type":
+            res = self.process_read_event_type(evt)
+        elif evt.eventType.name == "list_event_types":
+            res = revent.RCoreEventBuilder(
+                revent.EVT_TYPE_MGT_LIST_EVENT_TYPES_RESP) \
+                .add(self.list_event_types(evt.reader().read())) \
+                .build()
+        elif evt.eventType.name == "read_cache":
+            res = self.process_read_cache(evt)
+        elif evt.eventType.name == "read_stats":
+            res = revent.RCoreEventBuilder(
+                revent.EVT_TYPE_MGT_READ_STATS_RESP) \
+                .add(self.read_stats()) \
+                .build()
+        else:
+            # acknowledged publish, hand off to the data thread
+            sock_forwards[evt.eventType.priority].send_multipart(frames,
+                                                                 copy=False)
+            res = MGT_EVENT_RESP
+
+        return res
+
+    def process_data(self):
+        '''route events queued on the data sockets, high priority first
+
+        All pending high priority events are routed before each normal one.
+        '''
+        for i in range(DATA_RECV_BATCH):
+            while self.route_next(self.sock_data_high):
+                pass
+            if not self.route_next(self.sock_data):
+                return
+
+    def route_next(self, sock):
+        '''route the next message queued on a data socket, false if none'''
+        try:
+            frames = sock.recv_multipart(zmq.NOBLOCK, copy=False)
+        except zmq.Again:
+            return False
+
+        start = time.time()
+
+        events = self.parse_data_events(frames)
+        headers = False
+        for evt in events:
+            if evt.header is not None:
+                evt.stamp_ingress(int(start * 1e6))
+                headers = True
+            if evt.eventType.cache and self.cache is not None:
+                # cached even without subscribers, for later ones
+                self.cache.put(evt.eventType.id, evt.serialize_frames())
+        if headers:
+            self.record_publishers(events)
+        if len(events) == 1:
+            if not self.is_subscribed(events[0].eventType.id):
+                self.record_dropped(events[0].eventType.id, 1)
+                return True
+            self.process_event(events[0])
+            self.record_routed(events[0].eventType.id, 1, frames, start)
+        elif events:
+            self.process_batch(events, start)
+        return True
+
+    def process_subscriptions(self, sock_pub):
+        '''track subscription changes reported by an XPUB socket'''
+        hint_requested = False
+        while True:
+            try:
+                msg = sock_pub.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+
+            if not msg:
+                continue
+
+            subscribe = msg[0] == '\x01'
+            prefix = msg[1:]
+            if subscribe and prefix == SUBSCRIPTIONS_PREFIX:
+                hint_requested = True  # a new client wants the current state
+            elif subscribe and len(prefix) >= 2:
+                self.publish_cached(sock_pub, prefix)
+            with self.stats_lock:
+                count = self.subscriptions.get(prefix, 0)
+                if subscribe:
+                    count += 1
+                elif self.xpub_verboser:
+                    count -= 1
+                else:
+                    count = 0  # only the last unsubscribe is reported
+                self.subscriptions[prefix] = max(count, 0)
+
+        if self.update_subscribed() or hint_requested:
+            self.publish_subscriptions()
+
+    def update_subscribed(self):
+        '''recompute the subscribed event types, true if they or their
+        subscriber counts changed'''
+        subscribed_all = self.recorder is not None
+        subscribed_counts = {}
+        with self.stats_lock:
+            for prefix, count in self.subscriptions.items():
+                if count <= 0:
+                    continue
+                if len(prefix) < 2:
+                    # matches many (or all) types, don't drop anything
+                    subscribed_all = True
+                else:
+                    event_type_id = struct.unpack('>h', prefix[:2])[0]
+                    subscribed_counts[event_type_id] = \
+                        subscribed_counts.get(event_type_id, 0) + count
+
+        changed = subscribed_all != self.subscribed_all or \
+            subscribed_counts != self.subscribed_counts
+        self.subscribed_all = subscribed_all
+        self.subscribed_ids = frozenset(subscribed_counts.keys())
+        self.subscribed_counts = subscribed_counts
+        return changed
+
+    def publish_subscriptions(self):
+        '''tell clients which event types have subscribers, and how many
+
+        Catch-all subscriptions only set 'all' and are not counted per type.
+        '''
+        types = sorted(event_type_id
+                       for event_type_id in self.subscribed_ids
+                       if event_type_id >= revent.EVT_TYPE_FIRST_ID)
+        hint = {'all': self.subscribed_all,
+                'types': types,
+                'subscribers': [self.subscribed_counts[event_type_id]
+                                for event_type_id in types]}
+        evt = revent.RCoreEventBuilder(revent.EVT_TYPE_MGT_SUBSCRIPTIONS) \
+            .add(hint).build()
+        self.sock_pub.send(evt.serialize(), copy=False)
+
+    def publish_cached(self, sock_pub, prefix):
+        '''republish the cached event matching a new subscription'''
+        if self.cache is None:
+            return
+        frames = self.cache.get(struct.unpack('>h', prefix[:2])[0])
+        if frames is not None and \
+                memoryview(frames[0])[:len(prefix)].tobytes() == prefix:
+            sock_pub.send_multipart(frames, copy=False)
+
+    def is_subscribed(self, event_type_id):
+        return self.subscribed_all or event_type_id in self.subscribed_ids
+
+    def record_dropped(self, event_type_id, messages):
+        '''count messages dropped for lack of subscribers'''
+        with self.stats_lock:
+            self.stats_for(event_type_id)['dropped'] += messages
+
+    def stats_for(self, event_type_id):
+        '''return the stats of an event type, stats_lock must be held'''
+        stats = self.topic_stats.get(event_type_id)
+        if stats is None:
+            stats = {'messages': 0,
+                     'bytes': 0,
+                     'dropped': 0,
+                     'publishers': set(),
+                     'latency': rstats.RCoreHistogram()}
+            self.topic_stats[event_type_id] = stats
+        return stats
+
+    def record_publishers(self, events):
+        '''add the publishers of events with headers to their type's stats
+        '''
+        with self.stats_lock:
+            for evt in events:
+                if evt.header is not None:
+                    self.stats_for(evt.eventType.id)['publishers'].add(
+                        evt.header[0])
+
+    def record_routed(self, event_type_id, messages, frames, start):
+        '''add routed messages to the stats of an event type'''
+        elapsed = int((time.time() - start) * 1e6)
+        size = 0
+        for frame in frames:
+            size += len(frame)
+
+        with self.stats_lock:
+            stats = self.stats_for(event_type_id)
+            stats['messages'] += messages
+            stats['bytes'] += size
+            stats['latency'].record(elapsed, messages)
+
+    def read_stats(self):
+        '''return routing stats per event type name
+
+        latency_us is the time in microseconds from receiving a message to
+        publishing it, subscribers the current number of subscriptions,
+        dropped the messages received while there were no subscribers.
+        publishers is the number of distinct publisher ids seen, only known
+        for event types with the header option, None for others.
+        cache holds the size of the last value cache, None if disabled.
+        unknown counts the data messages dropped for an unknown type id.
+        '''
+        with self.lock:
+            event_types = [event_type
+                           for event_type in self.types_by_id.values()
+                           if event_type.id >= revent.EVT_TYPE_FIRST_ID]
+
+        types = {}
+        with self.stats_lock:
+            all_subscribers = self.subscriptions.get('', 0)
+            for event_type in event_types:
+                prefix = struct.pack('>h', event_type.id)
+                stats = self.topic_stats.get(event_type.id)
+                types[event_type.name] = {
+                    'id': event_type.id,
+                    'messages': stats['messages'] if stats else 0,
+                    'bytes': stats['bytes'] if stats else 0,
+                    'dropped': stats['dropped'] if stats else 0,
+                    'publishers': (len(stats['publishers']) if stats else 0)
+                    if event_type.header else None,
+                    'subscribers': self.subscriptions.get(prefix, 0) +
+                    all_subscribers,
+                    'latency_us': stats['latency'].snapshot()
+                    if stats else None
+                }
+
+            unknown = self.unknown_dropped
+
+        return {'uptime': time.time() - self.started if self.started else 0,
+                'cache': self.cache.stats() if self.cache else None,
+                'unknown': unknown,
+                'types': types}
+
+    def parse_data_events(self, frames):
+        '''parse events from a data message, dropping unknown types'''
+        # single dict lookups are atomic, no need to take the registry lock
+        events = revent.RCoreEvent \
+            .from_frames(frames,
+                         lambda id: self.types_by_id.get(id))
+
+        if events[-1].eventType is None:
+            with self.stats_lock:
+                self.unknown_dropped += 1
+            events.pop()
+
+        return events
+
+    def process_batch(self, events, start):
+        '''route a batch of events, one multipart message per event type
+
+        Subscribers filter on the first frame only, so a batch is split
+        into runs of a single event type before publishing.
+        '''
+        batches = {}
+        counts = {}
+        priorities = {}
+        batch_ids = []
+        for evt in events:
+            event_type_id = evt.eventType.id
+            if event_type_id not in batches:
+                batches[event_type_id] = []
+                counts[event_type_id] = 0
+                priorities[event_type_id] = evt.eventType.priority
+                batch_ids.append(event_type_id)
+            batches[event_type_id].extend(evt.serialize_frames())
+            counts[event_type_id] += 1
+
+        for event_type_id in batch_ids:
+            if not self.is_subscribed(event_type_id):
+                self.record_dropped(event_type_id, counts[event_type_id])
+                continue
+            frames = batches[event_type_id]
+            self.sock_pubs[priorities[event_type_id]].send_multipart(
+                frames, copy=False)
+            if self.recorder is not None and \
+                    not self.types_by_id[event_type_id].shmCount:
+                self.recorder.record(start, event_type_id, frames)
+            self.record_routed(event_type_id, counts[event_type_id], frames,
+                               start)
 
     def process_register_event_type(self, evt):
         '''process the registering of event type'''
         reader = evt.reader()
         name = reader.read()
-        data_types = [i for i in reader.read()]  # turns bytearray into int arra
+        # turns bytea into int array
+        data_types = list(bytearray(reader.read()))
+        options = reader.read()
 
         event_type_id = None
 
-        if self.event_type_exists(name, data_types):
-            event_type = self.types_by_name[name]
-            event_type_id = event_type.id
+        with self.lock:
+            if self.event_type_exists(name, data_types, options):
+                event_type = self.types_by_name[name]
+                event_type_id = event_type.id
+                is_new = False
+            else:
+                event_type_id = self.nextId
+                self.nextId += 1
+
+                event_type = revent.RCoreEventType(name, data_types,
+                                                   event_type_id,
+                                                   options=options)
+
+                self.types_by_name[event_type.name] = event_type
+                self.types_by_id[event_type.id] = event_type
+                self.version += 1
+                self.type_versions[event_type.id] = self.version
+                is_new = True
+
+                if self.registry_path is not None:
+                    revent.save_registry(self.registry_path,
+                                         self.list_event_types(0))
+                if self.recorder is not None:
+                    self.recorder.save_types(self.list_event_types(0))
+
+        if not is_new:
             print 'Registered existing event type %s [%d]' % (event_type.name, event_type.id)
         else:
-            event_type_id = self.nextId
-            self.nextId += 1
-
-            event_type = revent.RCoreEventType(name, data_types, event_type_id)
-
-            self.types_by_name[event_type.name] = event_type
-            self.types_by_id[event_type.id] = event_type
-
             print 'Registered event type %s [id=%d] [types=%s]' % (event_type.name, event_type.id, '|'.join([str(t) for t in data_types]))
 
         return revent.RCoreEventBuilder(
             revent.EVT_TYPE_MGT_REGISTER_EVENT_TYPE_RESP).add(event_type_id).build()
 
-    def event_type_exists(self, name, data_types):
+    def list_event_types(self, since):
+        '''return the event type catalog, registered after version since
+
+        The whole catalog is returned (full) when since is 0, or is newer
+        than this registry, e.g. after a master restart without a
+        persistent registry.
+        '''
+        with self.lock:
+            full = since <= 0 or since > self.version
+            if full:
+                since = 0
+
+            entries = [revent.event_type_entry(self.types_by_id[event_type_id],
+                                               version)
+                       for event_type_id, version in self.type_versions.items()
+                       if version > since]
+
+            return {'registry': self.registry_id,
+                    'version': self.version,
+                    'full': full,
+                    'types': entries}
+
+    def load_registry(self):
+        '''load event types persisted in registry_path, keeping their ids'''
+        catalog = revent.load_registry(self.registry_path)
+        if catalog is None:
+            return
+
+        with self.lock:
+            self.registry_id = catalog['registry']
+            self.version = catalog['version']
+            for entry in sorted(catalog['types'],
+                                key=lambda entry: entry['version']):
+                event_type = revent.RCoreEventType(
+                    entry['name'], entry['dataTypes'], entry['id'],
+                    options=entry.get('options'))
+                self.types_by_name[event_type.name] = event_type
+                self.types_by_id[event_type.id] = event_type
+                self.type_versions[event_type.id] = entry['version']
+                self.nextId = max(self.nextId, event_type.id + 1)
+
+        print 'Loaded %d event types from %s' % (len(catalog['types']),
+                                                  self.registry_path)
+
+    def event_type_exists(self, name, data_types, options):
         return name in self.types_by_name and \
-            self.event_data_types_match(self.types_by_name[name], data_types)
+            self.event_data_types_match(self.types_by_name[name], data_types) \
+            and revent.layout_options(self.types_by_name[name].options) == \
+            revent.layout_options(options)
 
     def event_data_types_match(self, event_type, data_types):
         if len(event_type.dataTypes) == len(data_types):
@@ -145,13 +743,16 @@ class RCoreMaster(object):
         reader = evt.reader()
         name = reader.read()
 
-        if name in self.types_by_name:
-            eventType = self.types_by_name[name]
+        with self.lock:
+            eventType = self.types_by_name.get(name)
+
+        if eventType is not None:
             return revent.RCoreEventBuilder(
                 revent.EVT_TYPE_MGT_READ_EVENT_TYPE_RESP) \
                 .add(eventType.id) \
                 .add(eventType.name) \
                 .add(bytearray(eventType.dataTypes)) \
+                .add(eventType.options) \
                 .build()
         else:
             return revent.RCoreEventBuilder(
@@ -159,30 +760,62 @@ class RCoreMaster(object):
                 .add(-1) \
                 .add('NOT_FOUND') \
                 .add(bytearray([])) \
+                .add({}) \
                 .build()
 
-    def process_event(self, evt, data):
-        # TODO: INSPECT EVENT, VERIFY NOT LOCKED, ETC
+    def process_read_cache(self, evt):
+        '''return the cached events of the requested type names, or all'''
+        names = evt.reader().read()
+        event_type_ids = None
+        if names is not None:
+            with self.lock:
+                event_type_ids = [self.types_by_name[name].id
+                                  for name in names
+                                  if name in self.types_by_name]
+
+        messages = self.cache.snapshot(event_type_ids) if self.cache else []
+        return revent.RCoreEventBuilder(
+            revent.EVT_TYPE_MGT_READ_CACHE_RESP) \
+            .add(revent.pack_messages(messages)) \
+            .build()
 
-        self.sock_pub.send(data)
+    def process_event(self, evt):
+        # TODO: INSPECT EVENT, VERIFY NOT LOCKED, ETC
 
-        return MGT_EVENT_RESP
+        frames = evt.serialize_frames()
+        self.sock_pubs[evt.eventType.priority].send_multipart(frames,
+                                                              copy=False)
+        # shared memory descriptors mean nothing outside this host and run
+        if self.recorder is not None and not evt.eventType.shmCount:
+            self.recorder.record(time.time(), evt.eventType.id, frames)
 
 
 class RCoreMain(object):
-    def __init__(self):
+    def __init__(self, stats_interval=None, registry_path=None,
+                 transports=None, pub_hwm=None, record_path=None,
+                 cache_size=CACHE_SIZE):
         self.ctx = zmq.Context()
+        self.stats_interval = stats_interval
 
-        self.master = RCoreMaster(self.ctx)
+        self.master = RCoreMaster(self.ctx, registry_path=registry_path,
+                                  transports=transports, pub_hwm=pub_hwm,
+                                  record_path=record_path,
+                                  cache_size=cache_size)
 
     def run(self):
         self.master.start()
 
+        last_stats = time.time()
         running = True
         while running:
             try:
                 if self.master.isAlive():
                     time.sleep(1.0)
+                    if self.stats_interval and \
+                            time.time() - last_stats >= self.stats_interval:
+                        last_stats = time.time()
+                        print json.dumps(self.master.read_stats(),
+                                         sort_keys=True)
                 else:
                     running = False
             except KeyboardInterrupt:
@@ -193,7 +826,36 @@ class RCoreMain(object):
 
 
 def main():
-    rcoreMain = RCoreMain()
+    parser = argparse.ArgumentParser(description='RobotCore master daemon')
+    parser.add_argument('--stats-interval', type=float,
+                        help='print routing stats every N seconds')
+    parser.add_argument('--registry',
+                        help='persist event types to this file, so ids are '
+                        'kept across restarts')
+    parser.add_argument('--transports',
+                        help='comma separated transports to bind, '
+                        'default tcp,inproc,ipc')
+    parser.add_argument('--pub-hwm', type=int,
+                        help='max events queued per subscriber, later '
+                        'events are dropped, default zmq\'s 1000')
+    parser.add_argument('--record',
+                        help='record published events to this directory, '
+                        'replay them with rcorelog.py')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                        help='bytes of events kept for event types with '
+                        'the cache option, 0 disables the cache')
+    args = parser.parse_args()
+
+    transports = None
+    if args.transports:
+        transports = args.transports.split(',')
+
+    rcoreMain = RCoreMain(stats_interval=args.stats_interval,
+                          registry_path=args.registry,
+                          transports=transports,
+                          pub_hwm=args.pub_hwm,
+                          record_path=args.record,
+                          cache_size=args.cache_size)
     rcoreMain.run()
 
 
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+test_bridge.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+
+Tests for rcorelib.bridge.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'rcorelib'))
+
+import rcorelib.bridge as rbridge
+import rcorelib.event as revent
+
+
+class FakeClient(object):
+    '''a master's event types, without any sockets'''
+    def __init__(self, publisherId, nextId):
+        self.sockHints = object()
+        self.publisherId = publisherId
+        self.sequences = {}
+        self.typesById = {}
+        self.nextId = nextId
+        self.sent = []
+
+    def get_event_type_by_id(self, eventTypeId):
+        return self.typesById.get(eventTypeId)
+
+    def read_event_type(self, name):
+        for eventType in self.typesById.values():
+            if eventType.name == name:
+                return eventType
+        return None
+
+    def register_event_type(self, eventType):
+        eventType.id = self.nextId
+        self.nextId += 1
+        self.typesById[eventType.id] = eventType
+        return eventType
+
+    def send_frames(self, frames, priority=revent.PRIORITY_NORMAL):
+        self.sent.append([bytes(bytearray(frame)) for frame in frames])
+
+
+def header_type(name, dataTypes=[revent.MSG_DATA_TYPE_INT]):
+    return revent.RCoreEventType(name, dataTypes, options={'header': True})
+
+
+class BridgeTest(unittest.TestCase):
+    def setUp(self):
+        self.a = FakeClient(1, 100)
+        self.b = FakeClient(2, 200)
+        self.bridge = rbridge.RCoreBridge([self.a, self.b])
+
+    def test_translate_registers(self):
+        pose = self.a.register_event_type(header_type('pose'))
+        translated = self.bridge.translate(0, 1, pose.id)
+        self.assertEqual(translated, 200)
+        self.assertEqual(self.b.typesById[200].name, 'pose')
+        self.assertEqual(self.bridge.translate(0, 1, pose.id), 200)
+        self.assertEqual(len(self.b.typesById), 1)
+
+    def test_translate_existing(self):
+        self.b.register_event_type(header_type('other'))
+        self.b.register_event_type(header_type('pose'))
+        pose = self.a.register_event_type(header_type('pose'))
+        self.assertEqual(self.bridge.translate(0, 1, pose.id), 201)
+
+    def test_not_bridged(self):
+        plain = self.a.register_event_type(revent.RCoreEventType(
+            'plain', [revent.MSG_DATA_TYPE_INT]))
+        shm = self.a.register_event_type(header_type(
+            'image', [revent.MSG_DATA_TYPE_SHM_BYTEA]))
+        clash = self.a.register_event_type(header_type('clash'))
+        self.b.register_event_type(header_type(
+            'clash', [revent.MSG_DATA_TYPE_STRING]))
+        for eventType in [plain, shm, clash]:
+            self.assertIsNone(self.bridge.translate(0, 1, eventType.id))
+        self.assertEqual(self.bridge.stats()[0]['unbridged'], 3)
+
+    def test_forward_restamps(self):
+        pose = self.a.register_event_type(header_type('pose'))
+        self.bridge.routes[0] = {pose.id: [(1, 200)]}
+        evt = pose.encode(5)
+        evt.stamp(77, 9, published=1234)
+        self.bridge.forward(0, evt.serialize_frames(), 0.0)
+        self.bridge.flush(1)
+
+        frame = self.b.sent[0][0]
+        self.assertEqual(revent.EVENT_TYPE_ID_STRUCT.unpack_from(frame)[0],
+                         200)
+        header = revent.EVENT_HEADER_STRUCT.unpack_from(
+            frame, revent.EVENT_TYPE_ID_STRUCT.size)
+        self.assertEqual(header, (self.b.publisherId, 1, 1234, 0))
+        self.assertEqual(self.bridge.stats()[1]['forwarded'], 1)
+
+    def test_forward_drops_echoes(self):
+        pose = self.b.register_event_type(header_type('pose'))
+        self.bridge.routes[1] = {pose.id: [(0, 100)]}
+        echo = pose.encode(5)
+        echo.stamp(self.b.publisherId, 1)
+        other = pose.encode(5)
+        other.stamp(3, 1)  # another bridge's, forwarded as usual
+        for evt in [echo, other, other]:
+            self.bridge.forward(1, evt.serialize_frames(), 0.0)
+        self.bridge.flush(0)
+
+        self.assertEqual(len(self.a.sent[0]), 2)
+        self.assertEqual(self.bridge.stats()[1]['echoes'], 1)
+
+    def test_forward_unknown(self):
+        self.bridge.forward(0, [revent.EVENT_TYPE_ID_STRUCT.pack(999)], 0.0)
+        self.assertEqual(self.bridge.stats()[0]['unknown'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
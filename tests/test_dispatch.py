@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+test_dispatch.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+
+Tests for rcorelib.dispatch.
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'rcorelib'))
+
+import rcorelib.dispatch as rdispatch
+
+WAIT_TIMEOUT = 5.0
+
+
+class FakeType(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeEvent(object):
+    def __init__(self, name, value):
+        self.eventType = FakeType(name)
+        self.value = value
+
+
+def wait_for(condition):
+    deadline = time.time() + WAIT_TIMEOUT
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out waiting")
+        time.sleep(0.005)
+
+
+class DispatcherTest(unittest.TestCase):
+    def tearDown(self):
+        self.dispatcher.stop()
+
+    def test_per_type_order(self):
+        self.dispatcher = rdispatch.RCoreDispatcher(workers=4)
+        self.dispatcher.start()
+        seen = {'a': [], 'b': []}
+        listener = lambda evt: seen[evt.eventType.name].append(evt.value)
+        for i in range(200):
+            self.dispatcher.dispatch(FakeEvent('a', i), [listener])
+            self.dispatcher.dispatch(FakeEvent('b', i), [listener])
+        wait_for(lambda: len(seen['a']) == 200 and len(seen['b']) == 200)
+        self.assertEqual(seen['a'], range(200))
+        self.assertEqual(seen['b'], range(200))
+
+    def test_drop_oldest(self):
+        self.dispatcher = rdispatch.RCoreDispatcher(
+            workers=1, maxQueueSize=2,
+            policy=rdispatch.DISPATCH_POLICY_DROP_OLDEST)
+        release = threading.Event()
+        seen = []
+
+        def listener(evt):
+            release.wait(WAIT_TIMEOUT)
+            seen.append(evt.value)
+
+        self.dispatcher.start()
+        self.dispatcher.dispatch(FakeEvent('a', 0), [listener])
+        wait_for(lambda: self.dispatcher.stats()['a']['pending'] == 0)
+        for i in range(1, 6):
+            self.dispatcher.dispatch(FakeEvent('a', i), [listener])
+        release.set()
+        wait_for(lambda: len(seen) == 3)
+        self.assertEqual(seen, [0, 4, 5])
+        stats = self.dispatcher.stats()['a']
+        self.assertEqual(stats['dropped'], 3)
+        self.assertEqual(stats['queued'], 6)
+
+    def test_block(self):
+        self.dispatcher = rdispatch.RCoreDispatcher(
+            workers=1, maxQueueSize=1, policy=rdispatch.DISPATCH_POLICY_BLOCK)
+        release = threading.Event()
+        seen = []
+
+        def listener(evt):
+            release.wait(WAIT_TIMEOUT)
+            seen.append(evt.value)
+
+        self.dispatcher.start()
+        self.dispatcher.dispatch(FakeEvent('a', 0), [listener])
+        wait_for(lambda: self.dispatcher.stats()['a']['pending'] == 0)
+        self.dispatcher.dispatch(FakeEvent('a', 1), [listener])
+
+        sender = threading.Thread(target=self.dispatcher.dispatch,
+                                  args=(FakeEvent('a', 2), [listener]))
+        sender.start()
+        time.sleep(0.05)
+        self.assertTrue(sender.isAlive())  # waiting for room in the queue
+        release.set()
+        sender.join(WAIT_TIMEOUT)
+        wait_for(lambda: len(seen) == 3)
+        self.assertEqual(seen, [0, 1, 2])
+        self.assertEqual(self.dispatcher.stats()['a']['dropped'], 0)
+
+    def test_conflated_key(self):
+        self.dispatcher = rdispatch.RCoreDispatcher(workers=1)
+        self.dispatcher.configure('latest', 1,
+                                  rdispatch.DISPATCH_POLICY_DROP_OLDEST)
+        for i in range(10):
+            self.dispatcher.dispatch(FakeEvent('a', i), [], key='latest')
+        stats = self.dispatcher.stats()
+        self.assertEqual(stats['latest']['pending'], 1)
+        self.assertEqual(stats['latest']['dropped'], 9)
+        self.assertNotIn('a', stats)
+
+    def test_configured_policy(self):
+        self.dispatcher = rdispatch.RCoreDispatcher(
+            workers=1, maxQueueSize=1, policy=rdispatch.DISPATCH_POLICY_BLOCK)
+        self.dispatcher.configure('burst', 3,
+                                  rdispatch.DISPATCH_POLICY_DROP_OLDEST)
+        for i in range(5):
+            self.dispatcher.dispatch(FakeEvent('a', i), [], key='burst')
+        stats = self.dispatcher.stats()['burst']
+        self.assertEqual(stats['pending'], 3)
+        self.assertEqual(stats['dropped'], 2)
+
+    def test_invalid_queue_size(self):
+        self.dispatcher = rdispatch.RCoreDispatcher()
+        self.assertRaises(Exception, rdispatch.RCoreDispatcher,
+                          maxQueueSize=0)
+        self.assertRaises(Exception, self.dispatcher.configure, 'a', 0)
+
+    def test_invalid_policy(self):
+        self.dispatcher = rdispatch.RCoreDispatcher()
+        self.assertRaises(Exception, rdispatch.RCoreDispatcher,
+                          policy='nope')
+        self.assertRaises(Exception, self.dispatcher.configure, 'a',
+                          policy='nope')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+test_event.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+
+Tests for the rcorelib.event codec.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'rcorelib'))
+
+import rcorelib.event as revent
+
+
+def build_type(name, dataTypes, id=100, options=None):
+    return revent.RCoreEventType(name, dataTypes, id=id, options=options)
+
+
+class CodecTest(unittest.TestCase):
+    def setUp(self):
+        self.eventType = build_type('mixed', [
+            revent.MSG_DATA_TYPE_BYTE,
+            revent.MSG_DATA_TYPE_INT,
+            revent.MSG_DATA_TYPE_STRING,
+            revent.MSG_DATA_TYPE_LONG,
+            revent.MSG_DATA_TYPE_FLOAT,
+            revent.MSG_DATA_TYPE_DOUBLE,
+            revent.MSG_DATA_TYPE_JSON,
+            revent.MSG_DATA_TYPE_BYTEA])
+        self.values = [7, -12, 'hello', 1 << 30, 0.5, 3.25,
+                       {'a': [1, 2]}, 'tail']
+
+    def test_encode_decode(self):
+        evt = self.eventType.encode(*self.values)
+        values = self.eventType.decode(evt.data)
+        self.assertEqual(values[:7], self.values[:7])
+        self.assertEqual(bytes(values[7]), 'tail')
+
+    def test_builder_matches_encode(self):
+        builder = revent.RCoreEventBuilder(self.eventType)
+        for value in self.values:
+            builder.add(value)
+        self.assertEqual(bytes(builder.build().data),
+                         bytes(self.eventType.encode(*self.values).data))
+
+    def test_reader(self):
+        reader = self.eventType.encode(*self.values).reader()
+        for value in self.values[:7]:
+            self.assertEqual(reader.read(), value)
+        self.assertEqual(bytes(reader.read()), 'tail')
+        self.assertRaises(Exception, reader.read)
+
+    def test_from_data(self):
+        data = self.eventType.encode(*self.values).serialize()
+        evt = revent.RCoreEvent.from_data(
+            data, {self.eventType.id: self.eventType}.get)
+        self.assertIs(evt.eventType, self.eventType)
+        self.assertEqual(evt.decode()[:7], self.values[:7])
+
+    def test_fixed_types_share_a_struct(self):
+        eventType = build_type('fixed', [revent.MSG_DATA_TYPE_INT,
+                                         revent.MSG_DATA_TYPE_DOUBLE,
+                                         revent.MSG_DATA_TYPE_BYTE])
+        self.assertEqual(len(eventType.segments), 1)
+        self.assertEqual(eventType.fixedSize, 13)
+        evt = eventType.encode(1, 2.5, 3)
+        self.assertEqual(len(evt.data), 13)
+        self.assertEqual(eventType.decode(evt.data), [1, 2.5, 3])
+
+    def test_var_field_lengths(self):
+        eventType = build_type('strings', [revent.MSG_DATA_TYPE_STRING,
+                                           revent.MSG_DATA_TYPE_STRING,
+                                           revent.MSG_DATA_TYPE_INT])
+        for values in [['', '', 0], ['a' * 1000, 'b', 5]]:
+            self.assertEqual(eventType.decode(eventType.encode(*values).data),
+                             values)
+
+    def test_wrong_value_count(self):
+        self.assertRaises(Exception, self.eventType.encode, 1, 2)
+
+
+class NamedFieldTest(unittest.TestCase):
+    def setUp(self):
+        builder = revent.RCoreEventTypeBuilder('reading')
+        builder.add_int('seq').add_string('label').add_double()
+        builder.add_json('meta').add_long('stamp')
+        self.eventType = builder.build()
+        self.eventType.id = 100
+        self.values = [3, 'left', 0.25, {'unit': 'm'}, 42]
+
+    def test_lookup(self):
+        evt = self.eventType.encode(*self.values)
+        self.assertEqual(evt['seq'], 3)
+        self.assertEqual(evt['label'], 'left')
+        self.assertEqual(evt[2], 0.25)
+        self.assertEqual(evt['meta'], {'unit': 'm'})
+        self.assertEqual(evt['stamp'], 42)
+        self.assertEqual(evt[-1], 42)
+
+    def test_lookup_out_of_order(self):
+        data = self.eventType.encode(*self.values).serialize()
+        evt = revent.RCoreEvent.from_data(
+            data, {self.eventType.id: self.eventType}.get)
+        self.assertEqual(evt['stamp'], 42)
+        self.assertEqual(evt['label'], 'left')
+        self.assertEqual(evt['seq'], 3)
+
+    def test_offsets(self):
+        self.assertEqual(self.eventType.offsets, [0, 4, None, None, None])
+        evt = self.eventType.encode(*self.values)
+        self.assertEqual(evt.field_offset(2), 4 + 4 + len('left'))
+
+    def test_missing_fields(self):
+        evt = self.eventType.encode(*self.values)
+        self.assertRaises(KeyError, lambda: evt['missing'])
+        self.assertRaises(IndexError, lambda: evt[5])
+        self.assertRaises(IndexError, lambda: evt[-6])
+
+    def test_duplicate_names(self):
+        builder = revent.RCoreEventTypeBuilder('reading').add_int('seq')
+        self.assertRaises(Exception, builder.add_int, 'seq')
+        self.assertRaises(Exception, build_type, 'reading',
+                          [revent.MSG_DATA_TYPE_INT] * 2,
+                          options={'names': ['seq', 'seq']})
+
+    def test_names_not_in_layout(self):
+        unnamed = build_type('reading', self.eventType.dataTypes)
+        self.assertEqual(revent.layout_options(unnamed.options),
+                         revent.layout_options(self.eventType.options))
+        self.assertNotIn('names', unnamed.options)
+
+
+class BufferTest(unittest.TestCase):
+    def setUp(self):
+        self.eventType = build_type('pose', [revent.MSG_DATA_TYPE_DOUBLE,
+                                             revent.MSG_DATA_TYPE_STRING])
+        self.data = bytearray(self.eventType.encode(1.5, 'x').serialize())
+
+    def test_from_buffer(self):
+        evt = revent.RCoreEvent.from_buffer(
+            self.data, {self.eventType.id: self.eventType}.get)
+        self.assertIs(evt.eventType, self.eventType)
+        self.assertEqual(evt.decode(), [1.5, 'x'])
+
+    def test_from_buffer_does_not_copy(self):
+        evt = revent.RCoreEvent.from_buffer(
+            self.data, {self.eventType.id: self.eventType}.get)
+        self.data[-1] = ord('y')
+        self.assertEqual(evt.reader().read(), 1.5)
+        self.assertEqual(evt.data[-1:].tobytes(), 'y')
+
+    def test_unknown_type(self):
+        evt = revent.RCoreEvent.from_buffer(self.data, {}.get)
+        self.assertIsNone(evt.eventType)
+
+
+@unittest.skipIf(revent.numpy is None, 'numpy is not installed')
+class CompressionTest(unittest.TestCase):
+    def build(self, codec='zlib', minSize=revent.COMPRESSION_MIN_SIZE):
+        builder = revent.RCoreEventTypeBuilder('compressed')
+        builder.add_int().add_json().add_bytea()
+        builder.with_compression(codec, minSize)
+        return builder.build()
+
+    def flag(self, evt):
+        # the codec flag of the bytea field, after the int and json fields
+        offset = 4
+        offset += revent.VAR_LENGTH_STRUCT.size + \
+            revent.VAR_LENGTH_STRUCT.unpack_from(evt.data, offset)[0]
+        return revent.COMPRESSION_FLAG_STRUCT.unpack_from(evt.data, offset)[0]
+
+    def test_zlib_round_trip(self):
+        eventType = self.build()
+        payload = 'abcd' * 1000
+        doc = {'values': range(200)}
+        evt = eventType.encode(1, doc, payload)
+        self.assertTrue(len(evt.data) < len(payload))
+        values = eventType.decode(evt.data)
+        self.assertEqual(values[:2], [1, doc])
+        self.assertEqual(bytes(values[2]), payload)
+
+    def test_small_values_uncompressed(self):
+        eventType = self.build()
+        evt = eventType.encode(1, [], 'tiny')
+        self.assertEqual(self.flag(evt), revent.COMPRESSION_NONE)
+        self.assertEqual(bytes(eventType.decode(evt.data)[2]), 'tiny')
+
+    def test_incompressible_values_uncompressed(self):
+        eventType = self.build(minSize=0)
+        payload = os.urandom(512)
+        evt = eventType.encode(1, [], payload)
+        self.assertEqual(self.flag(evt), revent.COMPRESSION_NONE)
+        self.assertEqual(bytes(eventType.decode(evt.data)[2]), payload)
+
+    def test_codec_flag(self):
+        evt = self.build().encode(1, [], 'x' * 1024)
+        self.assertEqual(self.flag(evt), revent.COMPRESSION_ZLIB)
+
+    def test_lz4(self):
+        evt = self.build('lz4').encode(1, [], 'x' * 1024)
+        if revent.lz4block is None:
+            # falls back to zlib
+            self.assertEqual(self.flag(evt), revent.COMPRESSION_ZLIB)
+        else:
+            self.assertEqual(self.flag(evt), revent.COMPRESSION_LZ4)
+        self.assertEqual(bytes(evt.decode()[2]), 'x' * 1024)
+
+    def test_unknown_codec(self):
+        builder = revent.RCoreEventTypeBuilder('compressed').add_bytea()
+        self.assertRaises(Exception, builder.with_compression, 'snappy')
+        self.assertRaises(Exception, build_type, 'compressed',
+                          [revent.MSG_DATA_TYPE_BYTEA],
+                          options={'compression': {'codec': 'snappy'}})
+
+
+class NdarrayTest(unittest.TestCase):
+    def setUp(self):
+        self.eventType = build_type('image', [revent.MSG_DATA_TYPE_INT,
+                                              revent.MSG_DATA_TYPE_NDARRAY,
+                                              revent.MSG_DATA_TYPE_STRING])
+        self.types = {self.eventType.id: self.eventType}.get
+
+    def test_frames_round_trip(self):
+        array = revent.numpy.arange(12, dtype='<f4').reshape(3, 4)
+        frames = self.eventType.encode(3, array, 'cam').serialize_frames()
+        self.assertEqual(len(frames), 2)
+
+        evts = revent.RCoreEvent.from_frames(frames, self.types)
+        self.assertEqual(len(evts), 1)
+        number, received, name = evts[0].decode()
+        self.assertEqual((number, name), (3, 'cam'))
+        self.assertEqual(received.dtype, array.dtype)
+        self.assertTrue((received == array).all())
+
+    def test_non_contiguous(self):
+        array = revent.numpy.arange(16).reshape(4, 4)[:, 1]
+        frames = self.eventType.encode(0, array, '').serialize_frames()
+        received = revent.RCoreEvent.from_frames(
+            frames, self.types)[0].decode()[1]
+        self.assertTrue((received == array).all())
+
+    def test_several_events_per_message(self):
+        frames = []
+        for i in range(3):
+            frames.extend(self.eventType.encode(
+                i, revent.numpy.zeros(i + 1), str(i)).serialize_frames())
+        evts = revent.RCoreEvent.from_frames(frames, self.types)
+        self.assertEqual([evt.decode()[0] for evt in evts], [0, 1, 2])
+        self.assertEqual([len(evt.decode()[1]) for evt in evts], [1, 2, 3])
+
+    def test_unknown_type_stops_parsing(self):
+        frames = self.eventType.encode(
+            0, revent.numpy.zeros(2), '').serialize_frames()
+        evts = revent.RCoreEvent.from_frames(frames * 2, {}.get)
+        self.assertEqual(len(evts), 1)
+        self.assertIsNone(evts[0].eventType)
+
+
+@unittest.skipIf(revent.numpy is None, 'numpy is not installed')
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.eventType = build_type(
+            'pose', [revent.MSG_DATA_TYPE_INT, revent.MSG_DATA_TYPE_DOUBLE],
+            options={'names': ['seq', 'x'], 'header': True})
+
+    def test_encode_decode_batch(self):
+        evts = self.eventType.encode_batch([(1, 0.5), (2, 1.5), (3, 2.5)])
+        self.assertEqual([evt.decode() for evt in evts],
+                         [[1, 0.5], [2, 1.5], [3, 2.5]])
+        array = self.eventType.decode_batch(evts)
+        self.assertEqual(list(array['seq']), [1, 2, 3])
+        self.assertEqual(list(array['x']), [0.5, 1.5, 2.5])
+
+    def test_encode_structured_array(self):
+        values = revent.numpy.array([(4, 1.0), (5, 2.0)],
+                                    dtype=[('a', '<i4'), ('b', '<f8')])
+        evts = self.eventType.encode_batch(values)
+        self.assertEqual([evt.decode() for evt in evts], [[4, 1.0], [5, 2.0]])
+
+    def test_decode_buffer(self):
+        evts = self.eventType.encode_batch([(1, 0.5), (2, 1.5)])
+        for i, evt in enumerate(evts):
+            evt.stamp(7, i, published=100 + i)
+        data = bytes(b''.join([bytes(evt.serialize()) for evt in evts]))
+        array = self.eventType.decode_buffer(data)
+        self.assertEqual(list(array['id']), [self.eventType.id] * 2)
+        self.assertEqual(list(array['publisher']), [7, 7])
+        self.assertEqual(list(array['sequence']), [0, 1])
+        self.assertEqual(list(array['published']), [100, 101])
+        self.assertEqual(list(array['seq']), [1, 2])
+
+    def test_decode_buffer_other_type(self):
+        other = build_type('other', self.eventType.dataTypes, id=101,
+                           options={'header': True})
+        data = bytes(other.encode(1, 0.5).serialize())
+        self.assertRaises(Exception, self.eventType.decode_buffer, data)
+
+    def test_zero_fields(self):
+        eventType = build_type('tick', [])
+        evts = eventType.encode_batch([(), ()])
+        self.assertEqual(len(evts), 2)
+        self.assertEqual([evt.decode() for evt in evts], [[], []])
+
+    def test_variable_length_rejected(self):
+        eventType = build_type('log', [revent.MSG_DATA_TYPE_STRING])
+        self.assertRaises(Exception, eventType.numpy_dtype)
+
+    def test_reserved_names(self):
+        for name in revent.EVENT_RESERVED_FIELD_NAMES:
+            self.assertRaises(Exception, build_type, 'pose',
+                              [revent.MSG_DATA_TYPE_INT],
+                              options={'names': [name]})
+
+
+if __name__ == '__main__':
+    unittest.main()
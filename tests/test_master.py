@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+test_master.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+
+Tests of event routing through an RCoreMaster over inproc transports.
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'rcorelib'))
+sys.path.insert(0, os.path.join(ROOT, 'rcoremaster'))
+
+import zmq
+
+import rcorelib
+import rcorelib.event as revent
+import rcoremaster
+
+WAIT_TIMEOUT = 5.0
+
+
+def wait_for(condition):
+    deadline = time.time() + WAIT_TIMEOUT
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out waiting")
+        time.sleep(0.005)
+
+
+class MasterTest(unittest.TestCase):
+    def setUp(self):
+        self.ctx = zmq.Context()
+        self.master = rcoremaster.RCoreMaster(self.ctx,
+                                              transports=['inproc'])
+        self.master.start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        threads = self.master.threads
+        self.master.stop()
+        self.ctx.term()
+        for thread in threads:
+            thread.join(WAIT_TIMEOUT)
+
+    def client(self, name):
+        client = rcorelib.RCoreClient(None, name, ctx=self.ctx,
+                                      transport=rcorelib.TRANSPORT_INPROC)
+        self.clients.append(client)
+        return client
+
+    def pose_type(self):
+        return revent.RCoreEventTypeBuilder('pose').add_int('seq') \
+            .add_string('frame').with_header().build()
+
+    def subscribe(self):
+        received = []
+        lock = threading.Lock()
+
+        def listener(evt):
+            with lock:
+                received.append(evt.decode())
+
+        subscriber = self.client('subscriber')
+        subscriber.register_event_types([self.pose_type()])
+        subscriber.register_listener('pose', listener)
+        subscriber.start()
+        return received
+
+    def test_routing(self):
+        received = self.subscribe()
+        publisher = self.client('publisher')
+        pose = publisher.register_event_type(self.pose_type())
+        wait_for(lambda: publisher.has_subscribers(pose))
+
+        for i in range(10):
+            publisher.send(pose.encode(i, 'map'))
+        publisher.send_many([pose.encode(i, 'odom') for i in range(10, 20)])
+        wait_for(lambda: len(received) == 20)
+        self.assertEqual([values[0] for values in received], range(20))
+        self.assertEqual(received[10][1], 'odom')
+
+        stats = publisher.read_stats()['types']['pose']
+        self.assertEqual(stats['messages'], 20)
+        self.assertEqual(stats['subscribers'], 1)
+        self.assertEqual(stats['publishers'], 1)
+
+    def test_unsubscribed_skipped(self):
+        publisher = self.client('publisher')
+        pose = publisher.register_event_type(self.pose_type())
+        publisher.send(pose.encode(0, 'map'))
+        self.assertEqual(publisher.skipped, 1)
+
+    def test_shared_type_ids(self):
+        first = self.client('first').register_event_type(self.pose_type())
+        second = self.client('second').register_event_type(self.pose_type())
+        self.assertEqual(first.id, second.id)
+        self.assertIsNotNone(self.clients[1].read_event_type('pose'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+test_recorder.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+
+Tests for rcorelib.recorder.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'rcorelib'))
+
+import rcorelib.event as revent
+import rcorelib.recorder as rrecorder
+
+
+class FakeClient(object):
+    '''assigns fresh type ids on registration, keeps what is sent'''
+    def __init__(self):
+        self.sent = []
+        self.nextId = 200
+
+    def register_event_type(self, eventType):
+        eventType.id = self.nextId
+        self.nextId += 1
+        return eventType
+
+    def send_frames(self, frames, priority=revent.PRIORITY_NORMAL):
+        self.sent.append(([bytes(bytearray(frame)) for frame in frames],
+                          priority))
+
+
+class RecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='rcorelog-')
+        self.pose = revent.RCoreEventType('pose', [revent.MSG_DATA_TYPE_INT],
+                                          id=100)
+        self.cmd = revent.RCoreEventType('cmd', [revent.MSG_DATA_TYPE_STRING],
+                                         id=101)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def record(self, count, segmentSize=rrecorder.LOG_SEGMENT_SIZE):
+        recorder = rrecorder.RCoreRecorder(self.path, segmentSize)
+        for i in range(count):
+            eventType = self.pose if i % 2 == 0 else self.cmd
+            evt = eventType.encode(i) if i % 2 == 0 else \
+                eventType.encode('c%d' % (i))
+            recorder.record(1000.0 + i, eventType.id,
+                            evt.serialize_frames())
+        recorder.save_types({'registry': 'test', 'version': 2, 'full': True,
+                             'types': [revent.event_type_entry(self.pose, 1),
+                                       revent.event_type_entry(self.cmd, 2)]})
+        recorder.close()
+        return rrecorder.RCoreLogReader(self.path)
+
+    def parse(self, frames):
+        types = {self.pose.id: self.pose, self.cmd.id: self.cmd}
+        return revent.RCoreEvent.from_frames(frames, types.get)[0].decode()
+
+    def test_entries(self):
+        reader = self.record(10)
+        entries = list(reader.entries())
+        self.assertEqual([entry[0] for entry in entries],
+                         [1000.0 + i for i in range(10)])
+        self.assertEqual(self.parse(entries[4][2]), [4])
+        self.assertEqual(self.parse(entries[5][2]), ['c5'])
+        self.assertEqual(reader.time_range(), (1000.0, 1009.0))
+        reader.close()
+
+    def test_seek_and_filter(self):
+        reader = self.record(10)
+        entries = list(reader.entries(start=1003.0, end=1008.0,
+                                      eventTypeIds=set([self.pose.id])))
+        self.assertEqual([entry[0] for entry in entries],
+                         [1004.0, 1006.0])
+        reader.close()
+
+    def test_segments(self):
+        reader = self.record(200, segmentSize=1024)
+        self.assertTrue(len(reader.segmentIds) > 1)
+        self.assertEqual(len(list(reader.entries())), 200)
+        entries = list(reader.entries(start=1150.5))
+        self.assertEqual(entries[0][0], 1151.0)
+        self.assertEqual(len(entries), 49)
+        reader.close()
+
+    def test_append(self):
+        self.record(4).close()
+        reader = self.record(4)
+        self.assertEqual(len(list(reader.entries())), 8)
+        reader.close()
+
+    def test_empty(self):
+        rrecorder.RCoreRecorder(self.path).close()
+        reader = rrecorder.RCoreLogReader(self.path)
+        self.assertIsNone(reader.time_range())
+        self.assertEqual(list(reader.entries()), [])
+
+    def test_replay_rewrites_ids(self):
+        reader = self.record(6)
+        client = FakeClient()
+        sent = rrecorder.replay(reader, client, speed=0,
+                                eventTypeNames=['cmd'])
+        self.assertEqual(sent, 3)
+        ids = set(revent.EVENT_TYPE_ID_STRUCT.unpack_from(frames[0])[0]
+                  for frames, priority in client.sent)
+        self.assertEqual(len(ids), 1)
+        self.assertNotIn(self.cmd.id, ids)
+        self.assertEqual(bytes(client.sent[0][0][0][2:]),
+                         bytes(self.cmd.encode('c1').data))
+        reader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+test_stats.py
+
+This file is part of RobotCore.
+
+RobotCore is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RobotCore is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with RobotCore.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Joseph Monti <joe.monti@gmail.com>
+@copyright: 2015 Joseph Monti All Rights Reserved, http://joemonti.org/
+
+Tests for rcorelib.stats.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'rcorelib'))
+
+import rcorelib.stats as rstats
+
+
+class HistogramTest(unittest.TestCase):
+    def test_small_values_are_exact(self):
+        histogram = rstats.RCoreHistogram(subBucketBits=5)
+        for value in range(32):
+            self.assertEqual(histogram.index(value), value)
+            self.assertEqual(histogram.value(histogram.index(value)), value)
+
+    def test_bucket_relative_error(self):
+        histogram = rstats.RCoreHistogram(subBucketBits=5)
+        last = -1
+        for value in [32, 33, 63, 64, 65, 1000, 123456, 10 ** 9]:
+            index = histogram.index(value)
+            high = histogram.value(index)
+            self.assertGreaterEqual(index, last)
+            self.assertGreaterEqual(high, value)
+            self.assertLessEqual(high - value, value / 32.0)
+            last = index
+
+    def test_bucket_boundaries(self):
+        histogram = rstats.RCoreHistogram(subBucketBits=5)
+        for index in range(32, 400):
+            high = histogram.value(index)
+            self.assertEqual(histogram.index(high), index)
+            self.assertEqual(histogram.index(high + 1), index + 1)
+
+    def test_percentiles(self):
+        histogram = rstats.RCoreHistogram()
+        for value in range(1, 101):
+            histogram.record(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 100)
+        self.assertEqual(snapshot['min'], 1)
+        self.assertEqual(snapshot['max'], 100)
+        self.assertEqual(snapshot['mean'], 50.5)
+        self.assertTrue(50 <= snapshot['p50'] <= 51)
+        self.assertTrue(90 <= snapshot['p90'] <= 93)
+        self.assertEqual(snapshot['p99_9'], 100)
+
+    def test_record_count_and_negative(self):
+        histogram = rstats.RCoreHistogram()
+        histogram.record(-5)
+        histogram.record(10, 3)
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.min, 0)
+        self.assertEqual(histogram.percentile(50), 10)
+
+    def test_empty(self):
+        snapshot = rstats.RCoreHistogram().snapshot()
+        self.assertEqual(snapshot['count'], 0)
+        self.assertIsNone(snapshot['mean'])
+        self.assertIsNone(snapshot['p50'])
+
+
+class ListenerStatsTest(unittest.TestCase):
+    def test_gaps_and_late(self):
+        stats = rstats.RCoreListenerStats()
+        for publisher, sequence in [(1, 1), (1, 2), (1, 5), (1, 4),
+                                    (2, 10), (2, 11), (1, 6)]:
+            stats.record((publisher, sequence, 100, 0), 150)
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['received'], 7)
+        self.assertEqual(snapshot['gaps'], 2)
+        self.assertEqual(snapshot['late'], 1)
+        self.assertEqual(snapshot['publishers'], 2)
+
+    def test_latency_and_delivery(self):
+        stats = rstats.RCoreListenerStats()
+        stats.record((1, 1, 1000, 0), 1500)
+        stats.record((1, 2, 1000, 1200), 1500)
+        self.assertEqual(stats.latency.count, 2)
+        self.assertEqual(stats.delivery.count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()